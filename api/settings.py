@@ -92,6 +92,13 @@ if DEBUG:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            # Con DEFERRED, dos transacciones que leen y luego escriben (p. ej. select_for_update, que SQLite
+            # ignora) fallan al instante con "database is locked"; IMMEDIATE toma el lock de escritura al
+            # empezar y la otra espera el timeout, como haría un SELECT ... FOR UPDATE en PostgreSQL
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+            # La base en memoria compartida de los tests bloquea por tabla sin esperar ("database table is
+            # locked"); los tests con hilos concurrentes necesitan una base en archivo (ignorada en git)
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
         }
     }
 else:
@@ -101,6 +108,92 @@ else:
         )
     }
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# With several gunicorn workers the catalog version must live in a shared backend,
+# set REDIS_URL (requires the `redis` package) to enable it.
+REDIS_URL = config("REDIS_URL", default="")
+
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Cache serialized catalog pages/products (they include price and stock). Catalog changes only reach
+# other workers through the shared version key, so it is on by default only with a shared backend.
+CATALOG_CACHE_ENABLED = config("CATALOG_CACHE_ENABLED", default=bool(REDIS_URL), cast=bool)
+
+# Seconds a serialized catalog page/product stays in cache (it is also dropped on catalog changes)
+CATALOG_CACHE_TIMEOUT = config("CATALOG_CACHE_TIMEOUT", default=60 * 15, cast=int)
+
+# Cache cart summaries. Like the catalog cache they are invalidated through version keys, so with a
+# per-process cache a change in one worker would not reach the others: on by default only with a shared backend.
+CART_SUMMARY_CACHE_ENABLED = config("CART_SUMMARY_CACHE_ENABLED", default=bool(REDIS_URL), cast=bool)
+
+# Seconds a cart summary stays in cache (it is also dropped when the cart lines or the catalog change)
+CART_SUMMARY_CACHE_TIMEOUT = config("CART_SUMMARY_CACHE_TIMEOUT", default=60 * 30, cast=int)
+
+# Cache the missing-items shopping list. The recomputation that invalidates it may run in another worker,
+# so it is on by default only with a shared backend.
+SHOPPING_LIST_CACHE_ENABLED = config("SHOPPING_LIST_CACHE_ENABLED", default=bool(REDIS_URL), cast=bool)
+
+# Seconds the aggregated missing-items shopping list stays in cache (it is also dropped on every recomputation)
+SHOPPING_LIST_CACHE_TIMEOUT = config("SHOPPING_LIST_CACHE_TIMEOUT", default=60 * 30, cast=int)
+
+# Inventory costing method used by the margin analytics (products.analytics.margins): FIFO or AVERAGE
+COGS_METHOD = config("COGS_METHOD", default="FIFO")
+
+# Seconds stock stays reserved for a pending order after its payment preference is created.
+# Keep it longer than PREFERENCE_CACHE_TIMEOUT so a reused preference still has its reservations.
+STOCK_RESERVATION_TTL = config("STOCK_RESERVATION_TTL", default=60 * 15, cast=int)
+
+# Background tasks (products.tasks): run after commit in a small thread pool,
+# or inline when BACKGROUND_TASKS_EAGER is set (tests, debugging).
+BACKGROUND_TASK_WORKERS = config("BACKGROUND_TASK_WORKERS", default=2, cast=int)
+BACKGROUND_TASKS_EAGER = config("BACKGROUND_TASKS_EAGER", default=False, cast=bool)
+
+# Class that turns a payment into invoice PDF bytes (`render(payment, items)`), built once per process
+# and per invoice worker. Tests point it at a stub so no worker has to load WeasyPrint.
+INVOICE_RENDERER = "products.payments.invoices.InvoiceRenderer"
+
+# MercadoPago (products.payments.mercadopago_client): one pooled client per process,
+# timeouts in seconds, retries only on idempotent calls and a circuit breaker.
+MERCADO_PAGO_ACCESS_TOKEN = config("MERCADO_PAGO_ACCESS_TOKEN")
+MERCADO_PAGO_API_BASE_URL = config("MERCADO_PAGO_API_BASE_URL", default="https://api.mercadopago.com")
+MERCADO_PAGO_CONNECT_TIMEOUT = config("MERCADO_PAGO_CONNECT_TIMEOUT", default=3.05, cast=float)
+MERCADO_PAGO_READ_TIMEOUT = config("MERCADO_PAGO_READ_TIMEOUT", default=10, cast=float)
+MERCADO_PAGO_MAX_RETRIES = config("MERCADO_PAGO_MAX_RETRIES", default=2, cast=int)
+MERCADO_PAGO_POOL_SIZE = config("MERCADO_PAGO_POOL_SIZE", default=10, cast=int)
+MERCADO_PAGO_BREAKER_THRESHOLD = config("MERCADO_PAGO_BREAKER_THRESHOLD", default=5, cast=int)
+MERCADO_PAGO_BREAKER_RESET_SECONDS = config("MERCADO_PAGO_BREAKER_RESET_SECONDS", default=30, cast=float)
+# Secret used to validate the x-signature header of webhook notifications (empty disables the check)
+MERCADO_PAGO_WEBHOOK_SECRET = config("MERCADO_PAGO_WEBHOOK_SECRET", default="")
+# Public URL of payment/mercadopago/webhook/ sent to MercadoPago with each payment (empty keeps the account default)
+MERCADO_PAGO_NOTIFICATION_URL = config("MERCADO_PAGO_NOTIFICATION_URL", default="")
+
+# Reuse a created payment preference for an identical checkout of the same user. The cart changes that
+# invalidate it may be saved by another worker, so it is on by default only with a shared backend.
+PREFERENCE_CACHE_ENABLED = config("PREFERENCE_CACHE_ENABLED", default=bool(REDIS_URL), cast=bool)
+# Seconds a created payment preference is reused for an identical checkout of the same user
+PREFERENCE_CACHE_TIMEOUT = config("PREFERENCE_CACHE_TIMEOUT", default=60 * 5, cast=int)
+
+# Local MercadoPago emulator (products.payments.mercadopago_emulator) for load/integration tests without network.
+# MERCADO_PAGO_EMULATOR answers every call in-process; to use the HTTP server instead run
+# `manage.py mercadopago_emulator` and point MERCADO_PAGO_API_BASE_URL at it.
+MERCADO_PAGO_EMULATOR = config("MERCADO_PAGO_EMULATOR", default=False, cast=bool)
+MERCADO_PAGO_EMULATOR_LATENCY_MS = config("MERCADO_PAGO_EMULATOR_LATENCY_MS", default=0, cast=float)
+MERCADO_PAGO_EMULATOR_JITTER_MS = config("MERCADO_PAGO_EMULATOR_JITTER_MS", default=0, cast=float)
+MERCADO_PAGO_EMULATOR_ERROR_RATE = config("MERCADO_PAGO_EMULATOR_ERROR_RATE", default=0.0, cast=float)
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -8,10 +8,12 @@ from .models import (
     Cart,
     ProductReview,
     Shipment,
-    Payment, Coupon, UnitOfMeasure, Purchase, PurchaseItem, MissingItems
+    Payment, Coupon, UnitOfMeasure, Purchase, PurchaseItem, MissingItems, Invoice, PaymentEvent, StockReservation,
+    InventoryMovement, InventorySnapshot, CostState, MarginRollup, AnalyticsWatermark
 )
 
 admin.site.register([Product, ProductCart, OrderProduct, Order, Category, Cart,
                      ProductReview, Shipment, Payment, Coupon, UnitOfMeasure,
-                     Purchase, PurchaseItem, MissingItems
+                     Purchase, PurchaseItem, MissingItems, Invoice, PaymentEvent, StockReservation,
+                     InventoryMovement, InventorySnapshot, CostState, MarginRollup, AnalyticsWatermark
                      ])
\ No newline at end of file
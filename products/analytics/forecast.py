@@ -0,0 +1,144 @@
+import math
+from datetime import datetime, time, timedelta
+
+import numpy as np
+import pandas as pd
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from products.inventory.reservations import available_stock
+from products.models import OrderProduct, Product, PurchaseItem
+
+# Órdenes que cuentan como demanda real (las PENDING pueden ser carritos abandonados)
+DEMAND_ORDER_STATUS = ["PROCESSING", "SHIPPED", "OUT_FOR_DELIVERY", "DELIVERED", "ON_HOLD"]
+
+HISTORY_DAYS = 182
+MOVING_AVERAGE_WINDOW = 28
+SEASONAL_WEEKS = 8
+HORIZON_DAYS = 7
+SAFETY_DAYS = 2
+
+
+def demand_matrix(days=HISTORY_DAYS, end=None, skus=None):
+    """
+    Matriz SKU × día (DataFrame, una fila por SKU y una columna por día, ceros en los días sin ventas)
+    con las cantidades vendidas en los últimos `days` días hasta `end` inclusive (ayer por defecto,
+    el último día completo). Las cantidades salen de un solo `GROUP BY` (SKU, día) y el pivoteo se hace en pandas.
+    """
+    end = end or timezone.localdate() - timedelta(days=1)
+    start = end - timedelta(days=days - 1)
+    lines = OrderProduct.objects.filter(
+        order__status__in=DEMAND_ORDER_STATUS,
+        order__creation_date__gte=timezone.make_aware(datetime.combine(start, time.min)),
+        order__creation_date__lt=timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)),
+    )
+    if skus is not None:
+        lines = lines.filter(product_id__in=list(skus))
+    rows = (
+        lines.annotate(day=TruncDate("order__creation_date"))
+        .values_list("product_id", "day")
+        .annotate(quantity=Sum("quantity"))
+        .order_by()
+    )
+
+    days_index = pd.date_range(start, end, freq="D").date
+    frame = pd.DataFrame.from_records(list(rows), columns=["sku", "day", "quantity"])
+    if frame.empty:
+        return pd.DataFrame(index=pd.Index([], name="sku"), columns=days_index, dtype=float)
+    matrix = frame.pivot_table(index="sku", columns="day", values="quantity", aggfunc="sum", fill_value=0)
+    return matrix.reindex(columns=days_index, fill_value=0).astype(float)
+
+
+def moving_average(matrix, window=MOVING_AVERAGE_WINDOW):
+    """Demanda diaria promedio de cada SKU en los últimos `window` días (vector alineado con las filas)."""
+    values = matrix.to_numpy()
+    window = min(window, values.shape[1])
+    if not window:
+        return np.zeros(values.shape[0])
+    return values[:, -window:].mean(axis=1)
+
+
+def seasonal_forecast(matrix, horizon=HORIZON_DAYS, weeks=SEASONAL_WEEKS):
+    """
+    Demanda total esperada de cada SKU en los próximos `horizon` días usando la estacionalidad semanal:
+    el promedio de cada día de la semana en las últimas `weeks` semanas.
+    Las últimas `7 * weeks` columnas se reorganizan como (SKU, semana, día) y se promedian por semana,
+    así el día `h` del horizonte usa el perfil `h % 7` (la matriz termina justo antes del primer día pronosticado).
+    """
+    values = matrix.to_numpy()
+    weeks = min(weeks, values.shape[1] // 7)
+    if not weeks:
+        return moving_average(matrix) * horizon
+    profile = values[:, -7 * weeks:].reshape(values.shape[0], weeks, 7).mean(axis=1)
+    return profile[:, np.arange(horizon) % 7].sum(axis=1)
+
+
+def _purchase_units(skus):
+    """
+    Unidad en que se compra cada SKU: la de su última compra (o la del producto si nunca se compró),
+    con su peso y el último precio de compra. Una sola consulta con subconsultas por producto.
+    """
+    last_item = PurchaseItem.objects.filter(product=OuterRef("sku")).order_by("-purchase__purchase_date", "-id")
+    products = Product.objects.filter(sku__in=list(skus)).annotate(
+        unit=Coalesce(Subquery(last_item.values("unit_measure__unity")[:1]), F("measure_unity__unity")),
+        unit_weight=Coalesce(Subquery(last_item.values("unit_measure__weight")[:1]), F("measure_unity__weight")),
+        last_purchase_price=Subquery(last_item.values("purchase_price")[:1]),
+    )
+    return {
+        row["sku"]: row
+        for row in products.values("sku", "name", "unit", "unit_weight", "last_purchase_price")
+    }
+
+
+def reorder_suggestions(horizon=HORIZON_DAYS, window=MOVING_AVERAGE_WINDOW, weeks=SEASONAL_WEEKS,
+                        safety_days=SAFETY_DAYS, days=HISTORY_DAYS, end=None, include_all=False):
+    """
+    Sugerencias de compra por SKU para cubrir los próximos `horizon` días.
+
+    - Pronóstico: estacional por día de la semana (`seasonal_forecast`); el promedio móvil se reporta al lado.
+    - Stock de seguridad: `safety_days` días de demanda promedio.
+    - Sugerido = pronóstico + seguridad − stock disponible (stock menos reservas vigentes), convertido
+      a la unidad de compra del producto (`ceil(cantidad / weight)`).
+    - Costo estimado: unidades de compra × último precio de compra, que es por unidad de compra (BULTO...).
+
+    Retorna una fila por SKU con demanda en la historia; sin `include_all` solo las que necesitan compra.
+    """
+    matrix = demand_matrix(days=days, end=end)
+    skus = list(matrix.index)
+    if not skus:
+        return []
+
+    daily = moving_average(matrix, window)
+    forecast = seasonal_forecast(matrix, horizon, weeks)
+    safety = daily * safety_days
+    stock = available_stock(skus)
+    available = np.array([stock.get(sku, 0) for sku in skus], dtype=float)
+    needed = np.ceil(np.maximum(forecast + safety - available, 0))
+
+    units = _purchase_units(skus)
+    suggestions = []
+    for i, sku in enumerate(skus):
+        if not include_all and not needed[i]:
+            continue
+        product = units.get(sku, {})
+        weight = product.get("unit_weight")
+        price = product.get("last_purchase_price")
+        units_to_buy = math.ceil(needed[i] / weight) if weight else None
+        # Sin peso la unidad de compra es la de stock (como en `purchase_unit_weight`)
+        purchase_units = units_to_buy if units_to_buy is not None else float(needed[i])
+        suggestions.append({
+            "sku": sku,
+            "name": product.get("name"),
+            "available_stock": int(available[i]),
+            "moving_average": round(float(daily[i]), 2),
+            "forecast": round(float(forecast[i]), 2),
+            "safety_stock": round(float(safety[i]), 2),
+            "suggested_quantity": int(needed[i]),
+            "unit": product.get("unit"),
+            "unit_weight": weight,
+            "units_to_buy": units_to_buy,
+            "estimated_cost": round(purchase_units * price, 2) if price is not None else None,
+        })
+    suggestions.sort(key=lambda row: row["suggested_quantity"], reverse=True)
+    return suggestions
@@ -0,0 +1,299 @@
+import logging
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, FloatField, Sum
+from django.db.models.functions import TruncMonth, TruncYear
+from django.utils import timezone
+
+from products.inventory.ledger import purchase_unit_weight, settled_movement_id
+from products.models import (
+    AnalyticsWatermark, CostState, InventoryMovement, MarginRollup, OrderProduct, Product, PurchaseItem
+)
+
+logger = logging.getLogger(__name__)
+
+MOVEMENT_BATCH_SIZE = 50000
+
+PERIODS = {
+    "day": F("period"),
+    "month": TruncMonth("period"),
+    "year": TruncYear("period"),
+}
+GROUPS = {
+    "sku": ["product_id", "product__name"],
+    "category": ["product__category__name"],
+    "total": [],
+}
+
+
+def _watermark_name(method):
+    return f"margins:{method}"
+
+
+def _unit_prices(queryset, reference_field, refs, skus, amount, quantity=F("quantity")):
+    """
+    `{(referencia, sku): precio por unidad de stock}` ponderado por cantidad, con una consulta agregada.
+    `quantity` es la cantidad de cada fila expresada en unidades de stock.
+    """
+    rows = (
+        queryset.filter(**{f"{reference_field}__in": refs}, product_id__in=skus)
+        .values(reference_field, "product_id")
+        .annotate(amount=Sum(amount, output_field=FloatField()), qty=Sum(quantity, output_field=FloatField()))
+        .values_list(reference_field, "product_id", "amount", "qty")
+    )
+    return {(str(ref), sku): total / qty for ref, sku, total, qty in rows if qty}
+
+
+def _movements_frame(after_id, up_to_id, batch_size):
+    """
+    Lee un lote de movimientos en orden de id y les agrega el costo unitario de las entradas
+    (precio de la compra, o `Product.purchase_price` para ajustes) y el precio de venta de las salidas SALE.
+    """
+    rows = (
+        InventoryMovement.objects.filter(id__gt=after_id, id__lte=up_to_id).order_by("id")
+        .values_list("id", "product_id", "kind", "quantity", "reference", "created_at")[:batch_size]
+    )
+    frame = pd.DataFrame.from_records(
+        list(rows), columns=["id", "sku", "kind", "quantity", "reference", "created_at"]
+    )
+    if frame.empty:
+        return frame
+
+    skus = frame["sku"].unique().tolist()
+    products = pd.DataFrame.from_records(
+        list(Product.objects.filter(sku__in=skus).values_list("sku", "price", "purchase_price")),
+        columns=["sku", "list_price", "default_cost"],
+    ).fillna(0)
+    frame = frame.merge(products, on="sku", how="left")
+
+    keys = list(zip(frame["reference"], frame["sku"]))
+    purchases = frame["kind"] == InventoryMovement.PURCHASE
+    sales = frame["kind"] == InventoryMovement.SALE
+    purchase_cost = _unit_prices(PurchaseItem.objects, "purchase_id", frame.loc[purchases, "reference"].unique().tolist(),
+                                 skus, F("quantity") * F("purchase_price"),
+                                 # El precio de compra es por unidad de compra (BULTO...), el costo por unidad de stock
+                                 quantity=F("quantity") * purchase_unit_weight())
+    sale_price = _unit_prices(OrderProduct.objects, "order_id", frame.loc[sales, "reference"].unique().tolist(),
+                              skus, F("quantity") * F("price"))
+
+    frame["unit_cost"] = pd.Series([purchase_cost.get(key) for key in keys], dtype=float)
+    frame["unit_cost"] = frame["unit_cost"].fillna(frame["default_cost"])
+    frame["sale_price"] = pd.Series([sale_price.get(key) for key in keys], dtype=float)
+    frame["sale_price"] = frame["sale_price"].fillna(frame["list_price"])
+    frame["period"] = (
+        pd.to_datetime(frame["created_at"], utc=True).dt.tz_convert(timezone.get_current_timezone_name()).dt.date
+    )
+    return frame
+
+
+def fifo_costs(state, quantities, unit_costs, fallback_cost):
+    """
+    Costo FIFO de cada salida de un producto (`quantities` con signo, en orden de movimiento).
+
+    Las entradas (capas pendientes del estado + entradas nuevas) forman una curva de costo acumulado
+    por unidad; la salida que consume las unidades `[inicio, fin)` cuesta `C(fin) - C(inicio)`, calculado
+    para todas las salidas a la vez con `np.interp`. Lo vendido por encima de lo que entró se costea con
+    la última capa (o `fallback_cost`) y queda como cantidad negativa en el estado.
+    Retorna `(costos por movimiento, cantidad, capas pendientes)`.
+    """
+    inflow = quantities > 0
+    layer_qty = np.array([layer[0] for layer in state.layers] + quantities[inflow].tolist(), dtype=float)
+    layer_cost = np.array([layer[1] for layer in state.layers] + unit_costs[inflow].tolist(), dtype=float)
+    cum_qty = np.concatenate([[0.0], np.cumsum(layer_qty)])
+    cum_cost = np.concatenate([[0.0], np.cumsum(layer_qty * layer_cost)])
+    last_cost = layer_cost[-1] if len(layer_cost) else fallback_cost
+
+    def cost_at(position):
+        return np.interp(position, cum_qty, cum_cost) + np.maximum(position - cum_qty[-1], 0) * last_cost
+
+    # Unidades ya vendidas y costeadas antes de tener entradas que las cubran
+    deficit = max(-state.quantity, 0)
+    outflow = np.where(inflow, 0, -quantities).astype(float)
+    end = deficit + np.cumsum(outflow)
+    costs = np.where(inflow, 0.0, cost_at(end) - cost_at(end - outflow))
+
+    consumed = end[-1] if len(end) else deficit
+    first = max(int(np.searchsorted(cum_qty, consumed, side="right")) - 1, 0)
+    layers = [
+        [float(cum_qty[i + 1] - max(consumed, cum_qty[i])), float(layer_cost[i])]
+        for i in range(first, len(layer_qty)) if cum_qty[i + 1] > consumed
+    ]
+    return costs, int(cum_qty[-1] - consumed), layers
+
+
+def average_costs(state, quantities, unit_costs, fallback_cost):
+    """
+    Costo promedio ponderado (perpetuo) de cada salida de un producto.
+
+    Las salidas no cambian el promedio, así que solo se recorre secuencialmente las entradas:
+    el stock previo a cada una sale de una suma acumulada y el promedio vigente se propaga a las
+    salidas con un forward-fill. Retorna `(costos por movimiento, cantidad, costo promedio)`.
+    """
+    inflow = quantities > 0
+    on_hand = state.quantity + np.cumsum(quantities) - quantities
+    current = state.average_cost or fallback_cost
+    averages = np.full(len(quantities), np.nan)
+    for i in np.flatnonzero(inflow):
+        held = max(on_hand[i], 0)
+        current = (held * current + quantities[i] * unit_costs[i]) / (held + quantities[i])
+        averages[i] = current
+    averages = pd.Series(averages).ffill().fillna(state.average_cost or fallback_cost).to_numpy()
+    costs = np.where(inflow, 0.0, -quantities * averages)
+    return costs, int(state.quantity + quantities.sum()), float(current)
+
+
+def _apply_batch(frame, method):
+    """Costea un lote de movimientos y suma sus resultados a los rollups y estados del método."""
+    skus = frame["sku"].unique().tolist()
+    states = {state.product_id: state for state in CostState.objects.filter(method=method, product_id__in=skus)}
+
+    frame["cost"] = 0.0
+    # Un SALE positivo es la devolución de una venta (pago reembolsado): descuenta unidades, ingresos
+    # y costo de ventas del período y vuelve al inventario al costo promedio de las ventas previas del lote
+    # (o al costo vigente del producto si el lote no tiene ventas anteriores)
+    returns = ((frame["kind"] == InventoryMovement.SALE) & (frame["quantity"] > 0)).to_numpy()
+    for sku, rows in frame.groupby("sku", sort=False).groups.items():
+        state = states.setdefault(sku, CostState(product_id=sku, method=method))
+        start = (state.quantity, list(state.layers), state.average_cost)
+        quantities = frame.loc[rows, "quantity"].to_numpy()
+        unit_costs = frame.loc[rows, "unit_cost"].to_numpy(dtype=float, copy=True)
+        fallback = float(frame.loc[rows[0], "default_cost"])
+        sku_returns = returns[frame.index.get_indexer(rows)]
+        if sku_returns.any():
+            current = state.layers[0][1] if method == CostState.FIFO and state.layers else state.average_cost
+            unit_costs[sku_returns] = current or fallback
+
+        # Segunda pasada solo si hay devoluciones: la primera da el costo de las ventas previas a cada una
+        for first_pass in ([True, False] if sku_returns.any() else [False]):
+            state.quantity, state.layers, state.average_cost = start
+            if method == CostState.FIFO:
+                costs, state.quantity, state.layers = fifo_costs(state, quantities, unit_costs, fallback)
+            else:
+                costs, state.quantity, state.average_cost = average_costs(state, quantities, unit_costs, fallback)
+            if first_pass:
+                sold = np.where(quantities < 0, -quantities, 0)
+                sold_cost, sold_qty = np.cumsum(costs * (quantities < 0)), np.cumsum(sold)
+                previous = np.divide(sold_cost, sold_qty, out=np.full(len(sold), np.nan), where=sold_qty > 0)
+                unit_costs[sku_returns] = np.where(np.isnan(previous[sku_returns]), unit_costs[sku_returns],
+                                                   previous[sku_returns])
+        frame.loc[rows, "unit_cost"] = unit_costs
+        frame.loc[rows, "cost"] = np.where(sku_returns, -quantities * unit_costs, costs)
+
+    outflows = frame[(frame["quantity"] < 0) | returns].copy()
+    sale = outflows["kind"] == InventoryMovement.SALE
+    outflows["quantity_sold"] = np.where(sale, -outflows["quantity"], 0)
+    outflows["revenue"] = np.where(sale, -outflows["quantity"] * outflows["sale_price"], 0.0)
+    outflows["cogs"] = np.where(sale, outflows["cost"], 0.0)
+    outflows["adjustment_cost"] = np.where(sale, 0.0, outflows["cost"])
+    totals = outflows.groupby(["sku", "period"])[["quantity_sold", "revenue", "cogs", "adjustment_cost"]].sum()
+
+    if not totals.empty:
+        existing = MarginRollup.objects.filter(
+            method=method, product_id__in=totals.index.get_level_values("sku").unique().tolist(),
+            period__in=totals.index.get_level_values("period").unique().tolist(),
+        ).values_list("product_id", "period", "quantity_sold", "revenue", "cogs", "adjustment_cost")
+        previous = pd.DataFrame.from_records(
+            list(existing), columns=["sku", "period", "quantity_sold", "revenue", "cogs", "adjustment_cost"]
+        ).set_index(["sku", "period"])
+        totals = totals.add(previous, fill_value=0).loc[totals.index]
+        MarginRollup.objects.bulk_create(
+            [
+                MarginRollup(product_id=sku, method=method, period=period, quantity_sold=int(row.quantity_sold),
+                             revenue=round(row.revenue, 2), cogs=round(row.cogs, 2),
+                             adjustment_cost=round(row.adjustment_cost, 2))
+                for (sku, period), row in totals.iterrows()
+            ],
+            update_conflicts=True,
+            unique_fields=["product", "method", "period"],
+            update_fields=["quantity_sold", "revenue", "cogs", "adjustment_cost"],
+        )
+
+    CostState.objects.bulk_create(
+        states.values(),
+        update_conflicts=True,
+        unique_fields=["product", "method"],
+        update_fields=["quantity", "average_cost", "layers"],
+    )
+
+
+def refresh_margin_rollups(method=None, batch_size=MOVEMENT_BATCH_SIZE, now=None):
+    """
+    Procesa los movimientos del libro de inventario posteriores a la marca de agua del método
+    (FIFO o AVERAGE, por defecto `COGS_METHOD`) y suma sus ventas, costo de ventas y margen a `MarginRollup`.
+
+    Cada lote se aplica en una transacción junto con el avance de la marca de agua (bloqueada con
+    `select_for_update`, así dos ejecuciones no procesan el mismo movimiento). Solo se procesan movimientos
+    con cierta antigüedad (`settled_movement_id`) para no saltar transacciones que todavía no confirmaron.
+    Retorna la cantidad de movimientos procesados.
+    """
+    method = method or settings.COGS_METHOD
+    up_to_id = settled_movement_id(now)
+    processed = 0
+    while True:
+        with transaction.atomic():
+            AnalyticsWatermark.objects.get_or_create(name=_watermark_name(method))
+            watermark = AnalyticsWatermark.objects.select_for_update().get(name=_watermark_name(method))
+            frame = _movements_frame(watermark.last_movement_id, up_to_id, batch_size)
+            if frame.empty:
+                break
+            _apply_batch(frame, method)
+            watermark.last_movement_id = int(frame["id"].iloc[-1])
+            watermark.save(update_fields=["last_movement_id", "updated_at"])
+            processed += len(frame)
+
+    logger.info("Margin rollups (%s): %s movimientos procesados", method, processed)
+    return processed
+
+
+def rebuild_margin_rollups(method=None):
+    """Borra los rollups, estados y marca de agua del método y los recalcula desde el primer movimiento."""
+    method = method or settings.COGS_METHOD
+    with transaction.atomic():
+        MarginRollup.objects.filter(method=method).delete()
+        CostState.objects.filter(method=method).delete()
+        AnalyticsWatermark.objects.filter(name=_watermark_name(method)).delete()
+    return refresh_margin_rollups(method)
+
+
+def margin_report(method=None, group_by="sku", period="month", date_from=None, date_to=None):
+    """
+    Margen realizado agrupado por `group_by` (sku, category o total) y `period` (day, month o year),
+    leído solo de `MarginRollup` con un `GROUP BY`.
+    """
+    method = method or settings.COGS_METHOD
+    rollups = MarginRollup.objects.filter(method=method)
+    if date_from:
+        rollups = rollups.filter(period__gte=date_from)
+    if date_to:
+        rollups = rollups.filter(period__lte=date_to)
+
+    fields = GROUPS[group_by]
+    rows = (
+        rollups.annotate(bucket=PERIODS[period])
+        .values("bucket", *fields)
+        .annotate(quantity_sold=Sum("quantity_sold"), revenue=Sum("revenue"), cogs=Sum("cogs"),
+                  adjustment_cost=Sum("adjustment_cost"))
+        .order_by("bucket", *fields)
+    )
+
+    report = []
+    for row in rows:
+        margin = row["revenue"] - row["cogs"]
+        entry = {"period": row["bucket"]}
+        if group_by == "sku":
+            entry.update(sku=row["product_id"], name=row["product__name"])
+        elif group_by == "category":
+            entry["category"] = row["product__category__name"]
+        entry.update(
+            quantity_sold=row["quantity_sold"],
+            revenue=round(row["revenue"], 2),
+            cogs=round(row["cogs"], 2),
+            margin=round(margin, 2),
+            margin_pct=round(margin / row["revenue"] * 100, 2) if row["revenue"] else None,
+            adjustment_cost=round(row["adjustment_cost"], 2),
+        )
+        report.append(entry)
+    return report
@@ -0,0 +1,67 @@
+from django.utils.dateparse import parse_date
+from rest_framework import status
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from products.models import CostState
+from .forecast import HISTORY_DAYS, HORIZON_DAYS, MOVING_AVERAGE_WINDOW, SAFETY_DAYS, reorder_suggestions
+from .margins import GROUPS, PERIODS, margin_report
+
+
+class ReorderSuggestionsView(APIView):
+    """
+    Return suggested purchase quantities per SKU from the order history.
+    Optional params: `horizon`, `window`, `safety_days` and `days` (history length), all in days,
+    and `all=true` to include SKUs that do not need to be bought.
+    Only accessible to admin users.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        params = {}
+        for name, default, minimum in (("horizon", HORIZON_DAYS, 1), ("window", MOVING_AVERAGE_WINDOW, 1),
+                                       ("safety_days", SAFETY_DAYS, 0), ("days", HISTORY_DAYS, 1)):
+            value = request.query_params.get(name, str(default))
+            if not value.isdigit() or int(value) < minimum:
+                return Response({"message": f"{name} must be an integer >= {minimum}"},
+                                status=status.HTTP_400_BAD_REQUEST)
+            params[name] = int(value)
+
+        include_all = request.query_params.get("all", "").lower() in ("1", "true", "yes")
+        suggestions = reorder_suggestions(include_all=include_all, **params)
+        return Response({"horizon": params["horizon"], "items": suggestions}, status=status.HTTP_200_OK)
+
+
+class MarginReportView(APIView):
+    """
+    Return realized revenue, cost of goods sold and margin from the precomputed rollups.
+    Optional params: `group_by` (sku, category, total), `period` (day, month, year),
+    `method` (FIFO, AVERAGE) and `date_from` / `date_to` (YYYY-MM-DD).
+    Only accessible to admin users.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        group_by = request.query_params.get("group_by", "sku")
+        period = request.query_params.get("period", "month")
+        method = request.query_params.get("method", "").upper() or None
+        if group_by not in GROUPS:
+            return Response({"message": f"group_by options are - {list(GROUPS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        if period not in PERIODS:
+            return Response({"message": f"period options are - {list(PERIODS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        if method and method not in dict(CostState.METHODS):
+            return Response({"message": f"method options are - {list(dict(CostState.METHODS))}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        dates = {}
+        for param in ("date_from", "date_to"):
+            value = request.query_params.get(param)
+            if value:
+                dates[param] = parse_date(value)
+                if dates[param] is None:
+                    return Response({"message": f"{param} must be a valid date (YYYY-MM-DD)"},
+                                    status=status.HTTP_400_BAD_REQUEST)
+
+        report = margin_report(method=method, group_by=group_by, period=period, **dates)
+        return Response({"items": report}, status=status.HTTP_200_OK)
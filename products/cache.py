@@ -0,0 +1,79 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+CATALOG_VERSION_KEY = "catalog:version"
+CATALOG_HITS_KEY = "catalog:stats:hits"
+CATALOG_MISSES_KEY = "catalog:stats:misses"
+
+
+def get_catalog_version():
+    """Retorna la versión actual del catálogo, inicializándola en 1 si no existe."""
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, 1, timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY, 1)
+    return version
+
+
+def bump_catalog_version():
+    """
+    Incrementa la versión del catálogo. Todas las claves construidas con la versión
+    anterior dejan de leerse y expiran solas por su TTL.
+    """
+    try:
+        return cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOG_VERSION_KEY, 1, timeout=None)
+        return cache.incr(CATALOG_VERSION_KEY)
+
+
+def catalog_key(name, *parts):
+    """Construye una clave de cache ligada a la versión actual del catálogo."""
+    raw = ":".join(str(part) for part in parts)
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    return f"catalog:v{get_catalog_version()}:{name}:{digest}"
+
+
+def _count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def get_or_build(name, parts, builder):
+    """
+    Lectura a través de la cache del catálogo: si la clave existe se retorna el payload
+    guardado, de lo contrario se ejecuta `builder()` y se guarda su resultado.
+    Con `CATALOG_CACHE_ENABLED` apagado siempre se ejecuta `builder()`: con una cache local por
+    proceso, el stock y los precios cambiados en un worker seguirían viejos en los demás.
+    """
+    if not settings.CATALOG_CACHE_ENABLED:
+        return builder()
+
+    key = catalog_key(name, *parts)
+    payload = cache.get(key)
+    if payload is not None:
+        _count(CATALOG_HITS_KEY)
+        return payload
+
+    _count(CATALOG_MISSES_KEY)
+    payload = builder()
+    cache.set(key, payload, timeout=settings.CATALOG_CACHE_TIMEOUT)
+    return payload
+
+
+def catalog_cache_stats():
+    """Retorna los contadores de aciertos/fallos y la versión actual del catálogo."""
+    hits = cache.get(CATALOG_HITS_KEY, 0)
+    misses = cache.get(CATALOG_MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        "version": get_catalog_version(),
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / total, 4) if total else 0,
+    }
@@ -0,0 +1,47 @@
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from products.carts.summary import bump_cart_version
+from products.models import ProductCart
+from products.payments.checkout import bump_checkout_version
+
+
+def parse_quantity(value):
+    """
+    Convierte la cantidad recibida a un entero positivo: acepta enteros y strings numéricos ("2"),
+    no fracciones (2.5, "2.5") ni booleanos. Retorna `None` si no es válida.
+    """
+    try:
+        quantity = int(str(value).strip())
+    except ValueError:
+        return None
+    return quantity if quantity > 0 else None
+
+
+def add_cart_items(cart, quantities):
+    """
+    Agrega productos al carrito sumando cantidades (`quantities` es `{sku: cantidad}`).
+    Con un número fijo de consultas sin importar cuántos items lleguen:
+    - un INSERT que crea las filas faltantes (los conflictos con la restricción única se ignoran),
+    - un UPDATE `quantity = quantity + <cantidad del sku>` sobre todas las filas,
+    así dos agregados concurrentes del mismo producto nunca duplican filas ni pierden cantidades.
+    Retorna las filas resultantes como `{"id", "product", "quantity"}`.
+    """
+    skus = list(quantities)
+    with transaction.atomic():
+        ProductCart.objects.bulk_create(
+            [ProductCart(cart=cart, product_id=sku, quantity=0) for sku in skus], ignore_conflicts=True
+        )
+        ProductCart.objects.filter(cart=cart, product_id__in=skus).update(
+            quantity=F("quantity") + Case(
+                *[When(product_id=sku, then=Value(quantity)) for sku, quantity in quantities.items()],
+                default=Value(0), output_field=IntegerField(),
+            )
+        )
+        # Las escrituras en bloque no disparan los signals de ProductCart
+        transaction.on_commit(lambda: bump_cart_version(cart.pk))
+        transaction.on_commit(lambda: bump_checkout_version(cart.user_id))
+
+    return list(
+        ProductCart.objects.filter(cart=cart, product_id__in=skus).order_by("id").values("id", "product", "quantity")
+    )
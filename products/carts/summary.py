@@ -0,0 +1,86 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, F, FloatField, When
+from django.db.models.functions import Coalesce
+
+from products.cache import get_catalog_version
+from products.models import ProductCart
+
+
+def _cart_version_key(cart_id):
+    return f"cart:version:{cart_id}"
+
+
+def get_cart_version(cart_id):
+    version = cache.get(_cart_version_key(cart_id))
+    if version is None:
+        cache.add(_cart_version_key(cart_id), 1, timeout=None)
+        version = cache.get(_cart_version_key(cart_id), 1)
+    return version
+
+
+def bump_cart_version(cart_id):
+    """Invalida el resumen guardado del carrito (cambió alguna de sus filas `ProductCart`)."""
+    try:
+        return cache.incr(_cart_version_key(cart_id))
+    except ValueError:
+        cache.add(_cart_version_key(cart_id), 1, timeout=None)
+        return cache.incr(_cart_version_key(cart_id))
+
+
+def build_cart_summary(cart):
+    """
+    Arma el resumen del carrito con una sola consulta anotada:
+    precio efectivo (`discount_price` cuando el producto tiene descuento), total por línea y total del carrito.
+    """
+    unit_price = Case(
+        When(product__has_discount=True, product__discount_price__gt=0, then=F("product__discount_price")),
+        default=F("product__price"),
+        output_field=FloatField(),
+    )
+    lines = (
+        ProductCart.objects.filter(cart=cart)
+        .annotate(
+            unit_price=unit_price,
+            line_total=F("quantity") * unit_price,
+            unit=Coalesce("measure_unity__unity", "product__measure_unity__unity"),
+        )
+        .order_by("id")
+        .values("product_id", "product__name", "unit", "quantity", "product__price", "unit_price", "line_total")
+    )
+
+    items = [
+        {
+            "sku": line["product_id"],
+            "name": line["product__name"],
+            "unit": line["unit"],
+            "quantity": line["quantity"],
+            "price": line["product__price"],
+            "unit_price": line["unit_price"],
+            "line_total": round(line["line_total"], 2),
+        }
+        for line in lines
+    ]
+    return {
+        "cart": cart.name,
+        "items": items,
+        "total_items": sum(item["quantity"] for item in items),
+        "total": round(sum(item["line_total"] for item in items), 2),
+    }
+
+
+def get_cart_summary(cart):
+    """
+    Resumen del carrito leído desde cache. La clave depende de la versión del carrito
+    (cambia con sus filas `ProductCart`) y de la del catálogo (cambia con precios y descuentos).
+    Con `CART_SUMMARY_CACHE_ENABLED` apagado (sin cache compartida) siempre se arma desde la base.
+    """
+    if not settings.CART_SUMMARY_CACHE_ENABLED:
+        return build_cart_summary(cart)
+
+    key = f"cart:summary:{cart.pk}:v{get_cart_version(cart.pk)}:c{get_catalog_version()}"
+    summary = cache.get(key)
+    if summary is None:
+        summary = build_cart_summary(cart)
+        cache.set(key, summary, timeout=settings.CART_SUMMARY_CACHE_TIMEOUT)
+    return summary
@@ -1,10 +1,12 @@
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView, Response
 from rest_framework import status
-from products.models import Cart, Product, ProductCart
+from products.models import Cart, Product
+from products.carts.items import add_cart_items, parse_quantity
+from products.carts.summary import get_cart_summary
 from users.models import User
 from products.serializers import  (
     CartSerializer,
-    ProductCartSerializer
 )
 
 
@@ -48,9 +50,13 @@ class CartExistView(APIView):
 
 
 class CartItemCreateView(APIView):
+    """
+    Add items to a cart, incrementing the quantity of products already in it.
+    All SKUs are resolved with one query and applied with one upsert, whatever the number of items.
+    Responds with the resulting rows: `[{"id", "product", "quantity"}]`.
+    """
     def post(self, request):
         data = request.data.get("data")
-        print(request.data)
 
         # Validar que `data` contenga `cart_id` y `items`
         if not data or "cart_id" not in data or "items" not in data:
@@ -64,38 +70,29 @@ class CartItemCreateView(APIView):
         if not isinstance(cart_items, list) or len(cart_items) == 0:
             return Response({'message': 'Items must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
 
+        # Agrupar por producto: un mismo SKU repetido en la petición suma sus cantidades
+        quantities = {}
+        for item in cart_items:
+            product_id = item.get("product")
+            quantity = parse_quantity(item.get("quantity"))
+
+            if not product_id or quantity is None:
+                return Response({"message": "Each item must have a product and a positive quantity"},
+                                status=status.HTTP_400_BAD_REQUEST)
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+
         try:
             # Verificar si el carrito existe
             cart = Cart.objects.get(name=cart_id)
-            updated_items = []
-
-            for item in cart_items:
-                product_id = item.get("product")
-                quantity = item.get("quantity")
-
-                if not product_id or not quantity:
-                    return Response({"message": "Each item must have a product and quantity"},
-                                    status=status.HTTP_400_BAD_REQUEST)
-
-                # Verificar si el producto existe
-                product = Product.objects.filter(sku=product_id).first()
-                if not product:
-                    return Response({"message": f"Product with ID {product_id} not found"},
-                                    status=status.HTTP_404_NOT_FOUND)
-
-                # Buscar si el producto ya está en el carrito
-                product_cart, created = ProductCart.objects.get_or_create(cart=cart, product=product)
-
-                if created:
-                    product_cart.quantity = quantity
-                else:
-                    product_cart.quantity += quantity  # Incrementa la cantidad si ya existe
 
-                product_cart.save()
+            # Verificar que todos los productos existan con una sola consulta
+            found = set(Product.objects.filter(sku__in=list(quantities)).values_list("sku", flat=True))
+            missing = sorted(set(quantities) - found)
+            if missing:
+                return Response({"message": f"Products not found: {', '.join(missing)}", "missing_products": missing},
+                                status=status.HTTP_404_NOT_FOUND)
 
-                updated_items.append(ProductCartSerializer(product_cart).data)
-
-            return Response(updated_items, status=status.HTTP_201_CREATED)
+            return Response(add_cart_items(cart, quantities), status=status.HTTP_201_CREATED)
 
         except Cart.DoesNotExist:
             return Response({"message": f"Cart with ID {cart_id} not found"}, status=status.HTTP_404_NOT_FOUND)
@@ -103,6 +100,26 @@ class CartItemCreateView(APIView):
             return Response({'message': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class CartSummaryView(APIView):
+    """
+    Return a compact summary of one of the authenticated user's carts:
+    per line SKU, name, unit, quantity, effective price (discount aware) and line total, plus the cart total.
+    `?cart=<name>` selects the cart; without it the user's first cart is used.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        carts = Cart.objects.filter(user=request.user)
+        cart_name = request.query_params.get("cart", None)
+        if cart_name:
+            carts = carts.filter(name=cart_name)
+
+        cart = carts.order_by("id").first()
+        if cart is None:
+            return Response({"message": "Cart not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(get_cart_summary(cart), status=status.HTTP_200_OK)
+
+
 #retrieve carts per user
 class CartUserListView(APIView):
     def get(self, request):
@@ -0,0 +1,140 @@
+import csv
+import json
+import tempfile
+from datetime import datetime
+
+from django.db.models import F
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from openpyxl import Workbook
+
+from products.models import MissingItems, Order, Product, Purchase
+
+CHUNK_SIZE = 2000
+
+
+def export_products(filters):
+    queryset = Product.objects.order_by("sku")
+    if filters.get("date_from"):
+        queryset = queryset.filter(last_updated__date__gte=filters["date_from"])
+    if filters.get("date_to"):
+        queryset = queryset.filter(last_updated__date__lte=filters["date_to"])
+    columns = ["sku", "name", "category__name", "measure_unity__unity", "price", "discount_price", "has_discount",
+               "stock", "purchase_price", "recommended", "best_seller", "rank", "last_updated"]
+    return columns, queryset.values_list(*columns)
+
+
+def export_orders(filters):
+    """Una fila por línea de la orden (las órdenes sin líneas salen con las columnas de producto vacías)."""
+    queryset = Order.objects.order_by("creation_date", "id", "orderproduct__id")
+    if filters.get("date_from"):
+        queryset = queryset.filter(creation_date__date__gte=filters["date_from"])
+    if filters.get("date_to"):
+        queryset = queryset.filter(creation_date__date__lte=filters["date_to"])
+    if filters.get("status"):
+        queryset = queryset.filter(status__in=filters["status"])
+    columns = ["id", "user_id", "status", "creation_date", "last_updated", "payment__payment_amount",
+               "payment__payment_status", "orderproduct__product_id", "orderproduct__product__name",
+               "orderproduct__quantity", "orderproduct__price"]
+    columns.append("line_total")
+    queryset = queryset.annotate(line_total=F("orderproduct__quantity") * F("orderproduct__price"))
+    return columns, queryset.values_list(*columns)
+
+
+def export_purchases(filters):
+    """Una fila por item de la compra."""
+    queryset = Purchase.objects.order_by("purchase_date", "id", "purchase_items__id")
+    if filters.get("date_from"):
+        queryset = queryset.filter(purchase_date__date__gte=filters["date_from"])
+    if filters.get("date_to"):
+        queryset = queryset.filter(purchase_date__date__lte=filters["date_to"])
+    columns = ["id", "purchased_by_id", "purchase_date", "global_sell_percentage", "total_amount",
+               "estimated_profit", "purchase_items__product_id", "purchase_items__quantity",
+               "purchase_items__purchase_price", "purchase_items__sell_percentage",
+               "purchase_items__unit_measure__unity"]
+    return columns, queryset.values_list(*columns)
+
+
+def export_missing_items(filters):
+    queryset = MissingItems.objects.order_by("id")
+    if filters.get("date_from"):
+        queryset = queryset.filter(last_updated__date__gte=filters["date_from"])
+    if filters.get("date_to"):
+        queryset = queryset.filter(last_updated__date__lte=filters["date_to"])
+    if filters.get("status"):
+        queryset = queryset.filter(order__status__in=filters["status"])
+    columns = ["order_id", "order__status", "product_id", "product__name", "stock", "missing_quantity",
+               "last_updated"]
+    return columns, queryset.values_list(*columns)
+
+
+DATASETS = {
+    "products": export_products,
+    "orders": export_orders,
+    "purchases": export_purchases,
+    "missing-items": export_missing_items,
+}
+
+
+class Echo:
+    """Buffer falso para que `csv.writer` retorne cada fila en lugar de escribirla."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(columns, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows.iterator(chunk_size=CHUNK_SIZE):
+        yield writer.writerow(row)
+
+
+def stream_ndjson(columns, rows):
+    for row in rows.iterator(chunk_size=CHUNK_SIZE):
+        yield json.dumps(dict(zip(columns, row)), default=str, ensure_ascii=False) + "\n"
+
+
+def excel_value(value):
+    """Excel no soporta fechas con zona horaria: se convierten a la hora local sin tzinfo."""
+    if isinstance(value, datetime) and timezone.is_aware(value):
+        return timezone.localtime(value).replace(tzinfo=None)
+    return value
+
+
+def build_xlsx(columns, rows):
+    """
+    Escribe las filas en un `Workbook(write_only=True)` (openpyxl las va volcando a disco)
+    y retorna un archivo temporal listo para enviarse por bloques.
+    """
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet()
+    worksheet.append(columns)
+    for row in rows.iterator(chunk_size=CHUNK_SIZE):
+        worksheet.append([excel_value(value) for value in row])
+    file = tempfile.TemporaryFile()
+    workbook.save(file)
+    file.seek(0)
+    return file
+
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+def export_response(dataset, file_format, filters):
+    """Construye la respuesta de exportación; la memoria usada no depende de la cantidad de filas."""
+    columns, rows = DATASETS[dataset](filters)
+    filename = f"{dataset}_{timezone.localdate():%Y%m%d}.{file_format}"
+
+    if file_format == "xlsx":
+        return FileResponse(build_xlsx(columns, rows), as_attachment=True, filename=filename,
+                            content_type=FORMATS["xlsx"])
+
+    stream = stream_csv if file_format == "csv" else stream_ndjson
+    response = StreamingHttpResponse(stream(columns, rows), content_type=FORMATS[file_format])
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
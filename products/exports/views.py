@@ -0,0 +1,41 @@
+from django.utils.dateparse import parse_date
+from rest_framework import status
+from rest_framework.permissions import IsAdminUser
+from rest_framework.views import APIView, Response
+
+from .exporters import DATASETS, FORMATS, export_response
+
+
+class ExportView(APIView):
+    """
+    Stream a dataset (products, orders, purchases, missing-items) as CSV, NDJSON or XLSX.
+    Optional filters: `date_from`, `date_to` (YYYY-MM-DD) and `status` (comma separated).
+    Only accessible to admin users.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, dataset, file_format):
+        if dataset not in DATASETS:
+            return Response({"message": f"Dataset options are - {list(DATASETS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        if file_format not in FORMATS:
+            return Response({"message": f"Format options are - {list(FORMATS)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        filters = {}
+        for param in ("date_from", "date_to"):
+            value = request.query_params.get(param)
+            if value:
+                try:
+                    filters[param] = parse_date(value)
+                except ValueError:  # Bien formada pero imposible, p. ej. 2024-02-30
+                    filters[param] = None
+                if filters[param] is None:
+                    return Response({"message": f"{param} must be a valid date (YYYY-MM-DD)"},
+                                    status=status.HTTP_400_BAD_REQUEST)
+        status_param = request.query_params.get("status")
+        if status_param:
+            filters["status"] = [value.strip().upper() for value in status_param.split(",") if value.strip()]
+
+        try:
+            return export_response(dataset, file_format, filters)
+        except Exception as e:
+            return Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -0,0 +1,212 @@
+import csv
+import io
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+from openpyxl import load_workbook
+
+from products.cache import bump_catalog_version
+from products.inventory.ledger import record_movements
+from products.models import Category, InventoryMovement, Product, UnitOfMeasure
+
+CHUNK_SIZE = 500
+
+REQUIRED_COLUMNS = {"sku", "name", "price", "stock"}
+FLOAT_COLUMNS = {"price", "purchase_price", "discount_price"}
+INT_COLUMNS = {"stock", "rank"}
+BOOL_COLUMNS = {"has_discount", "recommended", "best_seller"}
+TEXT_COLUMNS = {"description"}
+TRUE_VALUES = {"1", "true", "si", "sí", "yes", "x"}
+
+
+def iter_csv_rows(file):
+    """Lee un CSV fila por fila como diccionarios `{columna: valor}`."""
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        for row in csv.DictReader(text):
+            yield {(key or "").strip().lower(): value for key, value in row.items()}
+    finally:
+        text.detach()
+
+
+def iter_xlsx_rows(file):
+    """Lee la primera hoja de un XLSX en modo `read_only` fila por fila."""
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(cell or "").strip().lower() for cell in next(rows, [])]
+        for values in rows:
+            if any(value not in (None, "") for value in values):
+                yield dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+def iter_rows(file, filename):
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        return iter_xlsx_rows(file)
+    if filename.lower().endswith(".csv"):
+        return iter_csv_rows(file)
+    raise ValueError("Formato no soportado, use un archivo .csv o .xlsx")
+
+
+class ProductImporter:
+    """
+    Importa productos desde un CSV/XLSX procesándolo por bloques de `chunk_size` filas.
+
+    Categorías, unidades de medida y nombres existentes se cargan una vez en memoria; cada bloque
+    válido se guarda con `bulk_create(update_conflicts=True)` sobre el SKU en su propia transacción:
+    si la base de datos lo rechaza, solo ese bloque se descarta y sus filas quedan en `errors`.
+    La memoria usada no depende del tamaño del archivo, solo del tamaño del bloque y del catálogo.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.categories = {}
+        for category in Category.objects.all():
+            self.categories[str(category.pk)] = category.pk
+            self.categories[category.name.strip().lower()] = category.pk
+        self.units = {str(unit.pk): unit.pk for unit in UnitOfMeasure.objects.all()}
+        unit_names = {}
+        for unit in UnitOfMeasure.objects.all():
+            unit_names.setdefault(unit.unity.lower(), []).append(unit.pk)
+        # Por nombre solo se resuelven las unidades que no son ambiguas
+        self.units.update({name: pks[0] for name, pks in unit_names.items() if len(pks) == 1})
+        self.sku_by_name = {name: sku for sku, name in Product.objects.values_list("sku", "name")}
+        self.existing_skus = set(self.sku_by_name.values())
+        self.report = {"created": 0, "updated": 0, "errors": []}
+
+    def run(self, rows):
+        rows = enumerate(rows, start=2)  # La fila 1 es el encabezado
+        first_chunk = list(islice(rows, self.chunk_size))
+        if not first_chunk:
+            return self.report
+
+        columns = set(first_chunk[0][1])
+        missing = REQUIRED_COLUMNS - columns
+        if not columns & {"category", "category_id"}:
+            missing.add("category")
+        if missing:
+            self.report["errors"].append({"row": 1, "errors": {"columns": f"Faltan columnas: {', '.join(sorted(missing))}"}})
+            return self.report
+
+        self.update_fields = sorted(
+            (columns & (FLOAT_COLUMNS | INT_COLUMNS | BOOL_COLUMNS | TEXT_COLUMNS | {"name"}))
+            | {"category"}
+            | ({"measure_unity"} if columns & {"measure_unity", "unity"} else set())
+        )
+
+        chunk = first_chunk
+        while chunk:
+            self.save_chunk(chunk)
+            chunk = list(islice(rows, self.chunk_size))
+
+        if self.report["created"] or self.report["updated"]:
+            bump_catalog_version()
+        return self.report
+
+    def save_chunk(self, chunk):
+        products, lines, names = {}, {}, {}
+        for line, row in chunk:
+            product, errors = self.build_product(row)
+            if not errors and names.get(product.name, product.sku) != product.sku:
+                errors = {"name": f"El nombre {product.name} ya pertenece al SKU {names[product.name]} en el archivo"}
+            if errors:
+                self.report["errors"].append({"row": line, "sku": row.get("sku"), "errors": errors})
+                continue
+
+            if product.sku in products:  # Si un SKU se repite gana la última fila
+                names.pop(products[product.sku].name, None)
+            products[product.sku] = product
+            lines[product.sku] = line
+            names[product.name] = product.sku
+
+        if not products:
+            return
+
+        try:
+            with transaction.atomic():
+                # bulk_create no dispara post_save: la diferencia de stock se registra aquí como ajuste
+                previous = dict(
+                    Product.objects.select_for_update().filter(sku__in=list(products)).values_list("sku", "stock")
+                )
+                Product.objects.bulk_create(
+                    products.values(),
+                    update_conflicts=True,
+                    unique_fields=["sku"],
+                    update_fields=self.update_fields,
+                )
+                record_movements(
+                    {sku: product.stock - previous.get(sku, 0) for sku, product in products.items()},
+                    InventoryMovement.ADJUSTMENT, reference="import",
+                )
+        except IntegrityError as e:
+            # El bloque completo se revierte; las filas ya guardadas en bloques anteriores se mantienen
+            for sku in products:
+                self.report["errors"].append(
+                    {"row": lines[sku], "sku": sku, "errors": {"chunk": f"El bloque no se guardó: {e}"}}
+                )
+            return
+
+        for sku, product in products.items():
+            if sku in self.existing_skus:
+                self.report["updated"] += 1
+            else:
+                self.report["created"] += 1
+                self.existing_skus.add(sku)
+            self.sku_by_name[product.name] = sku
+
+    def build_product(self, row):
+        errors = {}
+        sku = str(row.get("sku") or "").strip()
+        name = str(row.get("name") or "").strip()
+        if not sku or len(sku) > 30:
+            errors["sku"] = "El SKU es obligatorio y debe tener máximo 30 caracteres"
+        if not name or len(name) > 20:
+            errors["name"] = "El nombre es obligatorio y debe tener máximo 20 caracteres"
+        elif self.sku_by_name.get(name, sku) != sku:
+            errors["name"] = f"El nombre {name} ya pertenece al SKU {self.sku_by_name[name]}"
+
+        values = {}
+        for column in FLOAT_COLUMNS | INT_COLUMNS:
+            raw = row.get(column)
+            if raw in (None, ""):
+                if column in REQUIRED_COLUMNS:
+                    errors[column] = "Este campo es obligatorio"
+                continue
+            try:
+                values[column] = int(float(raw)) if column in INT_COLUMNS else float(raw)
+            except (TypeError, ValueError):
+                errors[column] = f"Valor numérico inválido: {raw}"
+
+        for column in BOOL_COLUMNS:
+            if column in row:
+                values[column] = str(row[column]).strip().lower() in TRUE_VALUES
+
+        category = str(row.get("category_id") or row.get("category") or "").strip().lower()
+        category_id = self.categories.get(category)
+        if category_id is None:
+            errors["category"] = f"Categoría desconocida: {category or '-'}"
+
+        unit = str(row.get("measure_unity") or row.get("unity") or "").strip().lower()
+        unit_id = self.units.get(unit) if unit else None
+        if unit and unit_id is None:
+            errors["measure_unity"] = f"Unidad de medida desconocida o ambigua: {unit}"
+
+        if errors:
+            return None, errors
+
+        product = Product(
+            sku=sku,
+            name=name,
+            description=str(row.get("description") or ""),
+            category_id=category_id,
+            measure_unity_id=unit_id,
+            **values,
+        )
+        return product, None
+
+
+def import_products(file, filename, chunk_size=CHUNK_SIZE):
+    """Importa un archivo CSV/XLSX de productos y retorna el reporte `{created, updated, errors}`."""
+    return ProductImporter(chunk_size).run(iter_rows(file, filename))
@@ -0,0 +1,29 @@
+from rest_framework import status
+from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.permissions import IsAdminUser
+from rest_framework.views import APIView, Response
+
+from .importer import import_products
+
+
+class ProductImportView(APIView):
+    """
+    Bulk create/update products from a CSV or XLSX file sent in the `file` field.
+    Returns how many products were created/updated and the errors per row.
+    Only accessible to admin users.
+    """
+    permission_classes = [IsAdminUser]
+    parser_classes = [MultiPartParser, FormParser]
+
+    def post(self, request):
+        upload = request.FILES.get("file")
+        if not upload:
+            return Response({"message": "A CSV or XLSX file is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            report = import_products(upload, upload.name)
+            return Response(report, status=status.HTTP_200_OK)
+        except ValueError as e:
+            return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
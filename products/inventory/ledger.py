@@ -0,0 +1,152 @@
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Max, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, NullIf
+from django.utils import timezone
+
+from products.cache import bump_catalog_version
+from products.models import InventoryMovement, InventorySnapshot, Product, PurchaseItem
+
+logger = logging.getLogger(__name__)
+
+# Los snapshots solo cubren movimientos con cierta antigüedad, así una transacción
+# que todavía no confirmó su movimiento (id menor, commit posterior) no queda fuera del libro.
+SNAPSHOT_LAG = timedelta(minutes=5)
+SNAPSHOT_BATCH_SIZE = 1000
+
+
+def record_movements(deltas, kind, reference="", apply=False):
+    """
+    Agrega un movimiento por SKU (`deltas` es `{sku: cantidad con signo}`) con un solo INSERT.
+    Con `apply=True` también aplica las cantidades sobre `Product.stock` con un solo UPDATE
+    (`stock = stock + CASE ...`); si no, quien llama ya actualizó el stock.
+    """
+    deltas = {sku: quantity for sku, quantity in deltas.items() if quantity}
+    if not deltas:
+        return []
+
+    with transaction.atomic():
+        movements = InventoryMovement.objects.bulk_create([
+            InventoryMovement(product_id=sku, kind=kind, quantity=quantity, reference=str(reference))
+            for sku, quantity in deltas.items()
+        ])
+        if apply:
+            Product.objects.filter(sku__in=list(deltas)).update(
+                stock=F("stock") + Case(
+                    *[When(sku=sku, then=Value(quantity)) for sku, quantity in deltas.items()],
+                    default=Value(0), output_field=IntegerField(),
+                )
+            )
+            # update() no dispara post_save, se invalida el catálogo al confirmar
+            transaction.on_commit(bump_catalog_version)
+    return movements
+
+
+def purchase_unit_weight(prefix=""):
+    """
+    Unidades de stock por unidad de compra de un `PurchaseItem`: el `weight` de su unidad de medida
+    (1 cuando el item no tiene unidad o su peso es 0). `prefix` permite usarlo desde otra relación.
+    """
+    return Coalesce(NullIf(F(f"{prefix}unit_measure__weight"), Value(0)), Value(1))
+
+
+def purchase_quantities(purchase_id):
+    """
+    Retorna `{sku: cantidad comprada en unidades de stock}` de una compra (una consulta agregada):
+    la cantidad de cada item se multiplica por el peso de su unidad de medida (BULTO, CANASTILLA...).
+    """
+    return dict(
+        PurchaseItem.objects.filter(purchase_id=purchase_id, product__isnull=False)
+        .values("product_id")
+        .annotate(total=Sum(F("quantity") * purchase_unit_weight(), output_field=IntegerField()))
+        .values_list("product_id", "total")
+    )
+
+
+def receive_purchase(purchase_id, before, after):
+    """
+    Registra como entradas de inventario la diferencia entre las cantidades compradas (en unidades
+    de stock) antes (`before`) y después (`after`) de crear, editar o eliminar una compra, y la aplica al stock.
+    Una reducción nunca deja el stock negativo: si lo vendido ya consumió parte de la compra, solo se
+    descuenta lo que queda y el movimiento registra la diferencia realmente aplicada.
+    """
+    deltas = {sku: after.get(sku, 0) - before.get(sku, 0) for sku in set(before) | set(after)}
+    with transaction.atomic():
+        reduced = sorted(sku for sku, delta in deltas.items() if delta < 0)
+        if reduced:
+            stock = dict(Product.objects.select_for_update().filter(sku__in=reduced).order_by("sku")
+                         .values_list("sku", "stock"))
+            for sku in reduced:
+                deltas[sku] = max(deltas[sku], -max(stock.get(sku, 0), 0))
+        return record_movements(deltas, InventoryMovement.PURCHASE, reference=purchase_id, apply=True)
+
+
+def _ledger_queryset(products, up_to=None):
+    """Anota en cada producto su stock según el libro: último snapshot + movimientos posteriores."""
+    snapshots = InventorySnapshot.objects.filter(product=OuterRef("sku")).order_by("-last_movement_id")
+    movements = InventoryMovement.objects.filter(product=OuterRef("sku"), id__gt=OuterRef("snapshot_movement"))
+    if up_to is not None:
+        snapshots = snapshots.filter(last_movement_id__lte=up_to)
+        movements = movements.filter(id__lte=up_to)
+
+    return products.annotate(
+        snapshot_stock=Coalesce(Subquery(snapshots.values("stock")[:1]), Value(0)),
+        snapshot_movement=Coalesce(Subquery(snapshots.values("last_movement_id")[:1]), Value(0)),
+    ).annotate(
+        ledger_stock=F("snapshot_stock") + Coalesce(
+            Subquery(movements.order_by().values("product").annotate(total=Sum("quantity")).values("total")),
+            Value(0),
+        ),
+    )
+
+
+def ledger_stock(skus):
+    """
+    Retorna `{sku: stock según el libro}` con una sola consulta: por producto se lee su último
+    snapshot (índice producto/movimiento) y solo se suman los movimientos posteriores a él.
+    """
+    products = _ledger_queryset(Product.objects.filter(sku__in=list(skus)))
+    return dict(products.values_list("sku", "ledger_stock"))
+
+
+def settled_movement_id(now=None):
+    """Id del último movimiento con más de `SNAPSHOT_LAG` de antigüedad (0 si no hay ninguno)."""
+    cutoff = (now or timezone.now()) - SNAPSHOT_LAG
+    return InventoryMovement.objects.filter(created_at__lte=cutoff).aggregate(
+        last=Coalesce(Max("id"), Value(0))
+    )["last"]
+
+
+def take_inventory_snapshots(now=None):
+    """
+    Compactación periódica: escribe un snapshot por producto con su stock según el libro hasta el
+    último movimiento con más de `SNAPSHOT_LAG` de antigüedad, así las lecturas siguientes solo suman
+    los movimientos recientes. Retorna `{"snapshots", "last_movement_id", "drift"}`, donde `drift`
+    lista los productos cuyo `Product.stock` no coincide con el libro.
+    """
+    last_movement_id = settled_movement_id(now)
+
+    rows = _ledger_queryset(Product.objects.order_by("sku"), up_to=last_movement_id).values_list(
+        "sku", "ledger_stock", "snapshot_movement"
+    )
+    snapshots, written = [], 0
+    for sku, stock, snapshot_movement in rows.iterator(chunk_size=SNAPSHOT_BATCH_SIZE):
+        if snapshot_movement == last_movement_id and snapshot_movement:
+            continue  # ya tiene un snapshot al día
+        snapshots.append(InventorySnapshot(product_id=sku, stock=stock, last_movement_id=last_movement_id))
+        if len(snapshots) >= SNAPSHOT_BATCH_SIZE:
+            written += len(InventorySnapshot.objects.bulk_create(snapshots))
+            snapshots = []
+    if snapshots:
+        written += len(InventorySnapshot.objects.bulk_create(snapshots))
+
+    drift = [
+        {"sku": sku, "stock": stock, "ledger_stock": ledger}
+        for sku, stock, ledger in _ledger_queryset(Product.objects.order_by("sku"))
+        .exclude(stock=F("ledger_stock")).values_list("sku", "stock", "ledger_stock")
+    ]
+    for row in drift:
+        logger.warning("Inventory drift | SKU %s | stock %s | ledger %s", row["sku"], row["stock"], row["ledger_stock"])
+    return {"snapshots": written, "last_movement_id": last_movement_id, "drift": drift}
@@ -0,0 +1,99 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from products.models import Product, StockReservation
+
+
+class InsufficientStock(Exception):
+    """Alguna línea pide más de lo disponible; `shortages` trae `{"sku", "requested", "available"}`."""
+
+    def __init__(self, shortages):
+        super().__init__("Insufficient stock")
+        self.shortages = shortages
+
+
+def reserved_quantities(skus, exclude_order=None, now=None):
+    """
+    Retorna `{sku: cantidad}` reservada por reservas vigentes (una consulta agregada
+    sobre el índice producto/vencimiento). `exclude_order` deja fuera las reservas de esa orden.
+    """
+    holds = StockReservation.objects.filter(product_id__in=list(skus), expires_at__gt=now or timezone.now())
+    if exclude_order is not None:
+        holds = holds.exclude(order_id=exclude_order)
+    return dict(holds.values("product_id").annotate(total=Sum("quantity")).values_list("product_id", "total"))
+
+
+def available_stock(skus, exclude_order=None):
+    """Retorna `{sku: stock disponible}` = stock menos las reservas vigentes (nunca negativo)."""
+    reserved = reserved_quantities(skus, exclude_order)
+    return {
+        sku: max(stock - reserved.get(sku, 0), 0)
+        for sku, stock in Product.objects.filter(sku__in=list(skus)).values_list("sku", "stock")
+    }
+
+
+def _shortages(quantities, stock, reserved):
+    shortages = []
+    for sku in sorted(quantities):
+        available = max(stock.get(sku, 0) - reserved.get(sku, 0), 0)
+        if quantities[sku] > available:
+            shortages.append({"sku": sku, "requested": quantities[sku], "available": available})
+    return shortages
+
+
+def stock_shortages(quantities, exclude_order=None):
+    """
+    Chequeo sin bloqueos de lo que `reserve_order_stock` rechazaría: retorna las líneas de `quantities`
+    que piden más de lo disponible (`{"sku", "requested", "available"}`), vacío si todo alcanza.
+    """
+    skus = list(quantities)
+    stock = dict(Product.objects.filter(sku__in=skus).values_list("sku", "stock"))
+    return _shortages(quantities, stock, reserved_quantities(skus, exclude_order=exclude_order))
+
+
+def reserve_order_stock(order_id, quantities):
+    """
+    Reserva por `STOCK_RESERVATION_TTL` segundos el stock de una orden pendiente
+    (`quantities` es `{sku: cantidad}`), reemplazando sus reservas anteriores.
+    Es todo o nada: si alguna línea no alcanza lanza `InsufficientStock` y no reserva nada.
+    Usa un número fijo de consultas sin importar la cantidad de líneas.
+    """
+    now = timezone.now()
+    skus = sorted(quantities)
+    with transaction.atomic():
+        # Mismo orden de bloqueo que `commit_order_stock` para evitar deadlocks
+        stock = dict(Product.objects.select_for_update().filter(sku__in=skus).order_by("sku")
+                     .values_list("sku", "stock"))
+        reserved = reserved_quantities(skus, exclude_order=order_id, now=now)
+        shortages = _shortages(quantities, stock, reserved)
+        if shortages:
+            raise InsufficientStock(shortages)
+
+        expires_at = now + timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+        StockReservation.objects.bulk_create(
+            [
+                StockReservation(order_id=order_id, product_id=sku, quantity=quantities[sku], expires_at=expires_at)
+                for sku in skus if quantities[sku] > 0
+            ],
+            update_conflicts=True,
+            unique_fields=["order", "product"],
+            update_fields=["quantity", "expires_at"],
+        )
+        StockReservation.objects.filter(order_id=order_id).exclude(
+            product_id__in=[sku for sku in skus if quantities[sku] > 0]
+        ).delete()
+    return expires_at
+
+
+def release_order_reservations(order_id):
+    """Elimina las reservas de una orden (pagada o cancelada)."""
+    return StockReservation.objects.filter(order_id=order_id).delete()[0]
+
+
+def expire_reservations(now=None):
+    """Barre en bloque las reservas vencidas. Retorna cuántas se eliminaron."""
+    return StockReservation.objects.filter(expires_at__lte=now or timezone.now()).delete()[0]
@@ -0,0 +1,147 @@
+import logging
+
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from products.cache import bump_catalog_version
+from products.inventory.ledger import record_movements
+from products.inventory.reservations import release_order_reservations, reserved_quantities
+from products.models import InventoryMovement, Order, OrderProduct, Product, cart_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# Órdenes con el stock ya descontado pero todavía sin despachar
+STOCK_COMMITTED_STATUS = {"PROCESSING", "ON_HOLD"}
+DISPATCHED_STATUS = {"SHIPPED", "OUT_FOR_DELIVERY", "DELIVERED"}
+
+FULFILLED = "FULFILLED"
+PARTIAL = "PARTIAL"
+REMOVED = "REMOVED"
+
+
+def commit_order_stock(order_id):
+    """
+    Descuenta el stock de todas las líneas de una orden en una sola transacción.
+
+    Los productos involucrados se bloquean con `select_for_update` (en orden de SKU para evitar
+    deadlocks), así dos pagos concurrentes nunca venden el mismo stock. Si un producto no tiene
+    suficiente stock solo se factura lo disponible, y si no tiene stock la línea se elimina.
+    El stock reservado por otras órdenes pendientes no está disponible; las reservas de esta orden
+    se eliminan, quedando convertidas en el descuento de stock. Lo vendido se registra en el libro
+    de inventario como movimientos SALE.
+
+    Retorna una lista con el resultado por línea:
+    `{"order_product", "sku", "requested", "fulfilled", "status"}` con status FULFILLED, PARTIAL o REMOVED.
+    """
+    with transaction.atomic():
+        lines = list(OrderProduct.objects.filter(order_id=order_id).order_by("id"))
+        skus = {line.product_id for line in lines}
+        products = {
+            product.sku: product
+            for product in Product.objects.select_for_update().filter(sku__in=skus).order_by("sku")
+        }
+
+        # Las reservas vigentes de otras órdenes no se pueden vender; las de esta orden se convierten en descuento
+        reserved = reserved_quantities(skus, exclude_order=order_id)
+
+        results, partial_lines, removed_ids, changed, sold = [], [], [], {}, {}
+        for line in lines:
+            product = products[line.product_id]
+            others = reserved.get(product.sku, 0)
+            available = max(product.stock - others, 0)
+            requested = line.quantity
+
+            if available >= requested:
+                fulfilled, line_status = requested, FULFILLED
+            elif available > 0:
+                fulfilled, line_status = available, PARTIAL
+                line.quantity = available
+                partial_lines.append(line)
+            else:
+                fulfilled, line_status = 0, REMOVED
+                removed_ids.append(line.id)
+
+            if fulfilled:
+                product.stock = available + others - fulfilled
+                changed[product.sku] = product
+                sold[product.sku] = sold.get(product.sku, 0) - fulfilled
+
+            results.append({
+                "order_product": line.id,
+                "sku": line.product_id,
+                "requested": requested,
+                "fulfilled": fulfilled,
+                "status": line_status,
+            })
+
+        if changed:
+            Product.objects.bulk_update(changed.values(), ["stock"])
+            record_movements(sold, InventoryMovement.SALE, reference=order_id)
+        if partial_lines:
+            OrderProduct.objects.bulk_update(partial_lines, ["quantity"])
+        if removed_ids:
+            OrderProduct.objects.filter(id__in=removed_ids).delete()
+        release_order_reservations(order_id)
+        if partial_lines or removed_ids:
+            Order.objects.filter(pk=order_id).update(cart_fingerprint=cart_fingerprint(
+                (result["sku"], result["fulfilled"]) for result in results if result["fulfilled"]
+            ))
+
+        if changed:
+            # bulk_update no dispara post_save, se invalida el catálogo al confirmar
+            transaction.on_commit(bump_catalog_version)
+
+    for result in results:
+        if result["status"] != FULFILLED:
+            logger.info("Order %s | SKU %s | requested %s | fulfilled %s | %s", order_id, result["sku"],
+                        result["requested"], result["fulfilled"], result["status"])
+    return results
+
+
+def start_order_processing(order_id):
+    """
+    Mueve la orden de PENDING a PROCESSING y descuenta su stock en una sola transacción.
+    Solo el primer llamado que mueve la orden descuenta stock; retorna True en ese caso.
+    """
+    with transaction.atomic():
+        moved = Order.objects.filter(pk=order_id, status="PENDING").update(
+            status="PROCESSING", last_updated=timezone.now()
+        )
+        if moved:
+            commit_order_stock(order_id)
+    return bool(moved)
+
+
+def reverse_order_processing(order_id):
+    """
+    Revierte una orden cuyo pago fue reembolsado, cancelado o contracargado:
+    - PENDING: pasa a CANCELLED (sus reservas se liberan con el signal de la orden).
+    - PROCESSING/ON_HOLD: pasa a CANCELLED y devuelve al stock lo descontado por `commit_order_stock`,
+      registrado en el libro como un movimiento SALE positivo (devolución de la venta).
+    - Despachada o entregada: pasa a RETURNED sin tocar el stock; la mercancía vuelve al
+      inventario con un ajuste cuando se recibe.
+    Retorna el nuevo estado, o None si la orden no existe o ya estaba cerrada.
+    """
+    with transaction.atomic():
+        order = Order.objects.select_for_update().filter(pk=order_id).first()
+        if order is None:
+            return None
+        previous = order.status
+        if previous == "PENDING" or previous in STOCK_COMMITTED_STATUS:
+            order.status = "CANCELLED"
+        elif previous in DISPATCHED_STATUS:
+            order.status = "RETURNED"
+        else:
+            return None
+        order.save(update_fields=["status", "last_updated"])
+
+        if previous in STOCK_COMMITTED_STATUS:
+            returned = dict(
+                OrderProduct.objects.filter(order_id=order_id).values("product_id")
+                .annotate(total=Sum("quantity")).values_list("product_id", "total")
+            )
+            record_movements(returned, InventoryMovement.SALE, reference=order_id, apply=True)
+
+    logger.info("Order %s | payment reversed | %s -> %s", order_id, previous, order.status)
+    return order.status
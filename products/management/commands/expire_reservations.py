@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from products.inventory.reservations import expire_reservations
+
+
+class Command(BaseCommand):
+    help = "Elimina en bloque las reservas de stock vencidas (para ejecutar periódicamente con cron)."
+
+    def handle(self, *args, **options):
+        expired = expire_reservations()
+        self.stdout.write(self.style.SUCCESS(f"{expired} reservas vencidas eliminadas"))
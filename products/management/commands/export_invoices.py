@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from products.payments.invoice_batch import paid_payments, stream_invoice_zip
+
+
+class Command(BaseCommand):
+    help = "Genera un ZIP con las facturas PDF de los pagos aprobados en un rango de fechas."
+
+    def add_arguments(self, parser):
+        parser.add_argument("date_from", help="Fecha inicial (YYYY-MM-DD)")
+        parser.add_argument("date_to", help="Fecha final (YYYY-MM-DD)")
+        parser.add_argument("--output", default=None, help="Ruta del ZIP (por defecto Facturas_<desde>_<hasta>.zip)")
+        parser.add_argument("--workers", type=int, default=None, help="Procesos de renderizado (por defecto, núcleos)")
+
+    def handle(self, *args, **options):
+        date_from, date_to = parse_date(options["date_from"]), parse_date(options["date_to"])
+        if not date_from or not date_to:
+            raise CommandError("Las fechas deben tener el formato YYYY-MM-DD")
+
+        output = options["output"] or f"Facturas_{date_from}_{date_to}.zip"
+        payments = paid_payments(date_from, date_to)
+        with open(output, "wb") as file:
+            for chunk in stream_invoice_zip(payments, options["workers"]):
+                file.write(chunk)
+
+        self.stdout.write(self.style.SUCCESS(f"{payments.count()} facturas guardadas en {output}"))
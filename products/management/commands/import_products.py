@@ -0,0 +1,31 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.imports.importer import import_products, CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = "Importa (crea o actualiza) productos desde un archivo CSV o XLSX."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Ruta del archivo .csv o .xlsx")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Filas por bloque guardado")
+
+    def handle(self, *args, **options):
+        path = Path(options["path"])
+        if not path.exists():
+            raise CommandError(f"El archivo {path} no existe")
+
+        try:
+            with path.open("rb") as file:
+                report = import_products(file, path.name, options["chunk_size"])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for error in report["errors"]:
+            self.stderr.write(json.dumps(error, ensure_ascii=False))
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['created']} creados, {report['updated']} actualizados, {len(report['errors'])} filas con errores."
+        ))
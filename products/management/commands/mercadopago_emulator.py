@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from products.payments.mercadopago_emulator import MercadoPagoEmulator, make_emulator_server
+
+
+class Command(BaseCommand):
+    help = ("Levanta un emulador HTTP de MercadoPago (preferencias y pagos). "
+            "Apunte MERCADO_PAGO_API_BASE_URL a la dirección que se imprime.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8099)
+        parser.add_argument("--latency-ms", type=float, default=0, help="Latencia fija de cada respuesta")
+        parser.add_argument("--jitter-ms", type=float, default=0, help="Latencia aleatoria adicional (0..jitter)")
+        parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de llamadas que responden 500")
+        parser.add_argument("--seed", type=int, default=None, help="Semilla para reproducir errores/latencias")
+
+    def handle(self, *args, **options):
+        emulator = MercadoPagoEmulator(
+            latency_ms=options["latency_ms"],
+            jitter_ms=options["jitter_ms"],
+            error_rate=options["error_rate"],
+            seed=options["seed"],
+        )
+        server = make_emulator_server(emulator, options["host"], options["port"])
+        host, port = server.server_address[:2]
+        self.stdout.write(self.style.SUCCESS(f"Emulador de MercadoPago escuchando en http://{host}:{port}"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
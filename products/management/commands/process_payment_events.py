@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from products.payments.webhooks import EVENT_BATCH_SIZE, process_payment_events
+
+
+class Command(BaseCommand):
+    help = "Aplica las notificaciones de MercadoPago pendientes (y reintenta las que fallaron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=EVENT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        processed = process_payment_events(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"{processed} eventos procesados"))
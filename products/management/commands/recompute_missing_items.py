@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from products.purchases.missing_items import recompute_missing_items
+
+
+class Command(BaseCommand):
+    help = "Recalcula los productos faltantes (MissingItems) de las órdenes PENDING/PROCESSING."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sku", action="append", dest="skus",
+                            help="Recalcula solo este SKU (se puede repetir). Por defecto recalcula todos.")
+
+    def handle(self, *args, **options):
+        missing, removed = recompute_missing_items(options["skus"])
+        self.stdout.write(self.style.SUCCESS(f"{missing} faltantes actualizados, {removed} eliminados."))
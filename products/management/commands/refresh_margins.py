@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from products.analytics.margins import rebuild_margin_rollups, refresh_margin_rollups
+from products.models import CostState
+
+
+class Command(BaseCommand):
+    help = (
+        "Actualiza los rollups de margen realizado con los movimientos de inventario nuevos "
+        "(para ejecutar periódicamente con cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--method", choices=[method for method, _ in CostState.METHODS],
+                            help="Método de costeo. Por defecto COGS_METHOD.")
+        parser.add_argument("--rebuild", action="store_true",
+                            help="Borra los rollups del método y los recalcula desde el primer movimiento.")
+
+    def handle(self, *args, **options):
+        method = options["method"] or settings.COGS_METHOD
+        refresh = rebuild_margin_rollups if options["rebuild"] else refresh_margin_rollups
+        processed = refresh(method)
+        self.stdout.write(self.style.SUCCESS(f"{processed} movimientos procesados ({method})"))
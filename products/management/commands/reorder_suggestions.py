@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from products.analytics.forecast import HISTORY_DAYS, HORIZON_DAYS, MOVING_AVERAGE_WINDOW, SAFETY_DAYS, \
+    reorder_suggestions
+
+
+class Command(BaseCommand):
+    help = "Pronostica la demanda por SKU a partir del historial de órdenes y sugiere cantidades de compra."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--horizon", type=int, default=HORIZON_DAYS, help="Días a cubrir con la compra.")
+        parser.add_argument("--window", type=int, default=MOVING_AVERAGE_WINDOW, help="Días del promedio móvil.")
+        parser.add_argument("--safety-days", type=int, default=SAFETY_DAYS, help="Días de stock de seguridad.")
+        parser.add_argument("--days", type=int, default=HISTORY_DAYS, help="Días de historial a considerar.")
+        parser.add_argument("--all", action="store_true", help="Incluye los SKUs que no necesitan compra.")
+
+    def handle(self, *args, **options):
+        suggestions = reorder_suggestions(
+            horizon=options["horizon"], window=options["window"], safety_days=options["safety_days"],
+            days=options["days"], include_all=options["all"],
+        )
+        for row in suggestions:
+            units = f"{row['units_to_buy']} {row['unit']}" if row["units_to_buy"] is not None else "-"
+            self.stdout.write(
+                f"{row['sku']:<30} pronóstico {row['forecast']:>8} | disponible {row['available_stock']:>6} | "
+                f"sugerido {row['suggested_quantity']:>6} | {units}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"{len(suggestions)} SKUs con sugerencia de compra"))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from products.inventory.ledger import take_inventory_snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        "Escribe un snapshot del libro de inventario por producto y reporta los productos cuyo stock "
+        "no coincide con el libro (para ejecutar periódicamente con cron)."
+    )
+
+    def handle(self, *args, **options):
+        report = take_inventory_snapshots()
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['snapshots']} snapshots escritos hasta el movimiento {report['last_movement_id']}"
+        ))
+        for row in report["drift"]:
+            self.stdout.write(self.style.WARNING(
+                f"SKU {row['sku']}: stock {row['stock']}, libro {row['ledger_stock']}"
+            ))
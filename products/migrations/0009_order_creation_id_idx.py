@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_cart_last_updated_coupon_created_by_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-creation_date', '-id'], name='order_creation_id_idx'),
+        ),
+    ]
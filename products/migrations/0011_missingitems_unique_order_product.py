@@ -0,0 +1,30 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:20
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def remove_duplicate_missing_items(apps, schema_editor):
+    """Conserva solo el registro más reciente por (orden, producto) antes de crear la restricción."""
+    MissingItems = apps.get_model('products', 'MissingItems')
+    keep_ids = (
+        MissingItems.objects.values('order_id', 'product_id')
+        .annotate(keep_id=Max('id'))
+        .values_list('keep_id', flat=True)
+    )
+    MissingItems.objects.exclude(id__in=list(keep_ids)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_idsequence'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_missing_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='missingitems',
+            constraint=models.UniqueConstraint(fields=('order', 'product'), name='unique_missing_item_order_product'),
+        ),
+    ]
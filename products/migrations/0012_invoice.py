@@ -0,0 +1,24 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_missingitems_unique_order_product'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Invoice',
+            fields=[
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='invoice', serialize=False, to='products.order')),
+                ('pdf', models.FileField(upload_to='invoices/')),
+                ('fingerprint', models.CharField(max_length=40)),
+                ('last_modified', models.DateTimeField()),
+                ('rendered_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:35
+
+import hashlib
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_pending_cart_fingerprints(apps, schema_editor):
+    """Calcula el hash de las líneas de las órdenes PENDING existentes (mismo formato que `cart_fingerprint`)."""
+    Order = apps.get_model('products', 'Order')
+    OrderProduct = apps.get_model('products', 'OrderProduct')
+    quantities = defaultdict(dict)
+    lines = OrderProduct.objects.filter(order__status='PENDING').values_list('order_id', 'product_id', 'quantity')
+    for order_id, sku, quantity in lines.iterator():
+        quantities[order_id][str(sku)] = int(quantity)
+
+    orders = [
+        Order(pk=order_id, cart_fingerprint=hashlib.sha1(json.dumps(sorted(skus.items())).encode()).hexdigest())
+        for order_id, skus in quantities.items()
+    ]
+    Order.objects.bulk_update(orders, ['cart_fingerprint'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0013_paymentevent'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='cart_fingerprint',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'status'], name='order_user_status_idx'),
+        ),
+        migrations.RunPython(fill_pending_cart_fingerprints, migrations.RunPython.noop),
+    ]
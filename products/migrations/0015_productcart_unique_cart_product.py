@@ -0,0 +1,33 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:36
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_cart_items(apps, schema_editor):
+    """Une las filas repetidas de (carrito, producto): conserva la más antigua con la suma de las cantidades."""
+    ProductCart = apps.get_model('products', 'ProductCart')
+    duplicates = (
+        ProductCart.objects.values('cart_id', 'product_id')
+        .annotate(keep_id=Min('id'), total_quantity=Sum('quantity'), rows=Count('id'))
+        .filter(rows__gt=1)
+    )
+    for duplicate in list(duplicates):
+        rows = ProductCart.objects.filter(cart_id=duplicate['cart_id'], product_id=duplicate['product_id'])
+        rows.filter(id=duplicate['keep_id']).update(quantity=duplicate['total_quantity'])
+        rows.exclude(id=duplicate['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0014_order_cart_fingerprint'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_cart_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='productcart',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='unique_product_cart_cart_product'),
+        ),
+    ]
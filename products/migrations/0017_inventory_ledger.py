@@ -0,0 +1,53 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def snapshot_current_stock(apps, schema_editor):
+    """Punto de partida del libro: un snapshot por producto con su stock actual."""
+    Product = apps.get_model('products', 'Product')
+    InventorySnapshot = apps.get_model('products', 'InventorySnapshot')
+    InventorySnapshot.objects.bulk_create(
+        (InventorySnapshot(product_id=sku, stock=stock, last_movement_id=0)
+         for sku, stock in Product.objects.values_list('sku', 'stock').iterator()),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0016_stockreservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('PURCHASE', 'PURCHASE'), ('SALE', 'SALE'), ('ADJUSTMENT', 'ADJUSTMENT')], max_length=20)),
+                ('quantity', models.IntegerField()),
+                ('reference', models.CharField(blank=True, max_length=50)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movements', to='products.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'id'], name='movement_product_id_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='InventorySnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock', models.IntegerField()),
+                ('last_movement_id', models.BigIntegerField(default=0)),
+                ('taken_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='products.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', '-last_movement_id'], name='snapshot_product_latest_idx')],
+            },
+        ),
+        migrations.RunPython(snapshot_current_stock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0017_inventory_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyticsWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_movement_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CostState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(choices=[('FIFO', 'FIFO'), ('AVERAGE', 'AVERAGE')], max_length=10)),
+                ('quantity', models.IntegerField(default=0)),
+                ('average_cost', models.FloatField(default=0)),
+                ('layers', models.JSONField(blank=True, default=list)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cost_states', to='products.product')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('product', 'method'), name='unique_cost_state_product_method')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MarginRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(choices=[('FIFO', 'FIFO'), ('AVERAGE', 'AVERAGE')], max_length=10)),
+                ('period', models.DateField()),
+                ('quantity_sold', models.IntegerField(default=0)),
+                ('revenue', models.FloatField(default=0)),
+                ('cogs', models.FloatField(default=0)),
+                ('adjustment_cost', models.FloatField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='margin_rollups', to='products.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['method', 'period'], name='margin_rollup_period_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'method', 'period'), name='unique_margin_rollup')],
+            },
+        ),
+    ]
@@ -1,34 +1,79 @@
+import hashlib
+import json
 import uuid
-import random
 import string
 from abc import abstractmethod
 
 from django.core.validators import RegexValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Sum, Value
+from django.db.models.functions import Coalesce
+
+ID_ALPHABET = string.ascii_uppercase
+ID_SPACE = 26 * 26 * 10  # Combinaciones posibles del prefijo XX9
+# Multiplicador coprimo con ID_SPACE: recorre todo el espacio sin repetir y evita IDs consecutivos
+ID_STRIDE = 2731
+ID_OFFSET = 1237
+ID_BATCH = 10
+
+
+class IdSpaceExhausted(Exception):
+    """No quedan prefijos XX9 libres para el DNI dado."""
+
+
+class IdSequence(models.Model):
+    """
+    Secuencia persistida por ámbito (tipo de documento + DNI) usada para asignar IDs sin colisiones.
+    La fila se bloquea con `select_for_update` mientras se asigna el siguiente valor.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    last_value = models.IntegerField(default=-1)
+
+    def __str__(self):
+        return f"IdSequence {self.name} | Last value {self.last_value}"
+
+
+def encode_id_prefix(value):
+    """Convierte un valor de la secuencia (0..ID_SPACE-1) en un prefijo XX9 pseudoaleatorio."""
+    n = (value * ID_STRIDE + ID_OFFSET) % ID_SPACE
+    return f"{ID_ALPHABET[n // 260]}{ID_ALPHABET[(n // 10) % 26]}{n % 10}"
+
 
 def generate_unique_id(user_dni, purchase=False):
     """
     Genera un ID único con los siguientes formatos:
     - Orden: "ECCXX9YYYYYYYY" (XX = letras, 9 = número, YYYYYYYY = DNI)
-    - Compra: "COMP-ECCXX9YY" (XX = letras, 9 = número, YY = últimos 2 dígitos del DNI)
+    - Compra: "COMP-ECCXX9YYYY" (XX = letras, 9 = número, YYYY = últimos 4 dígitos del DNI)
+
+    El prefijo XX9 sale de una `IdSequence` por DNI bloqueada durante la asignación, así dos
+    peticiones concurrentes nunca obtienen el mismo ID. Los IDs heredados (generados al azar)
+    se descartan revisando un lote de candidatos en una sola consulta.
     """
+    if purchase:
+        model, scope = Purchase, f"purchase:{str(user_dni)[-4:]}"
+        build = lambda prefix: f"COMP-ECC{prefix}{str(user_dni)[-4:]}"
+    else:
+        model, scope = Order, f"order:{user_dni}"
+        build = lambda prefix: f"ECC{prefix}{user_dni}"
 
-    while True:
-        if purchase:
-            # Prefijo para compras: COMP-ECCXX9YY (últimos 2 dígitos del DNI)
-            prefix = f"{random.choice(string.ascii_uppercase)}{random.choice(string.ascii_uppercase)}{random.randint(0, 9)}"
-            unique_id = f"COMP-ECC{prefix}{str(user_dni)[-4:]}"  # Últimos 2 dígitos del DNI
+    with transaction.atomic():
+        sequence, _ = IdSequence.objects.select_for_update().get_or_create(name=scope)
+        next_value = sequence.last_value + 1
 
-            if not Purchase.objects.filter(id=unique_id).exists():
-                return unique_id
+        while next_value < ID_SPACE:
+            values = range(next_value, min(next_value + ID_BATCH, ID_SPACE))
+            candidates = {build(encode_id_prefix(value)): value for value in values}
+            taken = set(model.objects.filter(id__in=candidates).values_list("id", flat=True))
 
-        else:
-            # Prefijo para órdenes: ECCXX9YYYYYYYY
-            prefix = f"{random.choice(string.ascii_uppercase)}{random.choice(string.ascii_uppercase)}{random.randint(0, 9)}"
-            unique_id = f"ECC{prefix}{user_dni}"
+            for unique_id, value in candidates.items():
+                if unique_id not in taken:
+                    sequence.last_value = value
+                    sequence.save(update_fields=["last_value"])
+                    return unique_id
 
-            if not Order.objects.filter(id=unique_id).exists():
-                return unique_id
+            next_value = values[-1] + 1
+
+    raise IdSpaceExhausted(f"No hay IDs disponibles para el ámbito {scope}")
 
 
 options = (
@@ -93,6 +138,13 @@ class Product(models.Model):
         upload_to="products/", default="products/dummie_image.jpeg"
     )
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Stock leído de la base: al guardar, la diferencia se registra como ajuste de inventario
+        instance._loaded_stock = instance.__dict__.get("stock")
+        return instance
+
     def __str__(self):
         return f"Product: {self.name} (SKU: {self.sku}, Stock: {self.stock} KG, Price: ${self.price})"
 
@@ -114,6 +166,11 @@ class ProductCart(models.Model):
     quantity = models.IntegerField(default=1)
     measure_unity = models.ForeignKey(UnitOfMeasure, blank=True, null=True, on_delete=models.SET_NULL, verbose_name="unity")
 
+    class Meta:
+        constraints = [
+            # Un producto aparece una sola vez por carrito; agregarlo de nuevo incrementa la cantidad
+            models.UniqueConstraint(fields=["cart", "product"], name="unique_product_cart_cart_product"),
+        ]
 
     def __str__(self):
         return f"ProductCart: {self.product.name} x{self.quantity} in {self.cart.name}"
@@ -137,7 +194,16 @@ class Order(models.Model):
     creation_date = models.DateTimeField(auto_now_add=True)
     last_updated = models.DateTimeField(auto_now=True)
     status = models.CharField(max_length=20, choices=STATUS, default="PENDING")
+    # Hash de las líneas (SKU, cantidad), ver `cart_fingerprint`
+    cart_fingerprint = models.CharField(max_length=40, blank=True, default="")
 
+    class Meta:
+        indexes = [
+            # Soporta la paginación keyset del dashboard de órdenes
+            models.Index(fields=["-creation_date", "-id"], name="order_creation_id_idx"),
+            # Orden pendiente de un usuario (checkout y detección de cambios del carrito)
+            models.Index(fields=["user", "status"], name="order_user_status_idx"),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.id:  # Solo generar el ID si no existe
@@ -158,10 +224,116 @@ class OrderProduct(models.Model):
     measure_unity = models.ForeignKey(UnitOfMeasure, blank=True, null=True, on_delete=models.SET_NULL,
                                       verbose_name="unity")
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        refresh_cart_fingerprint(self.order_id)
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        refresh_cart_fingerprint(self.order_id)
+        return result
+
     def __str__(self):
         return f"OrderProduct: {self.product.name} (x{self.quantity}) in Order {self.order.pk}"
 
 
+def cart_fingerprint(lines):
+    """
+    Hash del contenido de un carrito/orden a partir de pares `(sku, cantidad)`.
+    No depende del orden de las líneas; un carrito vacío retorna "".
+    """
+    quantities = {str(sku): int(quantity) for sku, quantity in lines}
+    if not quantities:
+        return ""
+    return hashlib.sha1(json.dumps(sorted(quantities.items())).encode()).hexdigest()
+
+
+def refresh_cart_fingerprint(order_id):
+    """
+    Recalcula `Order.cart_fingerprint` desde las líneas guardadas.
+    `save()`/`delete()` de `OrderProduct` lo llaman solos; las escrituras en bloque
+    (`bulk_create`, `bulk_update`, `QuerySet.delete`) deben actualizarlo explícitamente.
+    """
+    lines = OrderProduct.objects.filter(order_id=order_id).values_list("product_id", "quantity")
+    fingerprint = cart_fingerprint(lines)
+    Order.objects.filter(pk=order_id).update(cart_fingerprint=fingerprint)
+    return fingerprint
+
+
+class StockReservation(models.Model):
+    """
+    Reserva temporal de stock de una orden pendiente, creada al iniciar el pago.
+    El stock disponible de un producto es `stock` menos sus reservas vigentes (`expires_at` futuro);
+    al confirmarse el pago la reserva se convierte en descuento de stock y se elimina.
+    """
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="reservations")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="reservations")
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["order", "product"], name="unique_reservation_order_product"),
+        ]
+        indexes = [
+            # Suma de reservas vigentes por producto y barrido de reservas vencidas
+            models.Index(fields=["product", "expires_at"], name="reservation_product_exp_idx"),
+        ]
+
+    def __str__(self):
+        return f"StockReservation {self.order_id} | {self.product_id} x{self.quantity} | Expires {self.expires_at}"
+
+
+class InventoryMovement(models.Model):
+    """
+    Movimiento de inventario (solo se agregan filas, nunca se modifican).
+    `quantity` es positiva para entradas y negativa para salidas.
+    """
+    PURCHASE = "PURCHASE"
+    SALE = "SALE"
+    ADJUSTMENT = "ADJUSTMENT"
+    KINDS = (
+        (PURCHASE, PURCHASE),
+        (SALE, SALE),
+        (ADJUSTMENT, ADJUSTMENT),
+    )
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="movements")
+    kind = models.CharField(max_length=20, choices=KINDS)
+    quantity = models.IntegerField()
+    reference = models.CharField(max_length=50, blank=True)  # compra, orden u origen del ajuste
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Movimientos de un producto posteriores a su último snapshot
+            models.Index(fields=["product", "id"], name="movement_product_id_idx"),
+        ]
+
+    def __str__(self):
+        return f"InventoryMovement {self.id} | {self.kind} | {self.product_id} {self.quantity:+d} | {self.reference}"
+
+
+class InventorySnapshot(models.Model):
+    """
+    Stock de un producto según el libro de inventario hasta el movimiento `last_movement_id` inclusive.
+    Stock actual = último snapshot + movimientos con id mayor.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="snapshots")
+    stock = models.IntegerField()
+    last_movement_id = models.BigIntegerField(default=0)
+    taken_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["product", "-last_movement_id"], name="snapshot_product_latest_idx"),
+        ]
+
+    def __str__(self):
+        return f"InventorySnapshot {self.product_id} | Stock {self.stock} | Up to movement {self.last_movement_id}"
+
+
 class ProductReview(models.Model):
     user = models.ForeignKey('users.User', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -239,6 +411,47 @@ class Payment(models.Model):
         return f"Payment {self.id} | {self.payment_status} | ${self.payment_amount}"
 
 
+class PaymentEvent(models.Model):
+    """
+    Notificación recibida por el webhook de MercadoPago.
+    Se guarda tal cual llega (deduplicada por `event_id`) y un worker en segundo plano
+    la aplica sobre `Payment`/`Order`; `processed_at` queda en null mientras esté pendiente.
+    """
+    event_id = models.CharField(max_length=100, unique=True)
+    topic = models.CharField(max_length=50)
+    action = models.CharField(max_length=50, blank=True)
+    resource_id = models.CharField(max_length=50, blank=True)
+    payload = models.JSONField(default=dict)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # El worker busca los eventos pendientes en orden de llegada
+            models.Index(fields=["processed_at", "id"], name="paymentevent_pending_idx"),
+        ]
+
+    def __str__(self):
+        return f"PaymentEvent {self.event_id} | {self.topic} {self.resource_id} | Processed {self.processed_at}"
+
+
+class Invoice(models.Model):
+    """
+    Factura PDF ya renderizada de una orden pagada.
+    `fingerprint` resume los datos usados al renderizarla; si cambian, el PDF se regenera.
+    """
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, primary_key=True, related_name="invoice")
+    pdf = models.FileField(upload_to="invoices/")
+    fingerprint = models.CharField(max_length=40)
+    last_modified = models.DateTimeField()
+    rendered_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Invoice {self.order_id} | {self.fingerprint[:8]} | Rendered {self.rendered_at}"
+
+
 class Coupon(models.Model):
     created_by = models.ForeignKey('users.User', null=True, blank=True, on_delete=models.CASCADE)
     coupon_code = models.CharField(max_length=15)
@@ -278,10 +491,18 @@ class Purchase(models.Model):
         super().save(*args, **kwargs)
 
     def update_totals(self):
-        """Recalcula el total de la compra y la ganancia estimada."""
-        total_cost = sum(item.subtotal() for item in self.purchase_items.all())
-        self.total_amount = total_cost
-        self.estimated_profit = sum(item.estimated_profit() for item in self.purchase_items.all())
+        """
+        Recalcula el total de la compra y la ganancia estimada con un solo agregado SQL.
+        El porcentaje de venta de cada item reemplaza al global cuando está definido.
+        """
+        subtotal = F("quantity") * F("purchase_price")
+        sell_percentage = Coalesce(F("sell_percentage"), Value(float(self.global_sell_percentage)))
+        totals = self.purchase_items.aggregate(
+            total=Coalesce(Sum(subtotal, output_field=models.FloatField()), Value(0.0)),
+            profit=Coalesce(Sum(subtotal * sell_percentage / 100, output_field=models.FloatField()), Value(0.0)),
+        )
+        self.total_amount = totals["total"]
+        self.estimated_profit = totals["profit"]
         self.save()
 
     def __str__(self):
@@ -337,5 +558,69 @@ class MissingItems(models.Model):
     missing_quantity = models.IntegerField(default=0)
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="pending_order")
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["order", "product"], name="unique_missing_item_order_product"),
+        ]
+
+    def __str__(self):
+        return f"Item {self.product.sku} | Order {self.order.id} | Missing {self.missing_quantity}"
+
+class CostState(models.Model):
+    """
+    Estado del costeo de inventario de un producto para un método (FIFO o promedio ponderado),
+    hasta el último movimiento procesado por `refresh_margin_rollups`.
+    `layers` son las capas FIFO pendientes `[[cantidad, costo unitario], ...]` (la más antigua primero).
+    """
+    FIFO = "FIFO"
+    AVERAGE = "AVERAGE"
+    METHODS = (
+        (FIFO, FIFO),
+        (AVERAGE, AVERAGE),
+    )
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="cost_states")
+    method = models.CharField(max_length=10, choices=METHODS)
+    quantity = models.IntegerField(default=0)  # Negativa si se vendió más de lo que entró
+    average_cost = models.FloatField(default=0)
+    layers = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "method"], name="unique_cost_state_product_method"),
+        ]
+
+    def __str__(self):
+        return f"CostState {self.product_id} | {self.method} | Qty {self.quantity} | Avg ${self.average_cost}"
+
+
+class MarginRollup(models.Model):
+    """Ventas, costo de lo vendido y margen realizado por producto y día, para un método de costeo."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="margin_rollups")
+    method = models.CharField(max_length=10, choices=CostState.METHODS)
+    period = models.DateField()
+    quantity_sold = models.IntegerField(default=0)
+    revenue = models.FloatField(default=0)
+    cogs = models.FloatField(default=0)
+    adjustment_cost = models.FloatField(default=0)  # Costo de salidas que no son ventas (ajustes, devoluciones)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "method", "period"], name="unique_margin_rollup"),
+        ]
+        indexes = [
+            models.Index(fields=["method", "period"], name="margin_rollup_period_idx"),
+        ]
+
+    def __str__(self):
+        return f"MarginRollup {self.product_id} | {self.method} | {self.period} | ${self.revenue - self.cogs}"
+
+
+class AnalyticsWatermark(models.Model):
+    """Último movimiento de inventario procesado por cada proceso de rollup incremental."""
+    name = models.CharField(max_length=50, unique=True)
+    last_movement_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
     def __str__(self):
-        return f"Item {self.product.sku} | Order {self.order.id} | Missing {self.missing_quantity}"
\ No newline at end of file
+        return f"AnalyticsWatermark {self.name} | Movement {self.last_movement_id}"
@@ -1,9 +1,9 @@
 from django.db import transaction
-from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.views import APIView, Response
 from rest_framework import status
-from products.models import Order, OrderProduct, Payment, UnitOfMeasure, Product
+from products.models import Order, OrderProduct, Payment, UnitOfMeasure, Product, cart_fingerprint
+from products.pagination import get_list_paginator
 from products.permissions import IsAdminOnly, CanViewOrder
 from users.models import User
 from products.serializers import OrderSerializer
@@ -96,6 +96,8 @@ class AdminOrderCreateView(APIView):
                 ))
 
             OrderProduct.objects.bulk_create(order_items)
+            order.cart_fingerprint = cart_fingerprint((item.product_id, item.quantity) for item in order_items)
+            Order.objects.filter(pk=order.pk).update(cart_fingerprint=order.cart_fingerprint)
 
         #handle Payment creation
         if data['is_paid']:
@@ -122,7 +124,7 @@ class OrderUserList(APIView):
 
         try:
             user = User.objects.get(dni = user_id)
-            orders = Order.objects.filter(user = user)
+            orders = OrderSerializer.setup_eager_loading(Order.objects.filter(user = user))
             serializer = OrderSerializer(orders, many = True)
             return Response(serializer.data, status = status.HTTP_200_OK)
         except User.DoesNotExist:
@@ -196,8 +198,8 @@ class OrdersDashboardView(APIView):
     permission_classes = [IsAdminUser]
     def get(self, request):
         try:
-            queryset = Order.objects.all()
-            paginator = LimitOffsetPagination()
+            queryset = OrderSerializer.setup_eager_loading(Order.objects.all())
+            paginator = get_list_paginator(request, ordering=("-creation_date", "-id"))
             paginated_queryset = paginator.paginate_queryset(queryset, request)
             serializer = OrderSerializer(paginated_queryset, many = True)
             return paginator.get_paginated_response(serializer.data)
@@ -214,7 +216,7 @@ class OrderDashboardDetailsView(APIView):
             return Response({"message": "Order ID is required"}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            order = Order.objects.get(pk=order_id)
+            order = OrderSerializer.setup_eager_loading(Order.objects.all()).get(pk=order_id)
 
             # Verificar permisos a nivel de objeto
             self.check_object_permissions(request, order)
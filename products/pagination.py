@@ -0,0 +1,26 @@
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Paginación por cursor (keyset) sobre claves estables.
+    No ejecuta `COUNT(*)` ni recorre filas con `OFFSET`, retorna cursores opacos `next`/`previous`.
+    """
+    page_size_query_param = "limit"
+    max_page_size = 100
+
+    def __init__(self, ordering):
+        self.ordering = ordering
+
+
+def get_list_paginator(request, ordering):
+    """
+    Retorna el paginador a usar en los listados grandes.
+    - `?pagination=cursor` (o un `cursor` recibido en un enlace next/previous) activa el modo keyset
+      ordenado por `ordering`.
+    - En cualquier otro caso se mantiene `LimitOffsetPagination` para los clientes existentes.
+    """
+    params = request.query_params
+    if params.get("pagination") == "cursor" or KeysetPagination.cursor_query_param in params:
+        return KeysetPagination(ordering)
+    return LimitOffsetPagination()
@@ -0,0 +1,176 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from products.carts.summary import bump_cart_version
+from products.models import Cart, Order, OrderProduct, Product, ProductCart, cart_fingerprint, generate_unique_id
+
+
+def items_fingerprint(items):
+    """
+    Hash canónico de los `items` del checkout: no depende del orden de los items
+    ni de campos descriptivos (título, imagen), solo de SKU, cantidad y precio unitario.
+    """
+    canonical = sorted(
+        [str(item.get("sku")), int(item.get("quantity") or 0), float(item.get("unit_price") or 0)]
+        for item in items
+    )
+    return hashlib.sha1(json.dumps(canonical).encode()).hexdigest()
+
+
+def _checkout_version_key(user_id):
+    return f"checkout:version:{user_id}"
+
+
+def get_checkout_version(user_id):
+    version = cache.get(_checkout_version_key(user_id))
+    if version is None:
+        cache.add(_checkout_version_key(user_id), 1, timeout=None)
+        version = cache.get(_checkout_version_key(user_id), 1)
+    return version
+
+
+def bump_checkout_version(user_id):
+    """Invalida las preferencias guardadas del usuario (su carrito cambió o su orden dejó PENDING)."""
+    try:
+        return cache.incr(_checkout_version_key(user_id))
+    except ValueError:
+        cache.add(_checkout_version_key(user_id), 1, timeout=None)
+        return cache.incr(_checkout_version_key(user_id))
+
+
+def _preference_key(user_id, fingerprint):
+    return f"checkout:preference:{user_id}:v{get_checkout_version(user_id)}:{fingerprint}"
+
+
+def get_cached_preference(user_id, fingerprint):
+    """
+    Retorna `{"order", "preference_data"}` si el usuario ya creó una preferencia con los mismos items
+    y su orden sigue PENDING; None en cualquier otro caso (también con `PREFERENCE_CACHE_ENABLED` apagado).
+    """
+    if not settings.PREFERENCE_CACHE_ENABLED:
+        return None
+    key = _preference_key(user_id, fingerprint)
+    payload = cache.get(key)
+    if payload is None:
+        return None
+    # La orden puede haber dejado PENDING con un `update()` que no dispara signals
+    if not Order.objects.filter(pk=payload["order"], status="PENDING").exists():
+        cache.delete(key)
+        return None
+    return payload
+
+
+def cache_preference(user_id, fingerprint, order_id, preference):
+    payload = {"order": order_id, "preference_data": preference}
+    if not settings.PREFERENCE_CACHE_ENABLED:
+        return payload
+    cache.set(_preference_key(user_id, fingerprint), payload, timeout=settings.PREFERENCE_CACHE_TIMEOUT)
+    return payload
+
+
+def merge_checkout_items(items):
+    """
+    Une las líneas repetidas de un mismo SKU sumando sus cantidades (el resto de los campos se toma
+    de la primera). El carrito y la orden tienen una sola fila por producto.
+    Lanza `KeyError`/`TypeError`/`ValueError` si algún item no trae SKU o una cantidad entera.
+    """
+    merged = {}
+    for item in items:
+        sku = str(item["sku"])
+        quantity = int(item["quantity"])
+        if sku in merged:
+            merged[sku]["quantity"] += quantity
+        else:
+            merged[sku] = {**item, "sku": sku, "quantity": quantity}
+    return list(merged.values())
+
+
+def resolve_checkout_products(items):
+    """
+    Resuelve con una sola consulta los productos de los `items` (ya unidos por SKU) enviados al checkout.
+    Retorna `(products, missing_skus)` donde `products` es `{sku: Product}`.
+    """
+    skus = {item["sku"] for item in items}
+    products = Product.objects.in_bulk(list(skus))
+    return products, sorted(skus - products.keys())
+
+
+def _sync_lines(model, existing, items, products, build, fields):
+    """
+    Deja las líneas `existing` (`{sku: fila}`) iguales a `items` con un `bulk_create`,
+    un `bulk_update` y un `delete` como máximo.
+    """
+    to_create, to_update = [], []
+    for item in items:
+        line = existing.get(item["sku"])
+        if line is None:
+            to_create.append(build(products[item["sku"]], item))
+            continue
+        values = {field: item[key] for field, key in fields.items()}
+        if any(getattr(line, field) != value for field, value in values.items()):
+            for field, value in values.items():
+                setattr(line, field, value)
+            to_update.append(line)
+
+    submitted = {item["sku"] for item in items}
+    to_delete = [line.pk for sku, line in existing.items() if sku not in submitted]
+
+    if to_create:
+        model.objects.bulk_create(to_create)
+    if to_update:
+        model.objects.bulk_update(to_update, list(fields))
+    if to_delete:
+        model.objects.filter(pk__in=to_delete).delete()
+
+
+def checkout_order_id(user):
+    """
+    Id de la orden del checkout: el de la orden PENDING del usuario o uno nuevo reservado en la
+    secuencia de IDs. Se conoce antes de crear la preferencia (va como `external_reference`),
+    pero la orden solo se escribe cuando MercadoPago la acepta.
+    Retorna `(order_id, created)`.
+    """
+    order_id = Order.objects.filter(user=user, status="PENDING").values_list("pk", flat=True).first()
+    if order_id is not None:
+        return order_id, False
+    return generate_unique_id(getattr(user, "dni", "00000000")), True
+
+
+def sync_pending_order(user, order_id, items, products):
+    """
+    Sincroniza la orden PENDING `order_id` del usuario (creándola si no existe) y su carrito con
+    los `items` del checkout, todo en una sola transacción y con un número fijo de consultas.
+    Retorna `(order, created)`.
+    """
+    with transaction.atomic():
+        order = Order.objects.select_for_update().filter(pk=order_id, user=user, status="PENDING").first()
+        created = order is None
+        if created:
+            # Si la orden dejó PENDING mientras tanto el id ya existe y el INSERT falla (IntegrityError)
+            order = Order.objects.create(pk=order_id, user=user, status="PENDING")
+
+        existing_order_products = {} if created else {op.product_id: op for op in order.orderproduct_set.all()}
+        _sync_lines(
+            OrderProduct, existing_order_products, items, products,
+            build=lambda product, item: OrderProduct(order=order, product=product, price=item["unit_price"],
+                                                     quantity=item["quantity"]),
+            fields={"quantity": "quantity", "price": "unit_price"},
+        )
+        # Las escrituras en bloque no pasan por `OrderProduct.save()`: el hash se actualiza aquí
+        order.cart_fingerprint = cart_fingerprint((item["sku"], item["quantity"]) for item in items)
+        Order.objects.filter(pk=order.pk).update(cart_fingerprint=order.cart_fingerprint)
+
+        cart = Cart.objects.filter(user=user).first()
+        if cart is not None:
+            _sync_lines(
+                ProductCart, {cp.product_id: cp for cp in cart.productcart_set.all()}, items, products,
+                build=lambda product, item: ProductCart(cart=cart, product=product, quantity=item["quantity"]),
+                fields={"quantity": "quantity"},
+            )
+            transaction.on_commit(lambda: bump_cart_version(cart.pk))
+
+    return order, created
@@ -0,0 +1,82 @@
+import multiprocessing
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db.models import Prefetch
+
+from products.models import OrderProduct, Payment
+from .invoice_worker import init_worker, render_worker
+
+
+def paid_payments(date_from, date_to):
+    """Pagos aprobados en el rango de fechas, con orden, usuario y líneas ya cargados."""
+    return (
+        Payment.objects.filter(payment_status="APPROVED", payment_date__date__gte=date_from,
+                               payment_date__date__lte=date_to)
+        .select_related("order__user")
+        .prefetch_related(Prefetch("order__orderproduct_set",
+                                   queryset=OrderProduct.objects.select_related("product", "measure_unity")))
+        .order_by("payment_date", "pk")
+    )
+
+
+def render_invoices(payments, workers=None):
+    """
+    Renderiza las facturas en un `ProcessPoolExecutor` y las retorna en orden como `(order_id, pdf)`.
+    Cada proceso parsea la plantilla y la hoja de estilos una vez; solo hay `2 * workers`
+    facturas en vuelo, así la memoria no depende del tamaño del rango.
+    """
+    workers = workers or os.cpu_count() or 1
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker,
+                             initargs=(settings.INVOICE_RENDERER,)) as pool:
+        pending = deque()
+        try:
+            for payment in payments.iterator(chunk_size=200):
+                items = list(payment.order.orderproduct_set.all())
+                payment.order._prefetched_objects_cache = {}  # Las líneas viajan solo una vez
+                pending.append(pool.submit(render_worker, payment, items))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+class ZipStream:
+    """Destino de escritura para `zipfile` que acumula los bytes hasta que se consumen."""
+
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_invoice_zip(payments, workers=None):
+    """Genera un ZIP con una `Factura_<orden>.pdf` por pago, entregando los bytes a medida que se renderizan."""
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        for order_id, pdf in render_invoices(payments, workers):
+            archive.writestr(f"Factura_{order_id}.pdf", pdf)
+            yield stream.pop()
+    yield stream.pop()
@@ -0,0 +1,25 @@
+"""
+Funciones que se ejecutan dentro de los procesos del `ProcessPoolExecutor` de facturas.
+El módulo no importa modelos al cargarse para que un proceso nuevo (spawn) pueda
+inicializar Django antes de usarlos.
+"""
+
+
+def init_worker(renderer_path=None):
+    """
+    Inicializa Django y crea el renderer (plantilla y hoja de estilos parseadas) una sola vez por proceso.
+    `renderer_path` llega desde el proceso principal, así el worker usa el mismo `INVOICE_RENDERER`.
+    """
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+    from .invoices import get_renderer
+    get_renderer(renderer_path)
+
+
+def render_worker(payment, items):
+    from .invoices import get_renderer
+    return payment.order_id, get_renderer().render(payment, items)
@@ -0,0 +1,107 @@
+import hashlib
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db.models import Count, F, Max, Sum
+from django.utils import timezone
+from django.template.loader import get_template
+from django.utils.module_loading import import_string
+
+from products.models import Invoice, Payment
+
+INVOICE_STYLESHEET = settings.BASE_DIR / "templates" / "sales_report.css"
+
+
+def get_invoice_payment(order_id):
+    """Retorna el pago de la orden con la orden y su usuario (lanza `Payment.DoesNotExist`)."""
+    return Payment.objects.select_related("order__user").get(order__id=order_id)
+
+
+def invoice_fingerprint(payment):
+    """
+    Huella de los datos que aparecen en la factura: `last_updated` de la orden, el estado, fecha y monto
+    del pago y un agregado de las líneas. Si ninguno cambia, el PDF guardado sigue siendo válido.
+    """
+    order = payment.order
+    lines = order.orderproduct_set.aggregate(
+        line_count=Count("id"), last_line=Max("id"), total_quantity=Sum("quantity"),
+        total_amount=Sum(F("price") * F("quantity")),
+    )
+    raw = "|".join(str(value) for value in (
+        order.pk, order.last_updated, order.status, payment.payment_status, payment.payment_date, payment.payment_amount,
+        payment.payment_method, lines["line_count"], lines["last_line"], lines["total_quantity"], lines["total_amount"],
+    ))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+class InvoiceRenderer:
+    """
+    Mantiene `sales_report.html` y `sales_report.css` ya parseados para reutilizarlos entre facturas.
+    WeasyPrint (y con él pango/cairo) se carga recién al crear el primer renderer, no al importar el módulo.
+    """
+
+    def __init__(self):
+        from weasyprint import CSS, HTML
+
+        self.html = HTML
+        self.template = get_template("sales_report.html")
+        self.stylesheet = CSS(filename=str(INVOICE_STYLESHEET))
+
+    def render(self, payment, items):
+        """Renderiza la factura del pago con WeasyPrint y retorna los bytes del PDF."""
+        # Formatear el total con separación cada 3 cifras (estilo colombiano)
+        total_formatted = "{:,.0f}".format(payment.payment_amount).replace(",", ".")
+        html_string = self.template.render({"sale": payment, "items": items, "total": total_formatted})
+        return self.html(string=html_string).write_pdf(stylesheets=[self.stylesheet])
+
+
+_renderer = None
+
+
+def get_renderer(path=None):
+    """Retorna el renderer del proceso actual (`INVOICE_RENDERER` o `path`), creándolo la primera vez."""
+    global _renderer
+    if _renderer is None:
+        _renderer = import_string(path or settings.INVOICE_RENDERER)()
+    return _renderer
+
+
+def invoice_items(payment):
+    return list(payment.order.orderproduct_set.select_related("product", "measure_unity"))
+
+
+def render_invoice_pdf(payment):
+    """Renderiza `sales_report.html` con WeasyPrint y retorna los bytes del PDF."""
+    return get_renderer().render(payment, invoice_items(payment))
+
+
+def get_or_render_invoice(payment, fingerprint=None):
+    """
+    Retorna la `Invoice` vigente de la orden, renderizando y guardando el PDF solo si no existe
+    o si su huella ya no coincide con los datos actuales.
+    """
+    fingerprint = fingerprint or invoice_fingerprint(payment)
+    invoice = Invoice.objects.filter(order_id=payment.order_id).first()
+    if invoice and invoice.fingerprint == fingerprint and invoice.pdf and invoice.pdf.storage.exists(invoice.pdf.name):
+        return invoice
+
+    pdf = render_invoice_pdf(payment)
+    if invoice is None:
+        invoice = Invoice(order_id=payment.order_id)
+    elif invoice.pdf:
+        invoice.pdf.delete(save=False)
+
+    invoice.fingerprint = fingerprint
+    invoice.last_modified = payment.order.last_updated or timezone.now()
+    invoice.pdf.save(f"Factura_{payment.order_id}.pdf", ContentFile(pdf), save=False)
+    invoice.save()
+    return invoice
+
+
+def generate_invoice(order_id):
+    """Tarea en segundo plano: deja lista la factura de la orden después de registrar el pago."""
+    try:
+        payment = get_invoice_payment(order_id)
+    except Payment.DoesNotExist:
+        return None
+    return get_or_render_invoice(payment)
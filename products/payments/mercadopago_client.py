@@ -0,0 +1,239 @@
+import logging
+import random
+import threading
+import time
+
+import mercadopago
+import requests
+from django.conf import settings
+from mercadopago.config import RequestOptions
+from mercadopago.http import HttpClient
+from requests.adapters import HTTPAdapter
+
+from .mercadopago_emulator import EmulatorAdapter, MercadoPagoEmulator
+
+logger = logging.getLogger(__name__)
+
+MERCADO_PAGO_DEFAULT_BASE_URL = "https://api.mercadopago.com"
+
+# Métodos que se pueden repetir sin efectos duplicados en MercadoPago
+IDEMPOTENT_METHODS = frozenset({"GET", "PUT", "DELETE"})
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class MercadoPagoUnavailable(Exception):
+    """MercadoPago no respondió (timeouts, errores de red o 5xx) o el circuito está abierto."""
+
+
+class CircuitBreaker:
+    """
+    Corta las llamadas a MercadoPago tras `failure_threshold` fallos seguidos.
+    Pasados `reset_timeout` segundos deja pasar una sola llamada de prueba (half-open):
+    si responde bien el circuito se cierra, si falla vuelve a abrirse.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logger.warning("MercadoPago circuit opened after %s failures", self.failures)
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+
+class PooledHttpClient(HttpClient):
+    """
+    Reemplazo del `HttpClient` del SDK de MercadoPago.
+    - Una sola `requests.Session` por proceso: las conexiones keep-alive se reutilizan entre requests.
+    - Timeout de conexión/lectura en cada llamada.
+    - Reintentos con backoff exponencial y jitter solo en llamadas idempotentes
+      (un POST solo se repite si la conexión nunca llegó a establecerse).
+    - Circuit breaker y métricas básicas por proceso.
+    """
+
+    def __init__(self, base_url=MERCADO_PAGO_DEFAULT_BASE_URL, connect_timeout=3.05, read_timeout=10,
+                 max_retries=2, backoff=0.2, backoff_cap=2, pool_size=10, breaker=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_cap = backoff_cap
+        self.breaker = breaker or CircuitBreaker(failure_threshold=5, reset_timeout=30)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._metrics_lock = threading.Lock()
+        self.metrics = {
+            "requests": 0,
+            "retries": 0,
+            "failures": 0,
+            "short_circuited": 0,
+            "total_latency_ms": 0.0,
+        }
+
+    def _count(self, name, value=1):
+        with self._metrics_lock:
+            self.metrics[name] += value
+
+    def _backoff_delay(self, attempt):
+        # "full jitter": espera aleatoria entre 0 y el backoff exponencial del intento
+        return random.uniform(0, min(self.backoff_cap, self.backoff * (2 ** attempt)))
+
+    def _resolve_url(self, url):
+        if url.startswith(MERCADO_PAGO_DEFAULT_BASE_URL):
+            return self.base_url + url[len(MERCADO_PAGO_DEFAULT_BASE_URL):]
+        return url
+
+    def _can_retry(self, method, attempt, error=None):
+        if attempt >= self.max_retries:
+            return False
+        if method in IDEMPOTENT_METHODS:
+            return True
+        return isinstance(error, requests.ConnectTimeout)
+
+    def request(self, method, url, maxretries=None, **kwargs):
+        """
+        Ejecuta la llamada y retorna `{"status", "response"}` como el cliente original del SDK.
+        `timeout` y `maxretries` enviados por el SDK se ignoran: se usan los del cliente.
+        """
+        kwargs.pop("timeout", None)
+        url = self._resolve_url(url)
+        attempt = 0
+
+        while True:
+            if not self.breaker.allow():
+                self._count("short_circuited")
+                raise MercadoPagoUnavailable("MercadoPago circuit is open")
+
+            self._count("requests")
+            started = time.monotonic()
+            try:
+                api_result = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except requests.RequestException as e:
+                self._count("total_latency_ms", (time.monotonic() - started) * 1000)
+                self._count("failures")
+                self.breaker.record_failure()
+                if not self._can_retry(method, attempt, e):
+                    raise MercadoPagoUnavailable(str(e)) from e
+            else:
+                self._count("total_latency_ms", (time.monotonic() - started) * 1000)
+                if api_result.status_code not in RETRY_STATUSES:
+                    self.breaker.record_success()
+                    return {"status": api_result.status_code, "response": self._parse(api_result)}
+
+                self._count("failures")
+                self.breaker.record_failure()
+                if not self._can_retry(method, attempt):
+                    return {"status": api_result.status_code, "response": self._parse(api_result)}
+
+            self._count("retries")
+            time.sleep(self._backoff_delay(attempt))
+            attempt += 1
+
+    @staticmethod
+    def _parse(api_result):
+        try:
+            return api_result.json()
+        except ValueError:
+            return {"message": api_result.text}
+
+    def stats(self):
+        with self._metrics_lock:
+            metrics = dict(self.metrics)
+        calls = metrics["requests"]
+        metrics["avg_latency_ms"] = round(metrics.pop("total_latency_ms") / calls, 2) if calls else 0
+        metrics["circuit"] = self.breaker.state
+        return metrics
+
+
+_sdk = None
+_sdk_lock = threading.Lock()
+
+
+def build_http_client():
+    """
+    Construye el cliente HTTP según la configuración.
+    Con `MERCADO_PAGO_EMULATOR` las llamadas las atiende un emulador en el mismo proceso.
+    """
+    client = PooledHttpClient(
+        base_url=settings.MERCADO_PAGO_API_BASE_URL,
+        connect_timeout=settings.MERCADO_PAGO_CONNECT_TIMEOUT,
+        read_timeout=settings.MERCADO_PAGO_READ_TIMEOUT,
+        max_retries=settings.MERCADO_PAGO_MAX_RETRIES,
+        pool_size=settings.MERCADO_PAGO_POOL_SIZE,
+        breaker=CircuitBreaker(
+            failure_threshold=settings.MERCADO_PAGO_BREAKER_THRESHOLD,
+            reset_timeout=settings.MERCADO_PAGO_BREAKER_RESET_SECONDS,
+        ),
+    )
+    if settings.MERCADO_PAGO_EMULATOR:
+        emulator = MercadoPagoEmulator(
+            latency_ms=settings.MERCADO_PAGO_EMULATOR_LATENCY_MS,
+            jitter_ms=settings.MERCADO_PAGO_EMULATOR_JITTER_MS,
+            error_rate=settings.MERCADO_PAGO_EMULATOR_ERROR_RATE,
+        )
+        client.session.mount(client.base_url, EmulatorAdapter(emulator))
+    return client
+
+
+def get_mercadopago_sdk():
+    """
+    Retorna el SDK de MercadoPago compartido por el proceso.
+    Se construye una sola vez para reutilizar el pool de conexiones y el estado del circuit breaker.
+    """
+    global _sdk
+    if _sdk is None:
+        with _sdk_lock:
+            if _sdk is None:
+                _sdk = mercadopago.SDK(
+                    settings.MERCADO_PAGO_ACCESS_TOKEN,
+                    http_client=build_http_client(),
+                    request_options=RequestOptions(max_retries=0),
+                )
+    return _sdk
+
+
+def reset_mercadopago_sdk():
+    """Descarta el SDK compartido; el próximo uso lo reconstruye con la configuración actual."""
+    global _sdk
+    with _sdk_lock:
+        _sdk = None
+
+
+def mercadopago_client_stats():
+    """Retorna las métricas del cliente compartido (o ceros si todavía no se usó)."""
+    if _sdk is None:
+        return {"requests": 0, "retries": 0, "failures": 0, "short_circuited": 0,
+                "avg_latency_ms": 0, "circuit": CLOSED}
+    return _sdk.http_client.stats()
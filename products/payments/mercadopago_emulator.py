@@ -0,0 +1,202 @@
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+PAYMENT_PATH = re.compile(r"^/v1/payments/(?P<id>\d+)$")
+PREFERENCE_PATH = re.compile(r"^/checkout/preferences/(?P<id>[\w-]+)$")
+
+
+class MercadoPagoEmulator:
+    """
+    Imitación local de la API de MercadoPago para pruebas de carga/integración sin red.
+    Implementa las llamadas que usa el checkout:
+    - `POST /checkout/preferences` y `GET /checkout/preferences/<id>`
+    - `POST /v1/payments` y `GET /v1/payments/<id>`
+    Cada respuesta tarda `latency_ms` (+ hasta `jitter_ms`) y falla con 500 en una fracción `error_rate`
+    de las llamadas. Un POST repetido con el mismo `x-idempotency-key` retorna la respuesta original.
+    """
+
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.preferences = {}
+        self.payments = {}
+        self.idempotent_responses = {}
+        self._lock = threading.Lock()
+        self._next_payment_id = 1000000000
+
+    def next_delay(self):
+        """Segundos que debe tardar la próxima respuesta."""
+        with self._lock:
+            jitter = self.random.uniform(0, self.jitter_ms) if self.jitter_ms else 0
+        return (self.latency_ms + jitter) / 1000
+
+    def handle(self, method, path, headers, body, delay=None):
+        """Atiende una llamada y retorna `(status, payload)`."""
+        time.sleep(self.next_delay() if delay is None else delay)
+
+        with self._lock:
+            if self.error_rate and self.random.random() < self.error_rate:
+                return 500, {"message": "emulated internal error", "error": "internal_error", "status": 500}
+
+            try:
+                data = json.loads(body) if body else {}
+            except ValueError:
+                return 400, {"message": "invalid JSON body", "error": "bad_request", "status": 400}
+
+            if method == "POST":
+                key = (path, headers.get("x-idempotency-key"))
+                if key[1] and key in self.idempotent_responses:
+                    return self.idempotent_responses[key]
+                result = self._create(path, data)
+                if key[1] and result[0] < 500:
+                    self.idempotent_responses[key] = result
+                return result
+
+            if method == "GET":
+                return self._retrieve(path)
+
+        return 405, {"message": "method not allowed", "error": "method_not_allowed", "status": 405}
+
+    def _create(self, path, data):
+        if path == "/checkout/preferences":
+            return self._create_preference(data)
+        if path == "/v1/payments":
+            return self._create_payment(data)
+        return 404, {"message": "resource not found", "error": "not_found", "status": 404}
+
+    def _retrieve(self, path):
+        match = PAYMENT_PATH.match(path)
+        if match and int(match["id"]) in self.payments:
+            return 200, self.payments[int(match["id"])]
+        match = PREFERENCE_PATH.match(path)
+        if match and match["id"] in self.preferences:
+            return 200, self.preferences[match["id"]]
+        return 404, {"message": "resource not found", "error": "not_found", "status": 404}
+
+    def _create_preference(self, data):
+        items = data.get("items") or []
+        if not items or any("unit_price" not in item or "quantity" not in item for item in items):
+            return 400, {"message": "items needed", "error": "invalid_items", "status": 400}
+
+        preference_id = f"emulator-{uuid.uuid4()}"
+        preference = {
+            **data,
+            "id": preference_id,
+            "init_point": f"https://emulator.local/checkout?pref_id={preference_id}",
+            "sandbox_init_point": f"https://sandbox.emulator.local/checkout?pref_id={preference_id}",
+            "date_created": time.strftime("%Y-%m-%dT%H:%M:%S.000-04:00"),
+        }
+        self.preferences[preference_id] = preference
+        return 201, preference
+
+    def _create_payment(self, data):
+        try:
+            amount = float(data.get("transaction_amount"))
+        except (TypeError, ValueError):
+            amount = 0
+        if amount <= 0 or not data.get("payment_method_id"):
+            return 400, {"message": "transaction_amount and payment_method_id are required",
+                         "error": "bad_request", "status": 400}
+
+        self._next_payment_id += 1
+        payment = {
+            "id": self._next_payment_id,
+            "status": "approved",
+            "status_detail": "accredited",
+            "transaction_amount": amount,
+            "installments": data.get("installments", 1),
+            "payment_method_id": data["payment_method_id"],
+            "payment_type_id": data.get("payment_type_id", "credit_card"),
+            "external_reference": data.get("external_reference"),
+            "description": data.get("description"),
+            "payer": data.get("payer", {}),
+            "date_created": time.strftime("%Y-%m-%dT%H:%M:%S.000-04:00"),
+            "date_approved": time.strftime("%Y-%m-%dT%H:%M:%S.000-04:00"),
+        }
+        self.payments[payment["id"]] = payment
+        return 201, payment
+
+
+class EmulatorAdapter(BaseAdapter):
+    """
+    Adaptador de `requests` que responde desde un `MercadoPagoEmulator` en el mismo proceso.
+    Se monta en la sesión del cliente compartido, así los reintentos, el circuit breaker
+    y las métricas se ejercitan igual que contra la API real.
+    """
+
+    def __init__(self, emulator):
+        super().__init__()
+        self.emulator = emulator
+
+    def send(self, request, timeout=None, **kwargs):
+        delay = self.emulator.next_delay()
+        read_timeout = timeout[1] if isinstance(timeout, tuple) else timeout
+        if read_timeout is not None and delay > read_timeout:
+            time.sleep(read_timeout)
+            raise requests.ReadTimeout(f"emulator did not answer within {read_timeout}s", request=request)
+
+        body = request.body.decode() if isinstance(request.body, bytes) else request.body
+        status, payload = self.emulator.handle(request.method, urlsplit(request.url).path,
+                                               request.headers, body, delay=delay)
+
+        response = requests.Response()
+        response.status_code = status
+        response.reason = "Emulated"
+        response.headers = CaseInsensitiveDict({"Content-Type": "application/json"})
+        response._content = json.dumps(payload).encode()
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+class EmulatorRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode() if length else ""
+        status, payload = self.server.emulator.handle(self.command, urlsplit(self.path).path, self.headers, body)
+        content = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+    def log_message(self, *args):
+        pass
+
+
+class EmulatorServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # el cliente cortó la conexión (p. ej. por su timeout de lectura): no es un error del emulador
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def make_emulator_server(emulator, host="127.0.0.1", port=0):
+    """Crea un servidor HTTP (multi-hilo) que atiende con `emulator`. `port=0` elige un puerto libre."""
+    server = EmulatorServer((host, port), EmulatorRequestHandler)
+    server.emulator = emulator
+    return server
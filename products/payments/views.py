@@ -1,32 +1,59 @@
 import uuid
-from io import BytesIO
-from django.template.loader import render_to_string
-from django.http import HttpResponse
-from weasyprint import HTML
-
-from rest_framework.permissions import IsAuthenticated
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, FileResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date
+from django.utils.http import http_date, quote_etag
+
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from rest_framework.views import APIView, Response
 from rest_framework import status
 
 import mercadopago
-from decouple import config
-from users.models import User
-from products.models import (
-    Shipment,
-    Payment, Order, OrderProduct, Product, ProductCart, Cart
-)
-from products.serializers import (
-    ShipmentSerializer,
-    PaymentSerializer
+from products.models import Payment, Order
+from products.serializers import PaymentSerializer
+from .checkout import (
+    cache_preference, checkout_order_id, get_cached_preference, items_fingerprint, merge_checkout_items,
+    resolve_checkout_products, sync_pending_order,
 )
-
-MP_ACCESS_TOKEN = config("MERCADO_PAGO_ACCESS_TOKEN")
+from .invoice_batch import paid_payments, stream_invoice_zip
+from .invoices import get_invoice_payment, get_or_render_invoice
+from .mercadopago_client import MercadoPagoUnavailable, get_mercadopago_sdk, mercadopago_client_stats
+from .webhooks import process_payment_events, record_notification, verify_signature
+from products.inventory.reservations import InsufficientStock, reserve_order_stock, stock_shortages
+from products.tasks import run_in_background
 
 class CreatePaymentPreference(APIView):
     def post(self, request):
-        mercado_pago = mercadopago.SDK(MP_ACCESS_TOKEN)
-        items = request.data.get("items", [])
-        print(request.data)
+        mercado_pago = get_mercadopago_sdk()
+        try:
+            items = merge_checkout_items(request.data.get("items", []))
+        except (KeyError, TypeError, ValueError):
+            return Response({"detail": "Each item must have a sku and an integer quantity"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Un reintento con los mismos items reutiliza la preferencia y la orden ya creadas
+        fingerprint = items_fingerprint(items)
+        cached = get_cached_preference(request.user.pk, fingerprint)
+        if cached is not None:
+            return Response(cached, status=status.HTTP_200_OK)
+
+        # Resolver todos los productos con una sola consulta
+        products, missing_skus = resolve_checkout_products(items)
+        if missing_skus:
+            return Response({"detail": "Products not found", "missing_products": missing_skus},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # La orden se escribe solo si MercadoPago acepta la preferencia; antes solo se conoce su id
+        order_id, created = checkout_order_id(request.user)
+
+        # Si el stock no alcanza se avisa antes de ir a MercadoPago
+        quantities = {item["sku"]: item["quantity"] for item in items}
+        shortages = stock_shortages(quantities, exclude_order=None if created else order_id)
+        if shortages:
+            return Response({"detail": "Insufficient stock", "unavailable": shortages},
+                            status=status.HTTP_409_CONFLICT)
 
         preference_data = {
             "items": items,
@@ -36,120 +63,44 @@ class CreatePaymentPreference(APIView):
                 "pending": "http://localhost:5173/payments/pending/",
             },
             "auto_return": "approved",
+            # Permite al webhook asociar el pago con la orden
+            "external_reference": order_id,
         }
+        if settings.MERCADO_PAGO_NOTIFICATION_URL:
+            preference_data["notification_url"] = settings.MERCADO_PAGO_NOTIFICATION_URL
 
         # Crear la preferencia de pago en MercadoPago
-        preference_response = mercado_pago.preference().create(preference_data)
-
-        if preference_response["status"] == 201:
-            user = request.user
-            cart = Cart.objects.filter(user=user).first()  # Obtener el carrito del usuario
-            pending_order = Order.objects.filter(user=user, status="PENDING").first()
-
-            if not pending_order:
-                # Crear una nueva orden si no hay una pendiente
-                order = Order.objects.create(user=user, status="PENDING")
-
-                # Crear lista de objetos para insertar en la BD en una sola operación
-                order_products = []
-                cart_products = []
-
-                for item in items:
-                    product = Product.objects.get(sku=item["sku"])
-                    order_products.append(
-                        OrderProduct(
-                            order=order,
-                            product=product,
-                            price=item["unit_price"],
-                            quantity=item["quantity"],
-                        )
-                    )
-                    cart_products.append(
-                        ProductCart(
-                            cart=cart,
-                            product=product,
-                            quantity=item["quantity"],
-                        )
-                    )
-
-                # Guardar los productos en una sola operación
-                OrderProduct.objects.bulk_create(order_products)
-                ProductCart.objects.bulk_create(cart_products)
-
-                return Response(
-                    {"order": order.pk, "preference_data": preference_response["response"]},
-                    status=status.HTTP_201_CREATED,
-                )
-
-            # Obtener productos actuales de la orden y el carrito
-            existing_order_products = {op.product.sku: op for op in pending_order.orderproduct_set.all()}
-            existing_cart_products = {cp.product.sku: cp for cp in cart.productcart_set.all()}
-            new_product_skus = {item["sku"] for item in items}
-
-            # Listas para `bulk_update()`
-            order_updates = []
-            cart_updates = []
-
-            for item in items:
-                product = Product.objects.get(sku=item["sku"])
-
-                # Actualizar cantidades en la orden
-                if product.sku in existing_order_products:
-                    existing_order_product = existing_order_products[product.sku]
-                    existing_order_product.quantity = item["quantity"]
-                    order_updates.append(existing_order_product)
-                else:
-                    OrderProduct.objects.create(
-                        order=pending_order,
-                        product=product,
-                        price=item["unit_price"],
-                        quantity=item["quantity"],
-                    )
-
-                # Actualizar cantidades en el carrito
-                if product.sku in existing_cart_products:
-                    existing_cart_product = existing_cart_products[product.sku]
-                    existing_cart_product.quantity = item["quantity"]
-                    cart_updates.append(existing_cart_product)
-                else:
-                    ProductCart.objects.create(
-                        cart=cart,
-                        product=product,
-                        quantity=item["quantity"],
-                    )
-
-            # Guardar actualizaciones en una sola operación
-            if order_updates:
-                OrderProduct.objects.bulk_update(order_updates, ["quantity"])
-            if cart_updates:
-                ProductCart.objects.bulk_update(cart_updates, ["quantity"])
-
-            # Eliminar productos que ya no están en la lista enviada
-            order_products_to_remove = [
-                op for sku, op in existing_order_products.items() if sku not in new_product_skus
-            ]
-            cart_products_to_remove = [
-                cp for sku, cp in existing_cart_products.items() if sku not in new_product_skus
-            ]
-
-            if order_products_to_remove:
-                OrderProduct.objects.filter(id__in=[op.id for op in order_products_to_remove]).delete()
-            if cart_products_to_remove:
-                ProductCart.objects.filter(id__in=[cp.id for cp in cart_products_to_remove]).delete()
+        try:
+            preference_response = mercado_pago.preference().create(preference_data)
+        except MercadoPagoUnavailable as e:
+            return Response({"detail": "MercadoPago is unavailable", "error": str(e)},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
-            return Response(
-                {"order": pending_order.pk, "preference_data": preference_response["response"]},
-                status=status.HTTP_200_OK,
-            )
+        if preference_response["status"] != 201:
+            return Response({"detail": "Error creating preference!"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Sincronizar la orden pendiente y el carrito y reservar el stock mientras el cliente paga,
+        # todo en una sola transacción: si el stock ya no alcanza no queda nada escrito
+        try:
+            with transaction.atomic():
+                order, _ = sync_pending_order(request.user, order_id, items, products)
+                reserve_order_stock(order.pk, quantities)
+        except InsufficientStock as e:
+            return Response({"detail": "Insufficient stock", "unavailable": e.shortages},
+                            status=status.HTTP_409_CONFLICT)
+        except IntegrityError:
+            return Response({"detail": "The pending order changed, retry the checkout"},
+                            status=status.HTTP_409_CONFLICT)
 
-        return Response({"detail": "Error creating preference!"}, status=status.HTTP_400_BAD_REQUEST)
+        payload = cache_preference(request.user.pk, fingerprint, order.pk, preference_response["response"])
+        return Response(payload, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
 
 class MercadoPagoPaymentView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request, *args, **kwargs):
-        sdk = mercadopago.SDK(MP_ACCESS_TOKEN)
+        sdk = get_mercadopago_sdk()
         request_options = mercadopago.config.RequestOptions()
         request_options.custom_headers = {
             'x-idempotency-key': request.data.get('idempotency_key', str(uuid.uuid4()))
@@ -185,22 +136,63 @@ class MercadoPagoPaymentView(APIView):
             )
 
         try:
-            payment_response = sdk.payment().create(request.data, request_options)
-            payment = payment_response.get("response", {})
-
             # Obtener la orden del usuario autenticado
             order = Order.objects.filter(user=user, status="PENDING").first()
             if not order:
                 return Response({"error": "No se encontró una orden asociada al usuario"}, status=status.HTTP_404_NOT_FOUND)
 
+            # `external_reference` permite al webhook asociar el pago con la orden
+            provider_data = {**request.data, "external_reference": order.pk}
+            if settings.MERCADO_PAGO_NOTIFICATION_URL:
+                provider_data["notification_url"] = settings.MERCADO_PAGO_NOTIFICATION_URL
+            payment_response = sdk.payment().create(provider_data, request_options)
+            payment = payment_response.get("response", {})
+
             return Response(payment, status=status.HTTP_201_CREATED)
 
+        except MercadoPagoUnavailable as e:
+            return Response(
+                {"error": "MercadoPago is unavailable", "details": str(e)},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
         except Exception as e:
             return Response(
                 {"error": "Payment creation failed", "details": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+class MercadoPagoWebhookView(APIView):
+    """
+    Receive MercadoPago notifications (webhooks and IPN).
+    The event is stored (deduplicated by event ID) and acknowledged right away;
+    a background worker applies it to the payment and the order.
+    """
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def post(self, request):
+        if not verify_signature(request):
+            return Response({"message": "Invalid signature"}, status=status.HTTP_401_UNAUTHORIZED)
+
+        data = request.data if isinstance(request.data, dict) else {}
+        if record_notification(data, request.query_params) is None:
+            return Response({"message": "Unsupported notification"}, status=status.HTTP_400_BAD_REQUEST)
+
+        run_in_background(process_payment_events)
+        return Response(status=status.HTTP_200_OK)
+
+
+class MercadoPagoClientStatsView(APIView):
+    """
+    Return the metrics of the shared MercadoPago client (calls, retries, failures, latency, circuit state).
+    Only accessible to admin users.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(mercadopago_client_stats(), status=status.HTTP_200_OK)
+
+
 #cart details
 class PaymentDetailsViewView(APIView):
     def get(self, request):
@@ -255,31 +247,48 @@ class PaymentCreateView(APIView):
 
 class GenerateSalesReportView(APIView):
     def get(self, request, order_id):
-        """Genera un reporte PDF para una venta específica."""
+        """
+        Retorna la factura PDF de una venta específica.
+        El PDF se sirve desde el almacenamiento y solo se vuelve a renderizar si la orden o el pago cambiaron;
+        responde 304 cuando el cliente ya tiene la versión vigente (ETag = huella de la factura,
+        Last-Modified = cuándo se renderizó).
+        """
         try:
-            sale = Payment.objects.select_related("order").get(order__id=order_id)
-            order = sale.order  # Ya se obtuvo con select_related
-            order_products = order.orderproduct_set.all()
-            total = sum([item.price * item.quantity for item in order_products])
-            total += 5000
-            # Formatear el total con separación cada 3 cifras (estilo colombiano)
-            total_formatted = "{:,.0f}".format(sale.payment_amount).replace(",", ".")
+            sale = get_invoice_payment(order_id)
         except Payment.DoesNotExist:
             return HttpResponse("Pago no encontrado", status=404)
-        except Order.DoesNotExist:
-            return HttpResponse("Orden no encontrada", status=404)
-
-        # Renderizar la plantilla HTML con datos
-        html_string = render_to_string("sales_report.html", {"sale": sale,
-                                                                                "items": order_products,
-                                                                                "total": total_formatted})
-
-        # Generar PDF
-        pdf_file = BytesIO()
-        HTML(string=html_string).write_pdf(pdf_file)
-
-        # Responder con el PDF
-        pdf_file.seek(0)
-        response = HttpResponse(pdf_file, content_type="application/pdf")
-        response["Content-Disposition"] = f'attachment; filename="Factura_{order.id}.pdf"'
-        return response
\ No newline at end of file
+
+        invoice = get_or_render_invoice(sale)
+        etag = quote_etag(invoice.fingerprint)
+        last_modified = int(invoice.rendered_at.timestamp())
+
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        response = FileResponse(invoice.pdf.open("rb"), content_type="application/pdf",
+                                as_attachment=True, filename=f"Factura_{sale.order_id}.pdf")
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified)
+        return response
+
+
+class GenerateSalesReportBatchView(APIView):
+    """
+    Stream a ZIP with the invoice PDF of every approved payment between `date_from` and `date_to`.
+    Invoices are rendered in parallel in a process pool.
+    Only accessible to admin users.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        date_from = parse_date(request.query_params.get("date_from", ""))
+        date_to = parse_date(request.query_params.get("date_to", ""))
+        if not date_from or not date_to:
+            return Response({"message": "date_from and date_to (YYYY-MM-DD) are required"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        payments = paid_payments(date_from, date_to)
+        response = StreamingHttpResponse(stream_invoice_zip(payments), content_type="application/zip")
+        response["Content-Disposition"] = f'attachment; filename="Facturas_{date_from}_{date_to}.zip"'
+        return response
@@ -0,0 +1,242 @@
+import hashlib
+import hmac
+import logging
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from products.inventory.stock import reverse_order_processing, start_order_processing
+from products.models import Order, Payment, PaymentEvent
+from products.tasks import run_in_background
+from .invoices import generate_invoice
+from .mercadopago_client import MercadoPagoUnavailable, get_mercadopago_sdk
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+EVENT_BATCH_SIZE = 100
+
+# Estados de MercadoPago -> Payment.payment_status
+PAYMENT_STATUS_MAP = {
+    "approved": "APPROVED",
+    "authorized": "IN_PROCESS",
+    "in_process": "IN_PROCESS",
+    "in_mediation": "IN_PROCESS",
+    "pending": "PENDING",
+    "rejected": "REJECTED",
+    "cancelled": "CANCELED",
+    "refunded": "REFUNDED",
+    "charged_back": "CHARGED_BACK",
+}
+
+# Estados que revierten una orden ya pagada (reembolso, cancelación, contracargo)
+REVERSED_PAYMENT_STATUS = {"REFUNDED", "CANCELED", "CHARGED_BACK"}
+
+# payment_type_id de MercadoPago -> Payment.payment_method
+PAYMENT_METHOD_MAP = {
+    "credit_card": "CREDIT_CARD",
+    "debit_card": "DEBIT_CARD",
+    "prepaid_card": "DEBIT_CARD",
+    "bank_transfer": "BANK_TRANSFER",
+    "account_money": "BANK_TRANSFER",
+    "ticket": "CASH",
+    "atm": "CASH",
+}
+
+_worker_lock = threading.Lock()
+
+
+def verify_signature(request):
+    """
+    Valida el header `x-signature` (`ts=...,v1=...`) con `MERCADO_PAGO_WEBHOOK_SECRET`.
+    Sin secreto configurado no se valida nada.
+    """
+    secret = settings.MERCADO_PAGO_WEBHOOK_SECRET
+    if not secret:
+        return True
+
+    parts = dict(
+        part.strip().split("=", 1) for part in request.headers.get("x-signature", "").split(",") if "=" in part
+    )
+    if "ts" not in parts or "v1" not in parts:
+        return False
+
+    data_id = str(request.query_params.get("data.id", "")).lower()
+    manifest = f"id:{data_id};request-id:{request.headers.get('x-request-id', '')};ts:{parts['ts']};"
+    expected = hmac.new(secret.encode(), manifest.encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, parts["v1"])
+
+
+def parse_notification(data, query_params):
+    """
+    Normaliza una notificación (webhook con cuerpo JSON o IPN por query string)
+    a los campos de `PaymentEvent`. Retorna None si no trae el recurso notificado.
+    """
+    topic = data.get("type") or data.get("topic") or query_params.get("type") or query_params.get("topic")
+    resource_id = (data.get("data") or {}).get("id") or query_params.get("data.id") or query_params.get("id")
+    if not topic or not resource_id:
+        return None
+
+    action = data.get("action", "")
+    # Las IPN no traen id propio: el evento se identifica por recurso y acción
+    event_id = str(data["id"]) if data.get("id") else f"{topic}:{resource_id}:{action}"
+    return PaymentEvent(event_id=event_id, topic=topic, action=action, resource_id=str(resource_id),
+                        payload=dict(data))
+
+
+def record_notification(data, query_params):
+    """
+    Guarda la notificación con un solo INSERT; los reenvíos del mismo evento se ignoran.
+    Retorna el evento guardado (o None si la notificación no es válida).
+    """
+    event = parse_notification(data, query_params)
+    if event is not None:
+        PaymentEvent.objects.bulk_create([event], ignore_conflicts=True)
+    return event
+
+
+def _payment_from_provider(order, data):
+    approved_at = parse_datetime(data.get("date_approved") or "") or timezone.now()
+    return Payment(
+        order=order,
+        payment_amount=float(data.get("transaction_amount") or 0),
+        payment_date=approved_at,
+        payment_method=PAYMENT_METHOD_MAP.get(data.get("payment_type_id"), "CREDIT_CARD"),
+        payment_status=PAYMENT_STATUS_MAP[data["status"]],
+    )
+
+
+def _winning_payment(candidates):
+    """
+    Elige, entre los pagos de MercadoPago de una misma orden, el que define su estado:
+    un pago aprobado gana siempre (un intento rechazado no deshace un pago); si no hay ninguno,
+    gana el actualizado más recientemente (`date_last_updated`).
+    """
+    def rank(candidate):
+        data = candidate[1]
+        return data["status"] == "approved", data.get("date_last_updated") or data.get("date_created") or ""
+    return max(candidates, key=rank)
+
+
+def apply_provider_payments(provider_payments):
+    """
+    Aplica un lote de pagos de MercadoPago sobre `Payment`/`Order`.
+    - La orden se identifica por `external_reference`; si una orden trae varios pagos en el lote
+      se aplica el ganador de `_winning_payment` y los demás quedan resueltos por él.
+    - Los pagos existentes actualizan su estado con un solo `bulk_update`.
+    - Un pago aprobado sin registro crea el `Payment` (en un solo `bulk_create`) y mueve la orden
+      a PROCESSING descontando el stock, igual que `update_order_and_stock`.
+    - Un pago reembolsado, cancelado o contracargado revierte la orden (`reverse_order_processing`).
+    Retorna `{resource_id: error}` para los pagos que no se pudieron aplicar.
+    """
+    errors = {}
+    by_order = {}
+    for resource_id, data in provider_payments.items():
+        if data.get("status") not in PAYMENT_STATUS_MAP:
+            errors[resource_id] = f"unknown payment status {data.get('status')!r}"
+        elif not data.get("external_reference"):
+            errors[resource_id] = "payment has no external_reference"
+        else:
+            by_order.setdefault(str(data["external_reference"]), []).append((resource_id, data))
+
+    orders = Order.objects.in_bulk(list(by_order))
+    existing = {payment.order_id: payment for payment in Payment.objects.filter(order_id__in=list(orders))}
+    now = timezone.now()
+    to_create, to_update, approved, reversed_orders = [], [], [], []
+
+    for order_id, candidates in by_order.items():
+        order = orders.get(order_id)
+        if order is None:
+            for resource_id, _ in candidates:
+                errors[resource_id] = f"order {order_id} not found"
+            continue
+
+        resource_id, data = _winning_payment(candidates)
+        status = PAYMENT_STATUS_MAP[data["status"]]
+        payment = existing.get(order_id)
+        if payment is not None:
+            if payment.payment_status != status:
+                payment.payment_status = status
+                payment.last_updated = now
+                to_update.append(payment)
+                if status in REVERSED_PAYMENT_STATUS:
+                    reversed_orders.append(order_id)
+        elif status == "APPROVED":
+            to_create.append(_payment_from_provider(order, data))
+
+        if status == "APPROVED":
+            approved.append(order_id)
+
+    with transaction.atomic():
+        Payment.objects.bulk_create(to_create, ignore_conflicts=True)
+        Payment.objects.bulk_update(to_update, ["payment_status", "last_updated"])
+
+    # bulk_create no dispara `update_order_and_stock`: se aplica la misma transición aquí
+    for order_id in approved:
+        if start_order_processing(order_id):
+            run_in_background(generate_invoice, order_id)
+    for order_id in reversed_orders:
+        reverse_order_processing(order_id)
+
+    return errors
+
+
+def _fetch_provider_payments(sdk, resource_ids):
+    payments, errors = {}, {}
+    for resource_id in resource_ids:
+        try:
+            response = sdk.payment().get(resource_id)
+        except MercadoPagoUnavailable as e:
+            errors[resource_id] = str(e)
+            continue
+        if response["status"] == 200:
+            payments[resource_id] = response["response"]
+        else:
+            errors[resource_id] = f"MercadoPago answered {response['status']}"
+    return payments, errors
+
+
+def process_payment_events(batch_size=EVENT_BATCH_SIZE, sdk=None):
+    """
+    Aplica los eventos pendientes en lotes de `batch_size`.
+    Cada pago se consulta una sola vez por lote aunque haya varias notificaciones suyas.
+    Los eventos que fallan quedan pendientes hasta `MAX_ATTEMPTS` intentos.
+    Retorna la cantidad de eventos procesados.
+    """
+    # Un solo worker por proceso; el que está corriendo recoge los eventos que lleguen mientras tanto
+    if not _worker_lock.acquire(blocking=False):
+        return 0
+
+    try:
+        sdk = sdk or get_mercadopago_sdk()
+        processed = 0
+        last_id = 0
+        while True:
+            events = list(
+                PaymentEvent.objects.filter(processed_at__isnull=True, attempts__lt=MAX_ATTEMPTS, id__gt=last_id)
+                .order_by("id")[:batch_size]
+            )
+            if not events:
+                return processed
+            last_id = events[-1].id
+
+            payment_ids = {event.resource_id for event in events if event.topic == "payment"}
+            provider_payments, errors = _fetch_provider_payments(sdk, payment_ids)
+            errors.update(apply_provider_payments(provider_payments))
+
+            now = timezone.now()
+            done = [event.id for event in events if event.topic != "payment" or event.resource_id not in errors]
+            PaymentEvent.objects.filter(id__in=done).update(processed_at=now, attempts=F("attempts") + 1)
+            for event in events:
+                if event.topic == "payment" and event.resource_id in errors:
+                    logger.warning("Payment event %s failed: %s", event.event_id, errors[event.resource_id])
+                    PaymentEvent.objects.filter(id=event.id).update(
+                        attempts=F("attempts") + 1, last_error=errors[event.resource_id]
+                    )
+            processed += len(done)
+    finally:
+        _worker_lock.release()
@@ -1,9 +1,9 @@
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView, Response
-from django.db import transaction
 from rest_framework import status
-from products.models import Cart, Product, ProductCart, Order, OrderProduct
+from products.models import Cart, Product, ProductCart, Order, cart_fingerprint
 from products.serializers import ProductCartSerializer
+from products.carts.items import add_cart_items, parse_quantity
 from users.models import User
 
 
@@ -40,21 +40,21 @@ class ProductCartCreateView(APIView):
                     status=status.HTTP_404_NOT_FOUND,
                 )
 
-            # Crear ProductCart en una transacción atómica
-            with transaction.atomic():
-                product_carts = []
-                for product_data in products:
-                    sku = product_data["sku"]
-                    quantity = product_data.get("quantity", 1)
-                    product = product_map[sku]
-
-                    product_cart = ProductCart.objects.create(
-                        cart=cart, product=product, quantity=quantity
-                    )
-                    product_carts.append(product_cart)
-
-                serializer = ProductCartSerializer(product_carts, many=True)
-                return Response(serializer.data, status=status.HTTP_201_CREATED)
+            # Un producto ya presente en el carrito incrementa su cantidad (restricción única carrito/producto)
+            quantities = {}
+            for product_data in products:
+                quantity = parse_quantity(product_data.get("quantity", 1))
+                if quantity is None:
+                    return Response({"message": f"Invalid quantity for SKU {product_data['sku']}"},
+                                    status=status.HTTP_400_BAD_REQUEST)
+                quantities[product_data["sku"]] = quantities.get(product_data["sku"], 0) + quantity
+            rows = add_cart_items(cart, quantities)
+
+            product_carts = ProductCart.objects.filter(id__in=[row["id"] for row in rows]).select_related(
+                "cart", "product"
+            )
+            serializer = ProductCartSerializer(product_carts, many=True)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         except Exception as e:
             return Response(
@@ -99,33 +99,35 @@ class ProductCartUserList(APIView):
 
 #edit a product into a single cart
 class ProductCartHasChanged(APIView):
+    """
+    Check whether the submitted cart differs from the user's pending order.
+    Accepts the `fingerprint` returned by a previous call, or the `items` (`sku`, `quantity`),
+    and compares it against the hash stored on the order with a single indexed lookup.
+    """
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
+        fingerprint = request.data.get("fingerprint", None)
         items = request.data.get("items", None)
-        user = request.user
-        print(request.data)
 
-        if not items:
+        if not fingerprint and not items:
             return Response({'message': 'All fields are required'}, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            order = Order.objects.filter(user=user, status="PENDING").first()
-            order_products = OrderProduct.objects.filter(order=order)  # Filtrar todos los productos de la orden
-        except Order.DoesNotExist:
+        if not fingerprint:
+            try:
+                fingerprint = cart_fingerprint((item["sku"], item["quantity"]) for item in items)
+            except (KeyError, TypeError, ValueError):
+                return Response({'message': 'Each item requires sku and quantity'}, status=status.HTTP_400_BAD_REQUEST)
+
+        stored = (
+            Order.objects.filter(user=request.user, status="PENDING")
+            .values_list("cart_fingerprint", flat=True)
+            .first()
+        )
+        if stored is None:
             return Response({'changed': True, 'message': 'No active order found'}, status=status.HTTP_200_OK)
 
-        # Convertir los productos de la orden en un diccionario {product_id: quantity}
-        order_product_map = {op.product.sku: op.quantity for op in order_products}
-
-        # Convertir los productos enviados en un diccionario {product_id: quantity}
-        request_product_map = {item["sku"]: item["quantity"] for item in items}
-
-        # Comparar si las claves (productos) o los valores (cantidades) han cambiado
-        if order_product_map != request_product_map:
-            return Response({'changed': True}, status=status.HTTP_200_OK)
-
-        return Response({'changed': False}, status=status.HTTP_200_OK)
+        return Response({'changed': stored != fingerprint, 'fingerprint': stored}, status=status.HTTP_200_OK)
 
 
 #remove a product into a cart
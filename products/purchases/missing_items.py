@@ -0,0 +1,170 @@
+import logging
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+from django.utils import timezone
+
+from products.cache import get_catalog_version
+from products.models import MissingItems, OrderProduct, PurchaseItem
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_ORDER_STATUS = ["PENDING", "PROCESSING"]
+
+MISSING_ITEMS_VERSION_KEY = "missing-items:version"
+
+
+def get_missing_items_version():
+    version = cache.get(MISSING_ITEMS_VERSION_KEY)
+    if version is None:
+        cache.add(MISSING_ITEMS_VERSION_KEY, 1, timeout=None)
+        version = cache.get(MISSING_ITEMS_VERSION_KEY, 1)
+    return version
+
+
+def bump_missing_items_version():
+    """Invalida la lista de compras guardada (se recalcularon los MissingItems)."""
+    try:
+        return cache.incr(MISSING_ITEMS_VERSION_KEY)
+    except ValueError:
+        cache.add(MISSING_ITEMS_VERSION_KEY, 1, timeout=None)
+        return cache.incr(MISSING_ITEMS_VERSION_KEY)
+
+
+def recompute_missing_items(skus=None):
+    """
+    Recalcula los productos faltantes (MissingItems) de las órdenes PENDING/PROCESSING.
+
+    Los faltantes por (orden, producto) salen de una sola consulta agregada, luego se aplican con
+    un upsert masivo y se eliminan los registros que ya no tienen déficit. Si se reciben `skus`,
+    solo se recalculan esos productos.
+    """
+    lines = OrderProduct.objects.filter(order__status__in=ACTIVE_ORDER_STATUS)
+    existing = MissingItems.objects.all()
+    if skus is not None:
+        skus = list(skus)
+        lines = lines.filter(product_id__in=skus)
+        existing = existing.filter(product_id__in=skus)
+
+    shortfalls = (
+        lines.values("order_id", "product_id", "product__stock")
+        .annotate(requested=Sum("quantity"))
+        .filter(requested__gt=F("product__stock"))
+        .order_by()
+    )
+
+    now = timezone.now()
+    items = [
+        MissingItems(
+            order_id=row["order_id"],
+            product_id=row["product_id"],
+            stock=row["product__stock"],
+            missing_quantity=row["requested"] - row["product__stock"],
+            last_updated=now,
+        )
+        for row in shortfalls
+    ]
+    keep = {(item.order_id, item.product_id) for item in items}
+
+    with transaction.atomic():
+        stale_ids = [
+            pk for pk, order_id, product_id in existing.values_list("id", "order_id", "product_id")
+            if (order_id, product_id) not in keep
+        ]
+        if stale_ids:
+            MissingItems.objects.filter(id__in=stale_ids).delete()
+        if items:
+            MissingItems.objects.bulk_create(
+                items,
+                batch_size=500,
+                update_conflicts=True,
+                unique_fields=["order", "product"],
+                update_fields=["stock", "missing_quantity", "last_updated"],
+            )
+        transaction.on_commit(bump_missing_items_version)
+
+    logger.info("MissingItems recalculados: %s con déficit, %s eliminados (SKUs: %s)",
+                len(items), len(stale_ids), "todos" if skus is None else len(skus))
+    return len(items), len(stale_ids)
+
+
+def recompute_missing_items_for_purchase(purchase_id):
+    """Recalcula solo los SKUs incluidos en la compra dada (todos si la compra no tiene items)."""
+    skus = set(PurchaseItem.objects.filter(purchase_id=purchase_id, product__isnull=False)
+               .values_list("product_id", flat=True))
+    return recompute_missing_items(skus or None)
+
+
+def build_shopping_list(include_orders=False):
+    """
+    Agrupa los faltantes por SKU con un solo `GROUP BY` y los convierte a la unidad de medida
+    del producto (`ceil(faltante / weight)`). El faltante de un SKU es lo pedido por todas sus
+    órdenes con déficit menos el stock, no la suma de los déficits por orden (cada uno descuenta
+    el mismo stock). Con `include_orders` agrega el detalle por orden con una consulta más.
+    """
+    rows = (
+        MissingItems.objects.values(
+            "product_id", "product__name", "product__measure_unity__unity", "product__measure_unity__weight"
+        )
+        .annotate(
+            orders=Count("id"),
+            requested=Sum(F("missing_quantity") + F("stock")),
+            current_stock=Max("stock"),
+        )
+        .order_by("product_id")
+    )
+
+    items = []
+    for row in rows:
+        missing = row["requested"] - row["current_stock"]
+        weight = row["product__measure_unity__weight"]
+        items.append({
+            "sku": row["product_id"],
+            "name": row["product__name"],
+            "stock": row["current_stock"],
+            "requested": row["requested"],
+            "missing_quantity": missing,
+            "unit": row["product__measure_unity__unity"],
+            "unit_weight": weight,
+            "units_to_buy": math.ceil(missing / weight) if weight else None,
+            "orders": row["orders"],
+        })
+
+    if include_orders:
+        detail = {}
+        lines = MissingItems.objects.order_by("product_id", "order_id").values_list(
+            "product_id", "order_id", "missing_quantity"
+        )
+        for sku, order_id, missing in lines:
+            detail.setdefault(sku, []).append({"order": order_id, "missing_quantity": missing})
+        for item in items:
+            item["order_detail"] = detail.get(item["sku"], [])
+
+    return {
+        "items": items,
+        "total_skus": len(items),
+        "total_units_to_buy": sum(item["units_to_buy"] or 0 for item in items),
+    }
+
+
+def get_shopping_list(include_orders=False):
+    """
+    Lista de compras leída desde cache. La clave depende de la versión de los MissingItems
+    (cambia con cada recálculo) y de la del catálogo (cambia con unidades de medida y productos).
+    Con `SHOPPING_LIST_CACHE_ENABLED` apagado (sin cache compartida) siempre se arma desde la base.
+    """
+    if not settings.SHOPPING_LIST_CACHE_ENABLED:
+        return build_shopping_list(include_orders)
+
+    key = (
+        f"missing-items:shopping-list:v{get_missing_items_version()}:c{get_catalog_version()}"
+        f":{'orders' if include_orders else 'skus'}"
+    )
+    shopping_list = cache.get(key)
+    if shopping_list is None:
+        shopping_list = build_shopping_list(include_orders)
+        cache.set(key, shopping_list, timeout=settings.SHOPPING_LIST_CACHE_TIMEOUT)
+    return shopping_list
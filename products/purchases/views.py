@@ -1,12 +1,95 @@
 from django.db import transaction
 from rest_framework.generics import ListAPIView, RetrieveAPIView
-from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework import status
+from products.inventory.ledger import purchase_quantities, receive_purchase
+from products.purchases.missing_items import get_shopping_list
 from products.models import PurchaseItem, UnitOfMeasure, Product, Purchase, MissingItems
-from products.serializers import PurchaseSerializer, MissingItemSerializer
+from products.pagination import get_list_paginator
+from products.serializers import PurchaseSerializer, PurchaseListSerializer, MissingItemSerializer
+
+
+def resolve_purchase_items(items_data, unit_field, default_sell_percentage=None):
+    """
+    Valida los items recibidos y resuelve productos y unidades de medida con una consulta
+    `sku__in` y una `pk__in`. Retorna `(items, error)`; `error` incluye todos los SKUs y
+    unidades desconocidos a la vez.
+    """
+    for item in items_data:
+        if not all([item.get("product"), item.get("quantity"), item.get("purchase_price"), item.get(unit_field)]):
+            return None, {"error": "Each item must have product, quantity, purchase_price, and unit_measure."}
+
+    # Los SKUs pueden llegar como números en el JSON; la llave primaria es texto
+    skus = {str(item["product"]) for item in items_data}
+    unit_ids = {str(item[unit_field]) for item in items_data}
+    products = Product.objects.in_bulk(skus)
+    units = {
+        str(pk): unit
+        for pk, unit in UnitOfMeasure.objects.in_bulk([pk for pk in unit_ids if pk.isdigit()]).items()
+    }
+
+    missing_products = sorted(sku for sku in skus if sku not in products)
+    missing_units = sorted(pk for pk in unit_ids if pk not in units)
+    if missing_products or missing_units:
+        error = {"error": "One or more products or unit measures do not exist."}
+        if missing_products:
+            error["missing_products"] = missing_products
+        if missing_units:
+            error["missing_unit_measures"] = missing_units
+        return None, error
+
+    items = [
+        {
+            "product": products[str(item["product"])],
+            "quantity": item["quantity"],
+            "purchase_price": item["purchase_price"],
+            "sell_percentage": item.get("sell_percentage", default_sell_percentage),
+            "unit_measure": units[str(item[unit_field])],
+        }
+        for item in items_data
+    ]
+    return items, None
+
+
+def sync_purchase_items(purchase, items):
+    """
+    Aplica sobre los items existentes de la compra solo las diferencias: crea los nuevos,
+    actualiza los modificados y elimina los que ya no vienen, cada uno con una operación masiva.
+    """
+    existing = {}
+    for purchase_item in purchase.purchase_items.all().order_by("id"):
+        existing.setdefault(purchase_item.product_id, []).append(purchase_item)
+
+    fields = ["quantity", "purchase_price", "sell_percentage", "unit_measure"]
+    to_create, to_update = [], []
+    for item in items:
+        matches = existing.get(item["product"].sku)
+        if not matches:
+            to_create.append(PurchaseItem(purchase=purchase, **item))
+            continue
+
+        purchase_item = matches.pop(0)
+        changed = (
+            purchase_item.quantity != item["quantity"]
+            or purchase_item.purchase_price != item["purchase_price"]
+            or purchase_item.sell_percentage != item["sell_percentage"]
+            or purchase_item.unit_measure_id != item["unit_measure"].pk
+        )
+        if changed:
+            for field in fields:
+                setattr(purchase_item, field, item[field])
+            to_update.append(purchase_item)
+
+    to_delete = [purchase_item.id for matches in existing.values() for purchase_item in matches]
+
+    if to_delete:
+        PurchaseItem.objects.filter(id__in=to_delete).delete()
+    if to_update:
+        PurchaseItem.objects.bulk_update(to_update, fields)
+    if to_create:
+        PurchaseItem.objects.bulk_create(to_create)
 
 
 class PurchaseCreateUpdateView(APIView):
@@ -33,6 +116,10 @@ class PurchaseCreateUpdateView(APIView):
             return Response({"error": "At least one purchase item is required."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
+            items, error = resolve_purchase_items(items_data, "unit_measure")
+            if error:
+                return Response(error, status=status.HTTP_400_BAD_REQUEST)
+
             with transaction.atomic():
                 # Crear la compra
                 purchase = Purchase.objects.create(
@@ -40,51 +127,18 @@ class PurchaseCreateUpdateView(APIView):
                     global_sell_percentage=global_sell_percentage,
                     purchase_date=purchase_date
                 )
-
-                purchase_items = []
-                for item in items_data:
-                    product_sku = item.get("product")
-                    quantity = item.get("quantity")
-                    purchase_price = item.get("purchase_price")
-                    sell_percentage = item.get("sell_percentage")
-                    unit_measure = item.get("unit_measure")
-
-                    if not all([product_sku, quantity, purchase_price, unit_measure]):
-                        return Response(
-                            {"error": "Each item must have product, quantity, purchase_price, and unit_measure."},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-
-                    product = Product.objects.get(sku=product_sku)
-                    unit_measure = UnitOfMeasure.objects.get(pk=unit_measure)
-
-                    purchase_items.append(
-                        PurchaseItem(
-                            purchase=purchase,
-                            product=product,
-                            quantity=quantity,
-                            purchase_price=purchase_price,
-                            sell_percentage=sell_percentage,
-                            unit_measure=unit_measure
-                        )
-                    )
-
-                PurchaseItem.objects.bulk_create(purchase_items)
+                PurchaseItem.objects.bulk_create([PurchaseItem(purchase=purchase, **item) for item in items])
                 purchase.update_totals()  # Actualiza totales y ganancias estimadas
+                # Lo comprado entra al inventario
+                receive_purchase(purchase.pk, {}, purchase_quantities(purchase.pk))
 
-                return Response(PurchaseSerializer(purchase).data, status=status.HTTP_201_CREATED)
-
-        except Product.DoesNotExist:
-            return Response({"error": "One or more products do not exist."}, status=status.HTTP_400_BAD_REQUEST)
-
-        except UnitOfMeasure.DoesNotExist:
-            return Response({"error": "One or more unit measures do not exist."}, status=status.HTTP_400_BAD_REQUEST)
+            purchase = PurchaseSerializer.setup_eager_loading(Purchase.objects.all()).get(pk=purchase.pk)
+            return Response(PurchaseSerializer(purchase).data, status=status.HTTP_201_CREATED)
 
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     def put(self, request):
-        print(request.data)
         purchase_id = request.data.get("purchase_id")
 
         if not purchase_id:
@@ -104,51 +158,23 @@ class PurchaseCreateUpdateView(APIView):
             return Response({"error": "At least one purchase item is required."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
+            items, error = resolve_purchase_items(items_data, "unity", default_sell_percentage=global_sell_percentage)
+            if error:
+                return Response(error, status=status.HTTP_400_BAD_REQUEST)
+
             with transaction.atomic():
                 # Actualizar la compra
                 purchase.global_sell_percentage = global_sell_percentage
                 purchase.save()
 
-                # Eliminar los items anteriores y agregar los nuevos
-                purchase.purchase_items.all().delete()
-
-                purchase_items = []
-                for item in items_data:
-                    product_sku = item.get("product")
-                    quantity = item.get("quantity")
-                    purchase_price = item.get("purchase_price")
-                    sell_percentage = item.get("sell_percentage", purchase.global_sell_percentage)
-                    unit_measure = item.get("unity")
-
-                    if not all([product_sku, quantity, purchase_price, unit_measure]):
-                        return Response(
-                            {"error": "Each item must have product, quantity, purchase_price, and unit_measure."},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-
-                    product = Product.objects.get(sku=product_sku)
-                    unit_measure = UnitOfMeasure.objects.get(pk=unit_measure)
-
-                    purchase_item = PurchaseItem(
-                        purchase=purchase,
-                        product=product,
-                        quantity=quantity,
-                        purchase_price=purchase_price,
-                        sell_percentage=sell_percentage,
-                        unit_measure=unit_measure
-                    )
-                    purchase_items.append(purchase_item)
-
-                PurchaseItem.objects.bulk_create(purchase_items)
+                # Aplicar solo las diferencias sobre los items existentes
+                before = purchase_quantities(purchase.pk)
+                sync_purchase_items(purchase, items)
                 purchase.update_totals()  # Recalcular totales
+                receive_purchase(purchase.pk, before, purchase_quantities(purchase.pk))
 
-                return Response(PurchaseSerializer(purchase).data, status=status.HTTP_200_OK)
-
-        except Product.DoesNotExist:
-            return Response({"error": "One or more products do not exist."}, status=status.HTTP_400_BAD_REQUEST)
-
-        except UnitOfMeasure.DoesNotExist:
-            return Response({"error": "One or more unit measures do not exist."}, status=status.HTTP_400_BAD_REQUEST)
+            purchase = PurchaseSerializer.setup_eager_loading(Purchase.objects.all()).get(pk=purchase.pk)
+            return Response(PurchaseSerializer(purchase).data, status=status.HTTP_200_OK)
 
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -165,7 +191,10 @@ class PurchaseDeleteView(APIView):
             return Response({'error': 'Purchase ID is missing'}, status.HTTP_400_BAD_REQUEST)
         try:
             purchase = Purchase.objects.get(id=purchase_id)
-            purchase.delete()
+            with transaction.atomic():
+                # Lo que había entrado con la compra sale del inventario
+                receive_purchase(purchase.pk, purchase_quantities(purchase.pk), {})
+                purchase.delete()
             return Response({'message': 'Purchase was deleted successfully'}, status = status.HTTP_204_NO_CONTENT)
         except Purchase.DoesNotExist:
             return Response({'error': f'Purchase with ID not found'}, status = status.HTTP_404_NOT_FOUND)
@@ -178,8 +207,8 @@ class PurchaseListView(ListAPIView):
     List all purchases
     """
     permission_classes = [IsAdminUser]
-    queryset = Purchase.objects.all().order_by("-purchase_date")  # Últimas compras primero
-    serializer_class = PurchaseSerializer
+    queryset = PurchaseSerializer.setup_eager_loading(Purchase.objects.all().order_by("-purchase_date"))  # Últimas compras primero
+    serializer_class = PurchaseListSerializer
 
 
 class PurchaseDetailView(RetrieveAPIView):
@@ -187,7 +216,7 @@ class PurchaseDetailView(RetrieveAPIView):
     Retrieve details of a specific purchase
     """
     permission_classes = [IsAdminUser]
-    queryset = Purchase.objects.all()
+    queryset = PurchaseSerializer.setup_eager_loading(Purchase.objects.all())
     serializer_class = PurchaseSerializer
     lookup_field = "id"  # Se buscará por el ID de la compra
 
@@ -205,9 +234,21 @@ class RetrieveMissingItemsView(APIView):
     def get(self, request):
         try:
             queryset = MissingItems.objects.all()
-            paginator = LimitOffsetPagination()
+            paginator = get_list_paginator(request, ordering=("id",))
             paginated_queryset = paginator.paginate_queryset(queryset, request)
             serializer = MissingItemSerializer(paginated_queryset, many=True)
             return paginator.get_paginated_response(serializer.data)
         except Exception as e:
-            return Response({'message': str(e)}, status = status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            return Response({'message': str(e)}, status = status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class MissingItemsShoppingListView(APIView):
+    """
+    Return the missing items as a shopping list: one row per SKU with the total shortfall
+    converted to the product's unit of measure. `?orders=true` adds the per order detail.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        include_orders = request.query_params.get("orders", "").lower() in ("1", "true", "yes")
+        return Response(get_shopping_list(include_orders), status=status.HTTP_200_OK)
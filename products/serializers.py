@@ -1,3 +1,5 @@
+from django.db.models import Prefetch, Value, FloatField
+from django.db.models.functions import Coalesce
 from rest_framework.serializers import ModelSerializer
 
 from users.models import User
@@ -107,8 +109,25 @@ class OrderSerializer(serializers.ModelSerializer):
     total = serializers.SerializerMethodField()
     products = OrderProductSerializer(source='orderproduct_set', many=True, read_only=True)
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Carga en una cantidad fija de consultas todo el grafo que serializa `OrderSerializer`:
+        usuario y pago por JOIN, total anotado, y líneas con su producto, categoría y unidad prefetcheados.
+        """
+        return queryset.select_related("user", "payment").annotate(
+            total_amount=Coalesce("payment__payment_amount", Value(0.0), output_field=FloatField())
+        ).prefetch_related(
+            Prefetch(
+                "orderproduct_set",
+                queryset=OrderProduct.objects.select_related("product__category", "product__measure_unity"),
+            )
+        )
+
     @staticmethod
     def get_total(order):
+        if hasattr(order, "total_amount"):
+            return order.total_amount
         try:
             payment = Payment.objects.filter(order=order).first()
             return payment.payment_amount if payment else 0
@@ -192,10 +211,36 @@ class PurchaseItemSerializer(serializers.ModelSerializer):
         model = PurchaseItem
         fields = ["id", "product", "quantity", "purchase_price", "sell_percentage", "unit_measure", "subtotal", "estimated_profit", "sale_price_per_weight"]
 
+class PurchaseItemListSerializer(serializers.ModelSerializer):
+    """Item de compra plano para los listados: sin el `ProductSerializer` anidado."""
+    product_name = serializers.CharField(source="product.name", read_only=True, default=None)
+    unity = serializers.CharField(source="unit_measure.unity", read_only=True, default=None)
+    subtotal = serializers.ReadOnlyField()
+    estimated_profit = serializers.ReadOnlyField()
+    sale_price_per_weight = serializers.ReadOnlyField()
+
+    class Meta:
+        model = PurchaseItem
+        fields = ["id", "product", "product_name", "quantity", "purchase_price", "sell_percentage", "unit_measure",
+                  "unity", "subtotal", "estimated_profit", "sale_price_per_weight"]
+
+
 class PurchaseSerializer(serializers.ModelSerializer):
     purchase_items = PurchaseItemSerializer(many=True, read_only=True)
     estimated_profit = serializers.ReadOnlyField()
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Prefetchea los items con su producto (categoría y unidad) y su unidad de medida."""
+        return queryset.prefetch_related(
+            Prefetch(
+                "purchase_items",
+                queryset=PurchaseItem.objects.select_related(
+                    "unit_measure", "product__category", "product__measure_unity"
+                ).order_by("id"),
+            )
+        )
+
 
     class Meta:
         model = Purchase
@@ -207,6 +252,10 @@ class PurchaseSerializer(serializers.ModelSerializer):
         return value
 
 
+class PurchaseListSerializer(PurchaseSerializer):
+    purchase_items = PurchaseItemListSerializer(many=True, read_only=True)
+
+
 class MissingItemSerializer(serializers.ModelSerializer):
     product = ProductSerializer()
     order = OrderSerializer()
@@ -1,7 +1,14 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.db.models import F
-from .models import Payment, Order, OrderProduct, Product
+from .cache import bump_catalog_version
+from .carts.summary import bump_cart_version
+from .inventory.ledger import record_movements
+from .inventory.reservations import release_order_reservations
+from .inventory.stock import start_order_processing
+from .payments.checkout import bump_checkout_version
+from .payments.invoices import generate_invoice
+from .tasks import run_in_background
+from .models import Payment, Order, Product, ProductCart, Category, UnitOfMeasure, InventoryMovement
 
 @receiver(post_save, sender=Payment)
 def update_order_and_stock(sender, instance, created, **kwargs):
@@ -10,32 +17,54 @@ def update_order_and_stock(sender, instance, created, **kwargs):
     Si un producto no tiene suficiente stock, solo se factura la cantidad disponible.
     """
     if created:
-        try:
-            order = instance.order
-            order_products = OrderProduct.objects.filter(order=order)
-
-            if order.status == "PENDING":
-                order.status = "PROCESSING"
-                order.save()
-
-                # Procesar stock de cada producto en la orden
-                for order_product in order_products:
-                    product = order_product.product
-                    if product.stock >= order_product.quantity:
-                        # Stock suficiente: se descuenta la cantidad solicitada
-                        product.stock = F('stock') - order_product.quantity
-                        product.save()
-                    elif product.stock > 0:
-                        # Stock insuficiente: se factura solo lo disponible
-                        print(f"Stock insuficiente para {product.name}. Solo se facturan {product.stock} unidades.")
-                        order_product.quantity = product.stock  # Ajustar cantidad en la orden
-                        order_product.save()
-                        product.stock = 0  # Se vende todo lo disponible
-                        product.save()
-                    else:
-                        # Sin stock: eliminar el producto de la orden
-                        print(f"Producto {product.name} sin stock. Eliminado de la orden.")
-                        order_product.delete()
-
-        except Order.DoesNotExist:
-            print("No se encontró la orden asociada al pago")
+        # Solo el primer pago que mueve la orden de PENDING a PROCESSING descuenta stock
+        start_order_processing(instance.order_id)
+
+        # La factura se renderiza fuera de la petición, ya con las líneas ajustadas
+        run_in_background(generate_invoice, instance.order_id)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=UnitOfMeasure)
+@receiver(post_delete, sender=UnitOfMeasure)
+def invalidate_catalog_cache(sender, **kwargs):
+    """
+    Cualquier cambio en productos, categorías o unidades de medida invalida las
+    páginas y productos serializados del catálogo.
+    """
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Product)
+def record_stock_adjustment(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Un cambio de stock hecho a mano (admin, API de productos) queda en el libro de inventario
+    como un ajuste por la diferencia con el stock leído de la base.
+    """
+    if update_fields is not None and "stock" not in update_fields:
+        return
+    previous = 0 if created else getattr(instance, "_loaded_stock", None)
+    if previous is None:
+        return
+    record_movements({instance.sku: instance.stock - previous}, InventoryMovement.ADJUSTMENT,
+                     reference="created" if created else "manual")
+    instance._loaded_stock = instance.stock
+
+
+@receiver(post_save, sender=ProductCart)
+@receiver(post_delete, sender=ProductCart)
+def invalidate_checkout_on_cart_change(sender, instance, **kwargs):
+    """Un cambio en el carrito invalida su resumen y las preferencias de pago guardadas del usuario."""
+    bump_cart_version(instance.cart_id)
+    bump_checkout_version(instance.cart.user_id)
+
+
+@receiver(post_save, sender=Order)
+def invalidate_checkout_on_order_status(sender, instance, **kwargs):
+    """Una orden que deja PENDING ya no puede reutilizar su preferencia de pago ni retener stock reservado."""
+    if instance.status != "PENDING":
+        bump_checkout_version(instance.user_id)
+        release_order_reservations(instance.pk)
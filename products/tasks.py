@@ -0,0 +1,36 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=settings.BACKGROUND_TASK_WORKERS, thread_name_prefix="products-task")
+
+
+def _run(func, args, kwargs):
+    """Ejecuta la tarea; un error queda en el log y no llega a quien la encoló."""
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception("Background task %s failed", func.__name__)
+
+
+def _run_in_worker(func, args, kwargs):
+    close_old_connections()
+    try:
+        _run(func, args, kwargs)
+    finally:
+        close_old_connections()
+
+
+def run_in_background(func, *args, **kwargs):
+    """
+    Ejecuta `func` fuera del ciclo de la petición una vez confirmada la transacción actual,
+    así la tarea siempre ve los datos guardados. Con `BACKGROUND_TASKS_EAGER` se ejecuta en línea.
+    """
+    if settings.BACKGROUND_TASKS_EAGER:
+        transaction.on_commit(lambda: _run(func, args, kwargs))
+    else:
+        transaction.on_commit(lambda: _executor.submit(_run_in_worker, func, args, kwargs))
@@ -1,3 +1,1335 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+import mercadopago
+from openpyxl import load_workbook
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test.utils import CaptureQueriesContext
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from users.models import User
+from .analytics.forecast import demand_matrix, reorder_suggestions
+from .analytics.margins import margin_report, refresh_margin_rollups
+from .cache import bump_catalog_version
+from .imports.importer import import_products
+from .inventory.ledger import ledger_stock, purchase_quantities, receive_purchase, take_inventory_snapshots
+from .inventory.reservations import expire_reservations
+from .purchases.missing_items import recompute_missing_items
+from .tasks import run_in_background
+from .inventory.stock import commit_order_stock, reverse_order_processing, FULFILLED, PARTIAL, REMOVED
+from .models import Category, UnitOfMeasure, Product, Order, OrderProduct, Payment, PaymentEvent, Cart, ProductCart, \
+    StockReservation, InventoryMovement, InventorySnapshot, MarginRollup, Purchase, PurchaseItem, cart_fingerprint, \
+    IdSequence, IdSpaceExhausted, MissingItems, ID_SPACE, encode_id_prefix, generate_unique_id
+from .payments.mercadopago_client import CircuitBreaker, MercadoPagoUnavailable, PooledHttpClient, OPEN, \
+    mercadopago_client_stats, reset_mercadopago_sdk
+from .payments.mercadopago_emulator import EmulatorAdapter, MercadoPagoEmulator, make_emulator_server
+from .payments.invoice_batch import paid_payments, stream_invoice_zip
+from .payments.webhooks import process_payment_events
+
+
+class OrderListQueryCountTest(TestCase):
+    """
+    Los listados de órdenes deben ejecutar una cantidad fija de consultas
+    sin importar cuántas órdenes, líneas o pagos haya en la página.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username="admin", email="admin@test.com", password="x", dni="1000")
+        cls.client_user = User.objects.create_user(username="client", email="client@test.com", password="x",
+                                                   dni="2000", rol="Cliente")
+        category = Category.objects.create(name="Frutas", description="Frutas")
+        unit = UnitOfMeasure.objects.create(unity="KG", weight=1)
+        products = [
+            Product.objects.create(sku=f"SKU{i}", name=f"Producto {i}", description="-", price=1000,
+                                   stock=100, category=category, measure_unity=unit)
+            for i in range(5)
+        ]
+        for i in range(10):
+            order = Order.objects.create(user=cls.client_user, status="DELIVERED")
+            OrderProduct.objects.bulk_create([
+                OrderProduct(order=order, product=product, price=product.price, quantity=2)
+                for product in products
+            ])
+            if i % 2 == 0:
+                Payment.objects.create(order=order, payment_amount=10000, payment_date=timezone.now(),
+                                       payment_method="CASH", payment_status="APPROVED")
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+
+    def test_cursor_pagination_walks_ties_without_gaps_or_repeats(self):
+        # La mitad de las órdenes comparte la misma fecha: el orden lo decide el id
+        tied = list(Order.objects.order_by("id").values_list("id", flat=True)[:5])
+        Order.objects.filter(id__in=tied).update(creation_date=timezone.now())
+        expected = list(Order.objects.order_by("-creation_date", "-id").values_list("id", flat=True))
+
+        seen, pages = [], 0
+        url = "/api/v1/dashboard/orders/?pagination=cursor&limit=3"
+        while url:
+            response = self.api.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn("count", response.data)
+            seen += [order["id"] for order in response.data["results"]]
+            url, pages = response.data["next"], pages + 1
+        self.assertEqual(pages, 4)
+        self.assertEqual(seen, expected)
+
+        previous = self.api.get(response.data["previous"])
+        self.assertEqual([order["id"] for order in previous.data["results"]], expected[6:9])
+
+    def test_dashboard_orders_query_count(self):
+        # COUNT + órdenes con usuario/pago/total + líneas con producto/categoría/unidad
+        with self.assertNumQueries(3):
+            response = self.api.get("/api/v1/dashboard/orders/?limit=50")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 10)
+        totals = sorted(order["total"] for order in response.data["results"])
+        self.assertEqual(totals, [0] * 5 + [10000] * 5)
+
+    def test_user_orders_query_count(self):
+        # usuario + órdenes con usuario/pago/total + líneas con producto/categoría/unidad
+        with self.assertNumQueries(3):
+            response = self.api.get("/api/v1/carts/orders/list/", {"user": self.client_user.dni})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 10)
+        self.assertEqual(len(response.data[0]["products"]), 5)
+        self.assertEqual(response.data[0]["products"][0]["product"]["category"], "Frutas")
+
+
+class GenerateUniqueIdTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="c", email="c@test.com", password="x", dni="12345678")
+
+    def test_ids_are_unique_within_each_scope(self):
+        order_ids = [generate_unique_id("12345678") for _ in range(300)]
+        self.assertEqual(len(set(order_ids)), 300)
+        self.assertTrue(all(re.fullmatch(r"ECC[A-Z]{2}\d12345678", unique_id) for unique_id in order_ids))
+
+        # Cada DNI y cada tipo de documento tiene su propia secuencia
+        self.assertEqual(generate_unique_id("87654321"), f"ECC{encode_id_prefix(0)}87654321")
+        self.assertEqual(generate_unique_id("12345678", purchase=True), f"COMP-ECC{encode_id_prefix(0)}5678")
+        self.assertEqual(IdSequence.objects.get(name="order:12345678").last_value, 299)
+
+    def test_legacy_ids_are_skipped(self):
+        for value in (0, 1, 3):
+            Order.objects.create(id=f"ECC{encode_id_prefix(value)}12345678", user=self.user)
+        self.assertEqual(generate_unique_id("12345678"), f"ECC{encode_id_prefix(2)}12345678")
+        self.assertEqual(generate_unique_id("12345678"), f"ECC{encode_id_prefix(4)}12345678")
+
+    def test_exhausted_scope_raises(self):
+        IdSequence.objects.create(name="order:12345678", last_value=ID_SPACE - 2)
+        Order.objects.create(id=f"ECC{encode_id_prefix(ID_SPACE - 1)}12345678", user=self.user)
+        with self.assertRaises(IdSpaceExhausted):
+            generate_unique_id("12345678")
+        self.assertEqual(IdSequence.objects.get(name="order:12345678").last_value, ID_SPACE - 2)
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True, MEDIA_ROOT=tempfile.mkdtemp(),
+                   INVOICE_RENDERER="products.tests.StubInvoiceRenderer")
+class ConcurrentStockCommitTest(TransactionTestCase):
+    """
+    Varios pagos simultáneos sobre el mismo SKU nunca deben vender más stock del disponible.
+    """
+
+    def test_parallel_payments_do_not_oversell(self):
+        category = Category.objects.create(name="Verduras", description="Verduras")
+        product = Product.objects.create(sku="TOMATE", name="Tomate", description="-", price=1000,
+                                         stock=10, category=category)
+        orders = []
+        for i in range(6):
+            user = User.objects.create_user(username=f"client{i}", email=f"client{i}@test.com", password="x",
+                                            dni=f"300{i}")
+            order = Order.objects.create(user=user)
+            OrderProduct.objects.create(order=order, product=product, price=product.price, quantity=3)
+            orders.append(order)
+
+        barrier = threading.Barrier(len(orders))
+        errors = []
+
+        def pay(order):
+            try:
+                barrier.wait()
+                Payment.objects.create(order=order, payment_amount=3000, payment_date=timezone.now(),
+                                       payment_method="CASH", payment_status="APPROVED")
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=pay, args=(order,)) for order in orders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        product.refresh_from_db()
+        sold = OrderProduct.objects.filter(product=product).aggregate(total=Sum("quantity"))["total"]
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(sold, 10)
+        self.assertEqual(Order.objects.filter(status="PROCESSING").count(), len(orders))
+
+
+@override_settings(CATALOG_CACHE_ENABLED=True)
+class CatalogCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Frutas", description="Frutas")
+        self.unit = UnitOfMeasure.objects.create(unity="KG", weight=1)
+        self.product = Product.objects.create(sku="A", name="Mango", description="-", price=100, stock=5,
+                                              category=self.category, measure_unity=self.unit)
+        self.api = APIClient()
+
+    def detail(self):
+        return self.api.get("/api/v1/products/product/details/?sku=A").data
+
+    def stats(self):
+        admin = User.objects.get_or_create(username="a", email="a@test.com", dni="9500", is_staff=True)[0]
+        self.api.force_authenticate(admin)
+        response = self.api.get("/api/v1/products/cache/stats/")
+        self.api.force_authenticate(None)
+        return response.data
+
+    def test_second_read_is_served_from_cache(self):
+        self.assertEqual(self.detail()["price"], 100)
+        with self.assertNumQueries(0):
+            self.api.get("/api/v1/products/product/details/?sku=A")
+        self.api.get("/api/v1/products/list/?limit=10")
+        self.api.get("/api/v1/products/list/?limit=10")
+        self.assertEqual({key: value for key, value in self.stats().items() if key != "version"},
+                         {"hits": 2, "misses": 2, "hit_ratio": 0.5})
+
+    def test_catalog_changes_bump_the_version(self):
+        self.detail()
+        for instance, field, value in ((self.product, "price", 150), (self.category, "description", "-"),
+                                       (self.unit, "weight", 2)):
+            version = self.stats()["version"]
+            setattr(instance, field, value)
+            instance.save()
+            self.assertEqual(self.stats()["version"], version + 1)
+        self.assertEqual(self.detail()["price"], 150)
+        self.assertEqual(self.stats()["misses"], 2)
+
+    @override_settings(CATALOG_CACHE_ENABLED=False)
+    def test_disabled_cache_always_reads_the_database(self):
+        self.detail()
+        Product.objects.filter(pk="A").update(stock=1)  # sin señales ni cambio de versión
+        self.assertEqual(self.detail()["stock"], 1)
+        self.assertEqual((self.stats()["hits"], self.stats()["misses"]), (0, 0))
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True)
+class RunInBackgroundTest(TestCase):
+    def test_eager_task_failure_is_logged_not_raised(self):
+        def fail():
+            raise RuntimeError("boom")
+
+        with self.assertLogs("products.tasks", level="ERROR") as logs, \
+                self.captureOnCommitCallbacks(execute=True):
+            run_in_background(fail)
+        self.assertIn("Background task fail failed", logs.output[0])
+
+
+class CommitOrderStockTest(TestCase):
+    def test_returns_per_line_results(self):
+        user = User.objects.create_user(username="c", email="c@test.com", password="x", dni="4000")
+        category = Category.objects.create(name="Frutas", description="Frutas")
+        full = Product.objects.create(sku="A", name="A", description="-", price=1, stock=5, category=category)
+        short = Product.objects.create(sku="B", name="B", description="-", price=1, stock=2, category=category)
+        empty = Product.objects.create(sku="C", name="C", description="-", price=1, stock=0, category=category)
+        order = Order.objects.create(user=user)
+        for product in (full, short, empty):
+            OrderProduct.objects.create(order=order, product=product, price=1, quantity=4)
+
+        results = commit_order_stock(order.pk)
+
+        self.assertEqual([(r["sku"], r["fulfilled"], r["status"]) for r in results],
+                         [("A", 4, FULFILLED), ("B", 2, PARTIAL), ("C", 0, REMOVED)])
+        self.assertEqual(dict(Product.objects.values_list("sku", "stock")), {"A": 1, "B": 0, "C": 0})
+        self.assertEqual(dict(order.orderproduct_set.values_list("product_id", "quantity")), {"A": 4, "B": 2})
+
+
+class StubMercadoPagoHandler(BaseHTTPRequestHandler):
+    """Responde con los códigos encolados en `server.statuses` (200 cuando la cola está vacía)."""
+    protocol_version = "HTTP/1.1"
+
+    def handle_request(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        self.server.calls.append((self.command, self.path, self.client_address[1]))
+        code = self.server.statuses.pop(0) if self.server.statuses else 200
+        body = json.dumps({"id": len(self.server.calls)}).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = handle_request
+
+    def log_message(self, *args):
+        pass
+
+
+class MercadoPagoClientTest(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubMercadoPagoHandler)
+        self.server.calls = []
+        self.server.statuses = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def mp_client(self, **kwargs):
+        kwargs.setdefault("backoff", 0)
+        return PooledHttpClient(base_url=self.base_url, **kwargs)
+
+    def test_reuses_keep_alive_connection(self):
+        client = self.mp_client()
+        for _ in range(3):
+            response = client.get("https://api.mercadopago.com/v1/payments/1", headers={})
+            self.assertEqual(response["status"], 200)
+        ports = {port for _, _, port in self.server.calls}
+        self.assertEqual(len(self.server.calls), 3)
+        self.assertEqual(len(ports), 1)
+
+    def test_retries_idempotent_calls_only(self):
+        client = self.mp_client(max_retries=2)
+        self.server.statuses = [503, 502]
+        response = client.get("https://api.mercadopago.com/v1/payments/1", headers={})
+        self.assertEqual(response["status"], 200)
+        self.assertEqual(client.stats()["retries"], 2)
+
+        self.server.calls.clear()
+        self.server.statuses = [503]
+        response = client.post("https://api.mercadopago.com/checkout/preferences", headers={}, data="{}")
+        self.assertEqual(response["status"], 503)
+        self.assertEqual(len(self.server.calls), 1)
+
+    def test_circuit_opens_and_recovers(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        client = self.mp_client(max_retries=0, breaker=breaker)
+        self.server.statuses = [500, 500]
+        for _ in range(2):
+            client.get("https://api.mercadopago.com/v1/payments/1", headers={})
+        self.assertEqual(breaker.state, OPEN)
+
+        with self.assertRaises(MercadoPagoUnavailable):
+            client.get("https://api.mercadopago.com/v1/payments/1", headers={})
+        self.assertEqual(len(self.server.calls), 2)
+        self.assertEqual(client.stats()["short_circuited"], 1)
+
+        time.sleep(0.06)
+        response = client.get("https://api.mercadopago.com/v1/payments/1", headers={})
+        self.assertEqual(response["status"], 200)
+        self.assertEqual(client.stats()["circuit"], "closed")
+
+    def test_connection_errors_raise_unavailable(self):
+        client = PooledHttpClient(base_url="http://127.0.0.1:1", max_retries=1, backoff=0)
+        with self.assertRaises(MercadoPagoUnavailable):
+            client.get("https://api.mercadopago.com/v1/payments/1", headers={})
+        self.assertEqual(client.stats()["failures"], 2)
+
+
+class MercadoPagoEmulatorTest(SimpleTestCase):
+    PAYMENT = {"transaction_amount": 1500, "token": "tok", "installments": 1, "payment_method_id": "visa",
+               "payer": {"email": "client@test.com"}}
+
+    def sdk(self, client):
+        return mercadopago.SDK("TEST", http_client=client, request_options=mercadopago.config.RequestOptions())
+
+    def test_in_process_preference_and_idempotent_payment(self):
+        emulator = MercadoPagoEmulator()
+        client = PooledHttpClient(backoff=0)
+        client.session.mount(client.base_url, EmulatorAdapter(emulator))
+        sdk = self.sdk(client)
+
+        preference = sdk.preference().create({"items": [{"title": "Tomate", "quantity": 2, "unit_price": 1000}]})
+        self.assertEqual(preference["status"], 201)
+        self.assertTrue(preference["response"]["init_point"])
+        self.assertEqual(sdk.preference().create({"items": []})["status"], 400)
+
+        options = mercadopago.config.RequestOptions(custom_headers={"x-idempotency-key": "checkout-1"})
+        first = sdk.payment().create(self.PAYMENT, options)
+        again = sdk.payment().create(self.PAYMENT, options)
+        self.assertEqual(first["status"], 201)
+        self.assertEqual(first["response"]["status"], "approved")
+        self.assertEqual(again["response"]["id"], first["response"]["id"])
+        self.assertEqual(len(emulator.payments), 1)
+        self.assertEqual(sdk.payment().get(first["response"]["id"])["status"], 200)
+
+    def test_error_rate_and_latency_over_http(self):
+        emulator = MercadoPagoEmulator(latency_ms=50, error_rate=1.0, seed=1)
+        server = make_emulator_server(emulator)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            base_url = f"http://127.0.0.1:{server.server_port}"
+            client = PooledHttpClient(base_url=base_url, max_retries=0, backoff=0)
+            self.assertEqual(self.sdk(client).payment().create(self.PAYMENT)["status"], 500)
+
+            slow = PooledHttpClient(base_url=base_url, read_timeout=0.01, max_retries=0)
+            with self.assertRaises(MercadoPagoUnavailable):
+                self.sdk(slow).payment().get(1)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class MercadoPagoWebhookTest(TestCase):
+    def test_duplicate_notifications_are_applied_once(self):
+        user = User.objects.create_user(username="c", email="c@test.com", password="x", dni="5000")
+        category = Category.objects.create(name="Frutas", description="Frutas")
+        product = Product.objects.create(sku="A", name="A", description="-", price=1000, stock=10, category=category)
+        order = Order.objects.create(user=user)
+        OrderProduct.objects.create(order=order, product=product, price=1000, quantity=3)
+
+        client = PooledHttpClient(backoff=0)
+        client.session.mount(client.base_url, EmulatorAdapter(MercadoPagoEmulator()))
+        sdk = mercadopago.SDK("TEST", http_client=client)
+        provider_payment = sdk.payment().create({"transaction_amount": 3000, "payment_method_id": "visa",
+                                                 "external_reference": order.pk})["response"]
+
+        api = APIClient()
+        notification = {"id": 1, "type": "payment", "action": "payment.created",
+                        "data": {"id": str(provider_payment["id"])}}
+        for body in (notification, notification, {**notification, "id": 2, "action": "payment.updated"}):
+            response = api.post("/api/v1/payment/mercadopago/webhook/", body, format="json")
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(PaymentEvent.objects.count(), 2)
+
+        self.assertEqual(process_payment_events(sdk=sdk), 2)
+        self.assertEqual(process_payment_events(sdk=sdk), 0)
+
+        order.refresh_from_db()
+        product.refresh_from_db()
+        self.assertEqual(order.status, "PROCESSING")
+        self.assertEqual(order.payment.payment_status, "APPROVED")
+        self.assertEqual(order.payment.payment_method, "CREDIT_CARD")
+        self.assertEqual(product.stock, 7)
+
+    def provider_sdk(self, payments):
+        """SDK falso que responde `payment().get(id)` con el pago de `payments`."""
+        class Resource:
+            def get(self, resource_id):
+                return {"status": 200, "response": payments[resource_id]}
+
+        class Sdk:
+            def payment(self):
+                return Resource()
+        return Sdk()
+
+    def notify(self, event_id, resource_id):
+        PaymentEvent.objects.create(event_id=event_id, topic="payment", action="payment.updated",
+                                    resource_id=resource_id)
+
+    def test_approved_payment_wins_over_other_attempts_for_the_order(self):
+        user = User.objects.create_user(username="c", email="c@test.com", password="x", dni="5100")
+        category = Category.objects.create(name="Frutas", description="Frutas")
+        product = Product.objects.create(sku="A", name="A", description="-", price=1000, stock=10, category=category)
+        order = Order.objects.create(user=user)
+        OrderProduct.objects.create(order=order, product=product, price=1000, quantity=3)
+        payments = {
+            "1": {"status": "approved", "external_reference": order.pk, "transaction_amount": 3000,
+                  "date_last_updated": "2026-01-01T10:00:00Z"},
+            "2": {"status": "rejected", "external_reference": order.pk, "transaction_amount": 3000,
+                  "date_last_updated": "2026-01-01T11:00:00Z"},
+        }
+        for resource_id in ("1", "2"):
+            self.notify(resource_id, resource_id)
+
+        self.assertEqual(process_payment_events(sdk=self.provider_sdk(payments)), 2)
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.payment.payment_status), ("PROCESSING", "APPROVED"))
+        self.assertFalse(PaymentEvent.objects.filter(processed_at__isnull=True).exists())
+
+    def test_refund_cancels_the_order_and_restocks(self):
+        user = User.objects.create_user(username="c", email="c@test.com", password="x", dni="5200")
+        category = Category.objects.create(name="Frutas", description="Frutas")
+        product = Product.objects.create(sku="A", name="A", description="-", price=1000, stock=10, category=category)
+        order = Order.objects.create(user=user)
+        OrderProduct.objects.create(order=order, product=product, price=1000, quantity=3)
+        payment = {"status": "approved", "external_reference": order.pk, "transaction_amount": 3000}
+        sdk = self.provider_sdk({"1": payment})
+
+        self.notify("created", "1")
+        process_payment_events(sdk=sdk)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 7)
+
+        payment["status"] = "refunded"
+        self.notify("refunded", "1")
+        process_payment_events(sdk=sdk)
+        order.refresh_from_db()
+        product.refresh_from_db()
+        self.assertEqual((order.status, order.payment.payment_status, product.stock), ("CANCELLED", "REFUNDED", 10))
+        self.assertEqual(list(InventoryMovement.objects.order_by("id").values_list("kind", "quantity"))[-2:],
+                         [("SALE", -3), ("SALE", 3)])
+
+        # Una orden ya entregada queda como devuelta sin tocar el stock
+        self.assertIsNone(reverse_order_processing(order.pk))
+        Order.objects.filter(pk=order.pk).update(status="DELIVERED")
+        self.assertEqual(reverse_order_processing(order.pk), "RETURNED")
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 10)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class InvoiceViewTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username="c", email="c@test.com", password="x", dni="5100")
+        category = Category.objects.create(name="Frutas", description="Frutas")
+        product = Product.objects.create(sku="A", name="A", description="-", price=1000, stock=10, category=category)
+        self.order = Order.objects.create(user=user)
+        self.line = OrderProduct.objects.create(order=self.order, product=product, price=1000, quantity=3)
+        Payment.objects.create(order=self.order, payment_amount=3000, payment_date=timezone.now(),
+                               payment_method="CASH", payment_status="APPROVED")
+        renderer = mock.patch("products.payments.invoices.render_invoice_pdf", return_value=b"%PDF-stub")
+        self.render = renderer.start()
+        self.addCleanup(renderer.stop)
+
+    def get(self, **headers):
+        return self.client.get(f"/api/v1/sales-report/{self.order.pk}/", headers=headers)
+
+    def test_current_invoice_is_not_rendered_or_sent_again(self):
+        first = self.get()
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(b"".join(first.streaming_content), b"%PDF-stub")
+
+        self.assertEqual(self.get(if_none_match=first["ETag"]).status_code, 304)
+        self.assertEqual(self.get(if_modified_since=first["Last-Modified"]).status_code, 304)
+        self.assertEqual(self.render.call_count, 1)
+
+    def test_changed_order_invalidates_the_fingerprint(self):
+        first = self.get()
+        self.line.quantity = 2
+        self.line.save()
+
+        second = self.get(if_none_match=first["ETag"])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second["ETag"], first["ETag"])
+        self.assertEqual(self.render.call_count, 2)
+        self.assertEqual(self.get(if_none_match=second["ETag"]).status_code, 304)
+
+
+class StubInvoiceRenderer:
+    """Renderer de facturas para los tests: se importa en los workers sin cargar WeasyPrint."""
+
+    def render(self, payment, items):
+        return f"{payment.order_id}|{payment.payment_amount:.0f}|{len(items)}".encode()
+
+
+@override_settings(INVOICE_RENDERER="products.tests.StubInvoiceRenderer")
+class InvoiceBatchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username="c", email="c@test.com", password="x", dni="5200")
+        category = Category.objects.create(name="Frutas", description="Frutas")
+        product = Product.objects.create(sku="A", name="A", description="-", price=100, stock=100, category=category)
+        day = timezone.make_aware(datetime(2026, 3, 10, 12))
+        cls.expected = []
+        for i, (offset, payment_status) in enumerate([(0, "APPROVED"), (1, "APPROVED"), (2, "REJECTED"),
+                                                      (2, "APPROVED"), (5, "APPROVED")]):
+            order = Order.objects.create(user=user)
+            OrderProduct.objects.bulk_create([
+                OrderProduct(order=order, product=product, price=100, quantity=1) for _ in range(i + 1)
+            ])
+            Payment.objects.create(order=order, payment_amount=100 * (i + 1), payment_date=day + timedelta(days=offset),
+                                   payment_method="CASH", payment_status=payment_status)
+            if payment_status == "APPROVED" and offset <= 2:
+                cls.expected.append((f"Factura_{order.pk}.pdf", f"{order.pk}|{100 * (i + 1)}|{i + 1}".encode()))
+
+    def read_zip(self, data):
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            return [(name, archive.read(name)) for name in archive.namelist()]
+
+    def test_zip_stream_keeps_payment_order_across_workers(self):
+        chunks = list(stream_invoice_zip(paid_payments(date(2026, 3, 10), date(2026, 3, 12)), workers=2))
+        self.assertGreater(len(chunks), len(self.expected))  # un bloque por factura más el cierre del ZIP
+        self.assertEqual(self.read_zip(b"".join(chunks)), self.expected)
+
+    def test_export_invoices_command_writes_the_zip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = f"{directory}/facturas.zip"
+            stdout = io.StringIO()
+            call_command("export_invoices", "2026-03-10", "2026-03-12", output=output, workers=1, stdout=stdout)
+            with open(output, "rb") as file:
+                self.assertEqual(self.read_zip(file.read()), self.expected)
+        self.assertIn("3 facturas", stdout.getvalue())
+
+
+@override_settings(MERCADO_PAGO_EMULATOR=True, PREFERENCE_CACHE_ENABLED=True)
+class CreatePaymentPreferenceTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Frutas", description="Frutas")
+        Product.objects.bulk_create([
+            Product(sku=f"SKU{i}", name=f"Producto {i}", description="-", price=100, stock=100, category=category)
+            for i in range(31)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        reset_mercadopago_sdk()
+        self.addCleanup(reset_mercadopago_sdk)
+
+    def checkout(self, dni, size):
+        """Orden pendiente con la mitad de las líneas y una línea sobrante; retorna las consultas del checkout."""
+        user = User.objects.create_user(username=f"client{dni}", email=f"{dni}@test.com", password="x", dni=dni)
+        cart = Cart.objects.create(user=user, name="Carrito", description="-")
+        order = Order.objects.create(user=user)
+        for sku in [f"SKU{i}" for i in range(0, size, 2)] + ["SKU30"]:
+            OrderProduct.objects.create(order=order, product_id=sku, price=100, quantity=1)
+            ProductCart.objects.create(cart=cart, product_id=sku, quantity=1)
+
+        items = [{"sku": f"SKU{i}", "title": f"Producto {i}", "quantity": 2, "unit_price": 100} for i in range(size)]
+        api = APIClient()
+        api.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = api.post("/api/v1/payment/preferences/", {"items": items}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["order"], order.pk)
+        self.assertEqual(dict(order.orderproduct_set.values_list("product_id", "quantity")),
+                         {item["sku"]: 2 for item in items})
+        self.assertEqual(cart.productcart_set.count(), size)
+        order.refresh_from_db()
+        self.assertEqual(order.cart_fingerprint, cart_fingerprint((item["sku"], 2) for item in items))
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_items(self):
+        self.assertEqual(self.checkout("6001", 3), self.checkout("6002", 30))
+
+    def test_unknown_products_are_rejected(self):
+        user = User.objects.create_user(username="c", email="c@test.com", password="x", dni="6003")
+        api = APIClient()
+        api.force_authenticate(user)
+        response = api.post("/api/v1/payment/preferences/",
+                            {"items": [{"sku": "NOPE", "quantity": 1, "unit_price": 1}]}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["missing_products"], ["NOPE"])
+        self.assertFalse(Order.objects.filter(user=user).exists())
+
+    def test_duplicate_skus_are_merged(self):
+        user = User.objects.create_user(username="c", email="c@test.com", password="x", dni="6005")
+        cart = Cart.objects.create(user=user, name="Carrito", description="-")
+        api = APIClient()
+        api.force_authenticate(user)
+        items = [{"sku": "SKU1", "title": "Producto 1", "quantity": 1, "unit_price": 100},
+                 {"sku": "SKU1", "title": "Producto 1", "quantity": "2", "unit_price": 100}]
+        response = api.post("/api/v1/payment/preferences/", {"items": items}, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(list(cart.productcart_set.values_list("product_id", "quantity")), [("SKU1", 3)])
+        self.assertEqual(list(OrderProduct.objects.filter(order_id=response.data["order"])
+                              .values_list("product_id", "quantity")), [("SKU1", 3)])
+
+        bad = api.post("/api/v1/payment/preferences/", {"items": [{"sku": "SKU1", "quantity": "x"}]}, format="json")
+        self.assertEqual(bad.status_code, 400)
+
+    @override_settings(MERCADO_PAGO_EMULATOR_ERROR_RATE=1.0)
+    def test_provider_failure_leaves_order_and_cart_untouched(self):
+        reset_mercadopago_sdk()
+        user = User.objects.create_user(username="c", email="c@test.com", password="x", dni="6006")
+        cart = Cart.objects.create(user=user, name="Carrito", description="-")
+        order = Order.objects.create(user=user)
+        OrderProduct.objects.create(order=order, product_id="SKU1", price=100, quantity=1)
+        ProductCart.objects.create(cart=cart, product_id="SKU1", quantity=1)
+        api = APIClient()
+        api.force_authenticate(user)
+
+        response = api.post("/api/v1/payment/preferences/",
+                            {"items": [{"sku": "SKU2", "title": "Producto 2", "quantity": 4, "unit_price": 100}]},
+                            format="json")
+        self.assertIn(response.status_code, (400, 503))
+        self.assertEqual(list(order.orderproduct_set.values_list("product_id", "quantity")), [("SKU1", 1)])
+        self.assertEqual(list(cart.productcart_set.values_list("product_id", "quantity")), [("SKU1", 1)])
+        self.assertEqual(Order.objects.filter(user=user).count(), 1)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_identical_checkout_reuses_preference(self):
+        user = User.objects.create_user(username="c", email="c@test.com", password="x", dni="6004")
+        cart = Cart.objects.create(user=user, name="Carrito", description="-")
+        ProductCart.objects.create(cart=cart, product_id="SKU1", quantity=1)
+        api = APIClient()
+        api.force_authenticate(user)
+        items = [{"sku": "SKU1", "title": "Producto 1", "quantity": 1, "unit_price": 100},
+                 {"sku": "SKU2", "title": "Producto 2", "quantity": 3, "unit_price": 100}]
+
+        first = api.post("/api/v1/payment/preferences/", {"items": items}, format="json")
+        self.assertEqual(first.status_code, 201)
+        with self.assertNumQueries(1):  # solo se confirma que la orden sigue PENDING
+            again = api.post("/api/v1/payment/preferences/", {"items": items[::-1]}, format="json")
+        self.assertEqual(again.data, first.data)
+        self.assertEqual(mercadopago_client_stats()["requests"], 1)
+
+        ProductCart.objects.filter(cart=cart, product_id="SKU1").first().delete()
+        changed = api.post("/api/v1/payment/preferences/", {"items": items}, format="json")
+        self.assertNotEqual(changed.data["preference_data"]["id"], first.data["preference_data"]["id"])
+
+        Order.objects.filter(pk=first.data["order"]).update(status="PROCESSING")
+        paid = api.post("/api/v1/payment/preferences/", {"items": items}, format="json")
+        self.assertNotEqual(paid.data["order"], first.data["order"])
+        self.assertEqual(mercadopago_client_stats()["requests"], 3)
+
+    @override_settings(PREFERENCE_CACHE_ENABLED=False)
+    def test_disabled_cache_creates_a_preference_per_checkout(self):
+        user = User.objects.create_user(username="c", email="c@test.com", password="x", dni="6005")
+        api = APIClient()
+        api.force_authenticate(user)
+        items = [{"sku": "SKU1", "title": "Producto 1", "quantity": 1, "unit_price": 100}]
+
+        first = api.post("/api/v1/payment/preferences/", {"items": items}, format="json")
+        again = api.post("/api/v1/payment/preferences/", {"items": items}, format="json")
+        self.assertEqual((first.status_code, again.status_code), (201, 200))
+        self.assertEqual(again.data["order"], first.data["order"])
+        self.assertEqual(mercadopago_client_stats()["requests"], 2)
+
+
+class CartChangeCheckTest(TestCase):
+    def test_compares_against_stored_fingerprint(self):
+        user = User.objects.create_user(username="c", email="c@test.com", password="x", dni="7000")
+        category = Category.objects.create(name="Frutas", description="Frutas")
+        for sku in ("A", "B"):
+            Product.objects.create(sku=sku, name=sku, description="-", price=1, stock=5, category=category)
+        order = Order.objects.create(user=user)
+        OrderProduct.objects.create(order=order, product_id="A", price=1, quantity=2)
+        line = OrderProduct.objects.create(order=order, product_id="B", price=1, quantity=1)
+
+        api = APIClient()
+        api.force_authenticate(user)
+        url = "/api/v1/carts/changes/check/"
+        with self.assertNumQueries(1):
+            response = api.post(url, {"items": [{"sku": "B", "quantity": 1}, {"sku": "A", "quantity": 2}]},
+                                format="json")
+        self.assertFalse(response.data["changed"])
+        fingerprint = response.data["fingerprint"]
+
+        line.quantity = 3
+        line.save()
+        self.assertTrue(api.post(url, {"fingerprint": fingerprint}, format="json").data["changed"])
+        self.assertFalse(api.post(url, {"items": [{"sku": "A", "quantity": 2}, {"sku": "B", "quantity": 3}]},
+                                  format="json").data["changed"])
+
+        line.delete()
+        self.assertFalse(api.post(url, {"items": [{"sku": "A", "quantity": 2}]}, format="json").data["changed"])
+
+
+class CartItemCreateTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="c", email="c@test.com", password="x", dni="8000")
+        category = Category.objects.create(name="Frutas", description="Frutas")
+        Product.objects.bulk_create([
+            Product(sku=f"SKU{i}", name=f"Producto {i}", description="-", price=1, stock=5, category=category)
+            for i in range(20)
+        ])
+
+    def add(self, cart, items):
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().post("/api/v1/carts/items/create/", {"data": {"cart_id": cart.name, "items": items}},
+                                        format="json")
+        self.assertEqual(response.status_code, 201)
+        return response, len(queries)
+
+    def test_increments_existing_rows_with_fixed_queries(self):
+        cart = Cart.objects.create(user=self.user, name="Carrito", description="-")
+        ProductCart.objects.create(cart=cart, product_id="SKU0", quantity=1)
+
+        response, small = self.add(cart, [{"product": "SKU0", "quantity": 2}, {"product": "SKU1", "quantity": 1},
+                                          {"product": "SKU0", "quantity": 1}])
+        self.assertEqual([(row["product"], row["quantity"]) for row in response.data], [("SKU0", 4), ("SKU1", 1)])
+
+        _, large = self.add(cart, [{"product": f"SKU{i}", "quantity": 1} for i in range(20)])
+        self.assertEqual(small, large)
+        self.assertEqual(dict(cart.productcart_set.values_list("product_id", "quantity")),
+                         {"SKU0": 5, "SKU1": 2, **{f"SKU{i}": 1 for i in range(2, 20)}})
+
+    def test_numeric_string_quantities_are_accepted(self):
+        cart = Cart.objects.create(user=self.user, name="Carrito", description="-")
+        response, _ = self.add(cart, [{"product": "SKU0", "quantity": "2"}, {"product": "SKU0", "quantity": 1}])
+        self.assertEqual([(row["product"], row["quantity"]) for row in response.data], [("SKU0", 3)])
+
+        for quantity in ("2.5", 2.5, True, None, "0", -1):
+            response = APIClient().post("/api/v1/carts/items/create/", {"data": {
+                "cart_id": cart.name, "items": [{"product": "SKU1", "quantity": quantity}]}}, format="json")
+            self.assertEqual(response.status_code, 400, quantity)
+
+    def test_product_cart_create_accepts_numeric_strings(self):
+        cart = Cart.objects.create(user=self.user, name="Carrito", description="-")
+        api = APIClient()
+        response = api.post("/api/v1/carts/products/create/", {"cart": cart.pk, "products": [
+            {"sku": "SKU0", "quantity": "2"}, {"sku": "SKU0", "quantity": 1}, {"sku": "SKU1"}]}, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(dict(cart.productcart_set.values_list("product_id", "quantity")), {"SKU0": 3, "SKU1": 1})
+
+        response = api.post("/api/v1/carts/products/create/", {"cart": cart.pk, "products": [
+            {"sku": "SKU1", "quantity": "2.5"}]}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CART_SUMMARY_CACHE_ENABLED=True)
+class CartSummaryTest(TestCase):
+    def test_totals_and_cache_invalidation(self):
+        cache.clear()
+        user = User.objects.create_user(username="c", email="c@test.com", password="x", dni="9000")
+        category = Category.objects.create(name="Frutas", description="Frutas")
+        unit = UnitOfMeasure.objects.create(unity="KG", weight=1)
+        Product.objects.create(sku="A", name="A", description="-", price=1000, stock=5, category=category,
+                               measure_unity=unit, has_discount=True, discount_price=800)
+        Product.objects.create(sku="B", name="B", description="-", price=500, stock=5, category=category)
+        cart = Cart.objects.create(user=user, name="Carrito", description="-")
+        ProductCart.objects.create(cart=cart, product_id="A", quantity=2)
+        line = ProductCart.objects.create(cart=cart, product_id="B", quantity=3)
+
+        api = APIClient()
+        api.force_authenticate(user)
+        with self.assertNumQueries(2):
+            summary = api.get("/api/v1/carts/summary/").data
+        self.assertEqual([(i["sku"], i["unit"], i["unit_price"], i["line_total"]) for i in summary["items"]],
+                         [("A", "KG", 800, 1600), ("B", None, 500, 1500)])
+        self.assertEqual((summary["total_items"], summary["total"]), (5, 3100))
+
+        with self.assertNumQueries(1):
+            api.get("/api/v1/carts/summary/", {"cart": "Carrito"})
+
+        line.delete()
+        self.assertEqual(api.get("/api/v1/carts/summary/").data["total"], 1600)
+        Product.objects.filter(sku="A").update(has_discount=False)
+        bump_catalog_version()
+        self.assertEqual(api.get("/api/v1/carts/summary/").data["total"], 2000)
+
+    @override_settings(CART_SUMMARY_CACHE_ENABLED=False)
+    def test_disabled_cache_always_reads_the_database(self):
+        cache.clear()
+        user = User.objects.create_user(username="c", email="c@test.com", password="x", dni="9010")
+        category = Category.objects.create(name="Frutas", description="Frutas")
+        Product.objects.create(sku="A", name="A", description="-", price=1000, stock=5, category=category)
+        cart = Cart.objects.create(user=user, name="Carrito", description="-")
+        ProductCart.objects.create(cart=cart, product_id="A", quantity=2)
+
+        api = APIClient()
+        api.force_authenticate(user)
+        self.assertEqual(api.get("/api/v1/carts/summary/").data["total"], 2000)
+        Product.objects.filter(sku="A").update(price=900)  # sin señales ni cambio de versión
+        with self.assertNumQueries(2):
+            self.assertEqual(api.get("/api/v1/carts/summary/").data["total"], 1800)
+
+
+@override_settings(MERCADO_PAGO_EMULATOR=True)
+class StockReservationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_mercadopago_sdk()
+        self.addCleanup(reset_mercadopago_sdk)
+        category = Category.objects.create(name="Frutas", description="Frutas")
+        self.product = Product.objects.create(sku="A", name="A", description="-", price=100, stock=5,
+                                              category=category)
+
+    def checkout(self, dni, quantity):
+        user, _ = User.objects.get_or_create(username=f"c{dni}", email=f"{dni}@test.com", dni=dni)
+        api = APIClient()
+        api.force_authenticate(user)
+        return api.post("/api/v1/payment/preferences/",
+                        {"items": [{"sku": "A", "title": "A", "quantity": quantity, "unit_price": 100}]}, format="json")
+
+    def test_shortage_found_while_reserving_rolls_back_the_order(self):
+        self.checkout("1", 4)
+        # Otra reserva entra entre el chequeo previo y la transacción de la orden
+        with mock.patch("products.payments.views.stock_shortages", return_value=[]):
+            response = self.checkout("2", 2)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data["unavailable"], [{"sku": "A", "requested": 2, "available": 1}])
+        self.assertFalse(Order.objects.filter(user__dni="2").exists())
+        self.assertFalse(ProductCart.objects.filter(cart__user__dni="2").exists())
+
+    def test_holds_block_other_checkouts_until_paid_or_expired(self):
+        first = self.checkout("1", 4)
+        self.assertEqual(first.status_code, 201)
+
+        blocked = self.checkout("2", 2)
+        self.assertEqual(blocked.status_code, 409)
+        self.assertEqual(blocked.data["unavailable"], [{"sku": "A", "requested": 2, "available": 1}])
+        self.assertFalse(Order.objects.filter(user__dni="2").exists())
+
+        Payment.objects.create(order_id=first.data["order"], payment_amount=400, payment_date=timezone.now(),
+                               payment_method="CASH", payment_status="APPROVED")
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 1)
+        self.assertFalse(StockReservation.objects.filter(order_id=first.data["order"]).exists())
+
+        self.assertEqual(self.checkout("2", 1).status_code, 201)
+        StockReservation.objects.update(expires_at=timezone.now())
+        self.assertEqual(self.checkout("3", 1).status_code, 201)
+        self.assertEqual(expire_reservations(), 1)
+
+
+class InventoryLedgerTest(TestCase):
+    def test_ledger_tracks_stock_and_snapshots_report_drift(self):
+        user = User.objects.create_user(username="c", email="c@test.com", password="x", dni="4000")
+        category = Category.objects.create(name="Frutas", description="Frutas")
+        product = Product.objects.create(sku="A", name="A", description="-", price=1, stock=5, category=category)
+        product = Product.objects.get(pk="A")
+        product.stock = 8
+        product.save()
+        order = Order.objects.create(user=user)
+        OrderProduct.objects.create(order=order, product=product, price=1, quantity=4)
+        commit_order_stock(order.pk)
+        receive_purchase("P-1", {}, {"A": 10})
+
+        self.assertEqual(
+            list(InventoryMovement.objects.order_by("id").values_list("kind", "quantity")),
+            [("ADJUSTMENT", 5), ("ADJUSTMENT", 3), ("SALE", -4), ("PURCHASE", 10)],
+        )
+        self.assertEqual(Product.objects.get(pk="A").stock, 14)
+        self.assertEqual(ledger_stock(["A"]), {"A": 14})
+
+        report = take_inventory_snapshots(now=timezone.now() + timedelta(hours=1))
+        self.assertEqual((report["snapshots"], report["drift"]), (1, []))
+        self.assertEqual(InventorySnapshot.objects.order_by("-last_movement_id").first().stock, 14)
+        with self.assertNumQueries(1):
+            self.assertEqual(ledger_stock(["A"]), {"A": 14})
+
+        Product.objects.filter(pk="A").update(stock=0)  # cambio fuera del libro
+        self.assertEqual(take_inventory_snapshots()["drift"], [{"sku": "A", "stock": 0, "ledger_stock": 14}])
+
+
+class PurchaseStockTest(TestCase):
+    def test_purchases_add_stock_in_stock_units_and_never_go_negative(self):
+        admin = User.objects.create_user(username="a", email="a@test.com", password="x", dni="4100", is_staff=True)
+        category = Category.objects.create(name="Frutas", description="Frutas")
+        bulto = UnitOfMeasure.objects.create(unity="BULTO", weight=25)
+        Product.objects.create(sku="A", name="A", description="-", price=1, stock=0, category=category)
+        api = APIClient()
+        api.force_authenticate(admin)
+
+        response = api.post("/api/v1/purchases/", {
+            "purchased_by": admin.pk, "purchase_date": "2026-01-01T00:00:00Z", "global_sell_percentage": 10,
+            "items": [{"product": "A", "quantity": 2, "purchase_price": 100, "unit_measure": bulto.pk}],
+        }, format="json")
+        self.assertEqual(response.status_code, 201)
+        purchase_id = response.data["id"]
+        self.assertEqual(Product.objects.get(pk="A").stock, 50)  # 2 bultos de 25
+
+        response = api.put("/api/v1/purchases/", {
+            "purchase_id": purchase_id,
+            "items": [{"product": "A", "quantity": 1, "purchase_price": 100, "unity": bulto.pk}],
+        }, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Product.objects.get(pk="A").stock, 25)
+
+        Product.objects.filter(pk="A").update(stock=10)  # se vendió parte de la compra
+        self.assertEqual(api.delete("/api/v1/purchases/delete/", {"purchase_id": purchase_id}, format="json")
+                         .status_code, 204)
+        self.assertEqual(Product.objects.get(pk="A").stock, 0)
+        self.assertEqual(list(InventoryMovement.objects.order_by("id").values_list("quantity", flat=True)),
+                         [50, -25, -10])
+
+
+class PurchaseItemsTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username="a", email="a@test.com", password="x", dni="4150", is_staff=True)
+        category = Category.objects.create(name="Frutas", description="Frutas")
+        self.kilo = UnitOfMeasure.objects.create(unity="KG", weight=1)
+        for sku in ("123", "A", "B"):
+            Product.objects.create(sku=sku, name=sku, description="-", price=1, stock=0, category=category)
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+
+    def create(self, items):
+        return self.api.post("/api/v1/purchases/", {
+            "purchased_by": self.admin.pk, "purchase_date": "2026-01-01T00:00:00Z", "global_sell_percentage": 10,
+            "items": items,
+        }, format="json")
+
+    def test_numeric_skus_resolve_and_unknown_references_are_reported_together(self):
+        response = self.create([{"product": 123, "quantity": 1, "purchase_price": 10, "unit_measure": self.kilo.pk}])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["purchase_items"][0]["product"]["sku"], "123")
+
+        response = self.create([
+            {"product": "X", "quantity": 1, "purchase_price": 10, "unit_measure": self.kilo.pk},
+            {"product": 456, "quantity": 1, "purchase_price": 10, "unit_measure": 999},
+            {"product": "A", "quantity": 1, "purchase_price": 10, "unit_measure": "abc"},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((response.data["missing_products"], response.data["missing_unit_measures"]),
+                         (["456", "X"], ["999", "abc"]))
+        self.assertEqual(Purchase.objects.count(), 1)
+
+    def test_update_only_touches_changed_items(self):
+        purchase = Purchase.objects.create(id="C1", purchased_by=self.admin, purchase_date=timezone.now())
+        a, b = PurchaseItem.objects.bulk_create([
+            PurchaseItem(purchase=purchase, product_id=sku, quantity=1, purchase_price=10, sell_percentage=10,
+                         unit_measure=self.kilo)
+            for sku in ("A", "B")
+        ])
+        with mock.patch.object(PurchaseItem.objects, "bulk_update", wraps=PurchaseItem.objects.bulk_update) as update, \
+                mock.patch.object(PurchaseItem.objects, "bulk_create", wraps=PurchaseItem.objects.bulk_create) as create:
+            response = self.api.put("/api/v1/purchases/", {"purchase_id": purchase.pk, "items": [
+                {"product": "A", "quantity": 3, "purchase_price": 10, "unity": self.kilo.pk},
+                {"product": "B", "quantity": 1, "purchase_price": 10, "unity": self.kilo.pk},
+            ]}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item.pk for item in update.call_args.args[0]], [a.pk])
+        create.assert_not_called()
+        self.assertEqual(dict(purchase.purchase_items.values_list("id", "quantity")), {a.pk: 3, b.pk: 1})
+
+
+class PurchaseListQueryCountTest(TestCase):
+    """El listado de compras ejecuta una cantidad fija de consultas sin importar compras ni items."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(username="a", email="a@test.com", password="x", dni="4200", is_staff=True)
+        category = Category.objects.create(name="Frutas", description="Frutas")
+        kilo = UnitOfMeasure.objects.create(unity="KG", weight=1)
+        bulto = UnitOfMeasure.objects.create(unity="BULTO", weight=25)
+        products = [
+            Product.objects.create(sku=f"SKU{i}", name=f"Producto {i}", description="-", price=1000, stock=10,
+                                   category=category, measure_unity=kilo)
+            for i in range(4)
+        ]
+        for i in range(8):
+            purchase = Purchase.objects.create(id=f"C{i}", purchased_by=cls.admin, purchase_date=timezone.now())
+            PurchaseItem.objects.bulk_create([
+                PurchaseItem(purchase=purchase, product=product, quantity=2, purchase_price=500,
+                             unit_measure=bulto if j % 2 else kilo)
+                for j, product in enumerate(products)
+            ])
+
+    def test_purchase_list_query_count(self):
+        api = APIClient()
+        api.force_authenticate(self.admin)
+        # COUNT + compras + items con producto/categoría/unidad y unidad de compra
+        with self.assertNumQueries(3):
+            response = api.get("/api/v1/purchases/list/?limit=50")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 8)
+        self.assertEqual(len(response.data["results"][0]["purchase_items"]), 4)
+
+
+class RecomputeMissingItemsTest(TestCase):
+    def test_upserts_shortfalls_and_deletes_stale_rows(self):
+        user = User.objects.create_user(username="c", email="c@test.com", password="x", dni="9150")
+        category = Category.objects.create(name="Frutas", description="Frutas")
+        a = Product.objects.create(sku="A", name="A", description="-", price=1, stock=5, category=category)
+        b = Product.objects.create(sku="B", name="B", description="-", price=1, stock=0, category=category)
+        first, second = Order.objects.create(user=user), Order.objects.create(user=user)
+        delivered = Order.objects.create(user=user, status="DELIVERED")
+        OrderProduct.objects.bulk_create([
+            OrderProduct(order=first, product=a, price=1, quantity=4),
+            OrderProduct(order=first, product=a, price=1, quantity=3),  # las líneas repetidas se suman
+            OrderProduct(order=first, product=b, price=1, quantity=1),
+            OrderProduct(order=second, product=a, price=1, quantity=2),
+            OrderProduct(order=delivered, product=a, price=1, quantity=10),
+        ])
+        kept = MissingItems.objects.create(order=first, product=a, stock=9, missing_quantity=9)
+        MissingItems.objects.create(order=second, product=a, stock=0, missing_quantity=2)
+
+        self.assertEqual(recompute_missing_items(), (2, 1))
+        self.assertEqual(
+            set(MissingItems.objects.values_list("order_id", "product_id", "stock", "missing_quantity")),
+            {(first.pk, "A", 5, 2), (first.pk, "B", 0, 1)},
+        )
+        self.assertTrue(MissingItems.objects.filter(pk=kept.pk, missing_quantity=2).exists())  # actualizado en su lugar
+
+        Product.objects.filter(pk="B").update(stock=5)
+        Product.objects.filter(pk="A").update(stock=0)
+        self.assertEqual(recompute_missing_items(skus=["B"]), (0, 1))
+        self.assertEqual(list(MissingItems.objects.values_list("product_id", "missing_quantity")), [("A", 2)])
+
+
+class MissingItemsDedupMigrationTest(TransactionTestCase):
+    """La migración 0011 conserva solo el registro más reciente por (orden, producto)."""
+
+    before = [("products", "0010_idsequence")]
+    after = [("products", "0011_missingitems_unique_order_product")]
+
+    def setUp(self):
+        self.executor = MigrationExecutor(connection)
+        self.executor.migrate(self.before)
+        self.addCleanup(self.migrate_to_latest)
+
+    def migrate_to_latest(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_duplicates_are_removed_before_adding_the_constraint(self):
+        apps = self.executor.loader.project_state(self.before).apps
+        user = apps.get_model("users", "User").objects.create(username="c", email="c@test.com", dni="9160")
+        product = apps.get_model("products", "Product").objects.create(sku="A", name="A", description="-",
+                                                                       price=1, stock=0)
+        order = apps.get_model("products", "Order").objects.create(id="ECCAA09160", user=user)
+        other = apps.get_model("products", "Order").objects.create(id="ECCAB09160", user=user)
+        MissingItems = apps.get_model("products", "MissingItems")
+        rows = [MissingItems.objects.create(order=order, product=product, missing_quantity=quantity)
+                for quantity in (1, 2, 3)]
+        single = MissingItems.objects.create(order=other, product=product, missing_quantity=4)
+
+        self.executor.loader.build_graph()
+        self.executor.migrate(self.after)
+
+        MissingItems = self.executor.loader.project_state(self.after).apps.get_model("products", "MissingItems")
+        self.assertEqual(sorted(MissingItems.objects.values_list("id", "missing_quantity")),
+                         [(rows[-1].pk, 3), (single.pk, 4)])
+
+
+@override_settings(SHOPPING_LIST_CACHE_ENABLED=True)
+class MissingItemsShoppingListTest(TestCase):
+    def test_groups_shortfalls_by_sku_and_unit(self):
+        cache.clear()
+        admin = User.objects.create_user(username="a", email="a@test.com", password="x", dni="9100", is_staff=True)
+        category = Category.objects.create(name="Frutas", description="Frutas")
+        bulto = UnitOfMeasure.objects.create(unity="BULTO", weight=25)
+        a = Product.objects.create(sku="A", name="A", description="-", price=1, stock=10, category=category,
+                                   measure_unity=bulto)
+        b = Product.objects.create(sku="B", name="B", description="-", price=1, stock=0, category=category)
+        first, second = Order.objects.create(user=admin), Order.objects.create(user=admin)
+        OrderProduct.objects.bulk_create([
+            OrderProduct(order=first, product=a, price=1, quantity=20),
+            OrderProduct(order=second, product=a, price=1, quantity=30),
+            OrderProduct(order=second, product=b, price=1, quantity=5),
+        ])
+        with self.captureOnCommitCallbacks(execute=True):
+            recompute_missing_items()
+
+        api = APIClient()
+        api.force_authenticate(admin)
+        with self.assertNumQueries(1):
+            shopping_list = api.get("/api/v1/purchases/missing-items/shopping-list/").data
+        self.assertEqual(
+            [(i["sku"], i["missing_quantity"], i["unit"], i["units_to_buy"], i["orders"]) for i in shopping_list["items"]],
+            [("A", 40, "BULTO", 2, 2), ("B", 5, None, None, 1)],
+        )
+        with self.assertNumQueries(0):
+            api.get("/api/v1/purchases/missing-items/shopping-list/")
+
+        detail = api.get("/api/v1/purchases/missing-items/shopping-list/", {"orders": "true"}).data
+        self.assertEqual(detail["items"][0]["order_detail"],
+                         [{"order": first.pk, "missing_quantity": 10}, {"order": second.pk, "missing_quantity": 20}])
+
+        OrderProduct.objects.filter(product=b).delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            recompute_missing_items()
+        self.assertEqual(api.get("/api/v1/purchases/missing-items/shopping-list/").data["total_skus"], 1)
+
+    @override_settings(SHOPPING_LIST_CACHE_ENABLED=False)
+    def test_disabled_cache_always_reads_the_database(self):
+        cache.clear()
+        admin = User.objects.create_user(username="a", email="a@test.com", password="x", dni="9110", is_staff=True)
+        category = Category.objects.create(name="Frutas", description="Frutas")
+        product = Product.objects.create(sku="A", name="A", description="-", price=1, stock=0, category=category)
+        order = Order.objects.create(user=admin)
+        MissingItems.objects.create(order=order, product=product, stock=0, missing_quantity=5)
+
+        api = APIClient()
+        api.force_authenticate(admin)
+        self.assertEqual(api.get("/api/v1/purchases/missing-items/shopping-list/").data["total_skus"], 1)
+        MissingItems.objects.all().delete()  # otro proceso recalculó: la versión local no cambió
+        self.assertEqual(api.get("/api/v1/purchases/missing-items/shopping-list/").data["total_skus"], 0)
+
+
+class ReorderSuggestionsTest(TestCase):
+    def test_seasonal_forecast_and_suggestion_per_unit(self):
+        user = User.objects.create_user(username="a", email="a@test.com", password="x", dni="9200", is_staff=True)
+        category = Category.objects.create(name="Frutas", description="Frutas")
+        bulto = UnitOfMeasure.objects.create(unity="BULTO", weight=10)
+        product = Product.objects.create(sku="A", name="A", description="-", price=1, stock=3, category=category,
+                                         measure_unity=bulto)
+        end = timezone.localdate() - timedelta(days=1)
+        # Se vende 7 los días de la semana que coinciden con el primer día pronosticado, 0 el resto
+        for days_ago, order_status in ((6, "DELIVERED"), (13, "DELIVERED"), (2, "PENDING")):
+            order = Order.objects.create(user=user, status=order_status)
+            OrderProduct.objects.create(order=order, product=product, price=1, quantity=7)
+            Order.objects.filter(pk=order.pk).update(creation_date=timezone.now() - timedelta(days=days_ago + 1))
+        purchase = Purchase.objects.create(id="C1", purchased_by=user,
+                                           purchase_date=timezone.now() - timedelta(days=20))
+        PurchaseItem.objects.create(purchase=purchase, product=product, quantity=1, purchase_price=300,
+                                    unit_measure=bulto)  # 300 por bulto de 10
+
+        matrix = demand_matrix(days=14, end=end)
+        self.assertEqual((matrix.shape, matrix.to_numpy().sum()), ((1, 14), 14))
+
+        [row] = reorder_suggestions(horizon=7, window=14, weeks=2, safety_days=2, days=14, end=end)
+        self.assertEqual(
+            (row["forecast"], row["moving_average"], row["safety_stock"], row["suggested_quantity"],
+             row["unit"], row["units_to_buy"], row["estimated_cost"]),
+            (7, 1, 2, 6, "BULTO", 1, 300),
+        )
+
+        api = APIClient()
+        api.force_authenticate(user)
+        self.assertEqual(api.get("/api/v1/analytics/reorder-suggestions/", {"horizon": "x"}).status_code, 400)
+        self.assertEqual(api.get("/api/v1/analytics/reorder-suggestions/").data["items"], [])  # 8 semanas: alcanza
+        self.assertEqual(len(api.get("/api/v1/analytics/reorder-suggestions/", {"all": "true"}).data["items"]), 1)
+
+
+class MarginRollupTest(TestCase):
+    def sell(self, user, quantity):
+        order = Order.objects.create(user=user, status="PROCESSING")
+        OrderProduct.objects.create(order=order, product_id="A", price=200, quantity=quantity)
+        commit_order_stock(order.pk)
+        return order
+
+    def test_fifo_and_average_margins_refresh_incrementally(self):
+        later = timezone.now() + timedelta(hours=1)
+        user = User.objects.create_user(username="a", email="a@test.com", password="x", dni="9300", is_staff=True)
+        category = Category.objects.create(name="Frutas", description="Frutas")
+        Product.objects.create(sku="A", name="A", description="-", price=200, stock=0, category=category)
+        canastilla = UnitOfMeasure.objects.create(unity="CANASTILLA", weight=5)
+        # 2 canastillas de 5 unidades: 500 y 650 por canastilla son 100 y 130 por unidad de stock
+        for purchase_id, cost in (("P1", 500), ("P2", 650)):
+            purchase = Purchase.objects.create(id=purchase_id, purchased_by=user)
+            PurchaseItem.objects.create(purchase=purchase, product_id="A", quantity=2, purchase_price=cost,
+                                        unit_measure=canastilla)
+            receive_purchase(purchase_id, {}, purchase_quantities(purchase_id))
+        self.sell(user, 15)
+
+        self.assertEqual(refresh_margin_rollups("FIFO", now=later), 3)
+        self.assertEqual(refresh_margin_rollups("AVERAGE", now=later), 3)
+        [fifo] = margin_report("FIFO", group_by="total")
+        [average] = margin_report("AVERAGE", group_by="total")
+        self.assertEqual((fifo["revenue"], fifo["cogs"], fifo["margin"]), (3000, 1650, 1350))  # 10 x 100 + 5 x 130
+        self.assertEqual(average["cogs"], 1725)  # 15 x 115
+
+        self.sell(user, 5)
+        self.assertEqual(refresh_margin_rollups("FIFO", now=timezone.now() - timedelta(hours=1)), 0)  # aún no asentado
+        self.assertEqual(refresh_margin_rollups("FIFO", now=later), 1)
+        self.assertEqual(MarginRollup.objects.filter(method="FIFO").count(), 1)
+
+        api = APIClient()
+        api.force_authenticate(user)
+        [row] = api.get("/api/v1/analytics/margins/", {"group_by": "category", "method": "fifo"}).data["items"]
+        self.assertEqual((row["category"], row["quantity_sold"], row["cogs"], row["margin_pct"]), ("Frutas", 20, 2300, 42.5))
+
+    def test_refunded_sale_is_taken_out_of_the_period(self):
+        later = timezone.now() + timedelta(hours=1)
+        user = User.objects.create_user(username="a", email="a@test.com", password="x", dni="9400")
+        category = Category.objects.create(name="Frutas", description="Frutas")
+        Product.objects.create(sku="A", name="A", description="-", price=200, stock=0, category=category)
+        purchase = Purchase.objects.create(id="P1", purchased_by=user)
+        PurchaseItem.objects.create(purchase=purchase, product_id="A", quantity=20, purchase_price=100)
+        receive_purchase("P1", {}, purchase_quantities("P1"))
+        self.sell(user, 5)
+        refunded = self.sell(user, 10)
+        reverse_order_processing(refunded.pk)
+
+        for method in ("FIFO", "AVERAGE"):
+            refresh_margin_rollups(method, now=later)
+            [total] = margin_report(method, group_by="total")
+            self.assertEqual((total["quantity_sold"], total["revenue"], total["cogs"]), (5, 1000, 500))
+
+
+class ProductImportTest(TestCase):
+    HEADER = "sku,name,price,stock,category\n"
+
+    def setUp(self):
+        Category.objects.create(name="Frutas", description="Frutas")
+        Product.objects.create(sku="OLD", name="Pera", description="-", price=1, stock=1,
+                               category=Category.objects.get())
+
+    def upload(self, body):
+        admin = User.objects.create_user(username="a", email="a@test.com", password="x", dni="9400", is_staff=True)
+        api = APIClient()
+        api.force_authenticate(admin)
+        file = SimpleUploadedFile("productos.csv", (self.HEADER + body).encode(), content_type="text/csv")
+        return api.post("/api/v1/products/import/", {"file": file}, format="multipart")
+
+    def test_valid_rows_are_saved_and_bad_rows_reported(self):
+        response = self.upload("A,Mango,100,5,frutas\nOLD,Pera,200,3,Frutas\nB,Kiwi,abc,1,Frutas\nC,Uva,1,1,Carnes\n")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data["created"], response.data["updated"]), (1, 1))
+        self.assertEqual([(error["row"], sorted(error["errors"])) for error in response.data["errors"]],
+                         [(4, ["price"]), (5, ["category"])])
+        self.assertEqual(dict(Product.objects.values_list("sku", "stock")), {"A": 5, "OLD": 3})
+
+    def test_duplicate_names_in_the_file_are_rejected(self):
+        response = self.upload("A,Mango,100,5,Frutas\nB,Mango,100,5,Frutas\nC,Pera,1,1,Frutas\n"
+                               "D,Lima,1,1,Frutas\nD,Limon,1,1,Frutas\nE,Lima,1,1,Frutas\n")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(error["row"], error["sku"]) for error in response.data["errors"]], [(3, "B"), (4, "C")])
+        # D se renombró a Limon en la última fila, así Lima queda libre para E
+        self.assertEqual(dict(Product.objects.exclude(sku="OLD").values_list("sku", "name")),
+                         {"A": "Mango", "D": "Limon", "E": "Lima"})
+
+    def test_rejected_chunk_is_reported_without_aborting_the_import(self):
+        rows = "A,Mango,1,1,Frutas\nB,Kiwi,1,1,Frutas\nC,Uva,1,1,Frutas\nD,Lima,1,1,Frutas\n"
+        with mock.patch("products.imports.importer.record_movements",
+                        side_effect=[[], IntegrityError("constraint failed"), [], []]):
+            report = import_products(io.BytesIO((self.HEADER + rows).encode()), "productos.csv", chunk_size=1)
+        self.assertEqual(report["created"], 3)
+        self.assertEqual([(error["row"], error["sku"], list(error["errors"])) for error in report["errors"]],
+                         [(3, "B", ["chunk"])])
+        self.assertFalse(Product.objects.filter(sku="B").exists())
+
+
+class ExportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(username="a", email="a@test.com", password="x", dni="9600", is_staff=True)
+        category = Category.objects.create(name="Frutas", description="Frutas")
+        a = Product.objects.create(sku="A", name="Mango", description="-", price=100, stock=5, category=category)
+        b = Product.objects.create(sku="B", name="Kiwi", description="-", price=50, stock=0, category=category)
+        cls.pending = Order.objects.create(user=cls.admin)
+        cls.cancelled = Order.objects.create(user=cls.admin, status="CANCELLED")
+        OrderProduct.objects.bulk_create([
+            OrderProduct(order=cls.pending, product=a, price=100, quantity=2),
+            OrderProduct(order=cls.pending, product=b, price=50, quantity=1),
+            OrderProduct(order=cls.cancelled, product=a, price=100, quantity=1),
+        ])
+
+    def export(self, dataset, file_format, **params):
+        api = APIClient()
+        api.force_authenticate(self.admin)
+        response = api.get(f"/api/v1/exports/{dataset}/{file_format}/", params)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content)
+
+    def test_invalid_dates_are_rejected(self):
+        api = APIClient()
+        api.force_authenticate(self.admin)
+        for value in ("2024-02-30", "30/01/2024"):
+            response = api.get("/api/v1/exports/orders/csv/", {"date_from": value})
+            self.assertEqual(response.status_code, 400, value)
+            self.assertEqual(response.data["message"], "date_from must be a valid date (YYYY-MM-DD)")
+
+    def test_csv_has_header_and_one_row_per_order_line(self):
+        rows = list(csv.reader(io.StringIO(self.export("orders", "csv", status="pending").decode())))
+        self.assertEqual(rows[0][:3], ["id", "user_id", "status"])
+        self.assertEqual(rows[0][-1], "line_total")
+        self.assertEqual([(row[0], row[7], row[-1]) for row in rows[1:]],
+                         [(self.pending.pk, "A", "200.0"), (self.pending.pk, "B", "50.0")])
+
+    def test_ndjson_has_one_object_per_row(self):
+        rows = [json.loads(line) for line in self.export("products", "ndjson").decode().splitlines()]
+        self.assertEqual([(row["sku"], row["name"], row["category__name"], row["stock"]) for row in rows],
+                         [("A", "Mango", "Frutas", 5), ("B", "Kiwi", "Frutas", 0)])
+
+    def test_xlsx_has_header_and_rows(self):
+        workbook = load_workbook(io.BytesIO(self.export("orders", "xlsx")), read_only=True)
+        rows = list(workbook.active.iter_rows(values_only=True))
+        self.assertEqual(rows[0][:3], ("id", "user_id", "status"))
+        self.assertEqual([(row[0], row[2], row[7]) for row in rows[1:]],
+                         [(self.pending.pk, "PENDING", "A"), (self.pending.pk, "PENDING", "B"),
+                          (self.cancelled.pk, "CANCELLED", "A")])
+        self.assertIsInstance(rows[1][3], datetime)
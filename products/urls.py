@@ -1,10 +1,13 @@
 from django.urls import path
 
+from products.analytics.views import MarginReportView, ReorderSuggestionsView
+from products.imports.views import ProductImportView
+from products.exports.views import ExportView
 from products.shipments.views import ShipmentCreateView, ShipmentListView, ShipmentUpdateView
 from products.purchases.views import PurchaseCreateUpdateView, PurchaseDeleteView, PurchaseListView, PurchaseDetailView, \
-    RetrieveMissingItemsView
+    RetrieveMissingItemsView, MissingItemsShoppingListView
 from .payments.views import CreatePaymentPreference, MercadoPagoPaymentView, PaymentDetailsViewView, \
-    PaymentCreateView, GenerateSalesReportView
+    PaymentCreateView, GenerateSalesReportView, GenerateSalesReportBatchView, MercadoPagoClientStatsView, MercadoPagoWebhookView
 from .views import (
     ProductCreateView,
     ProductListView,
@@ -16,7 +19,7 @@ from .views import (
     CouponDeleteView,
     CouponsAdminRetrieveView,
     CouponCodeCheckView,
-    UnitOfMeasureView, RetrieveLatestProducts,
+    UnitOfMeasureView, RetrieveLatestProducts, CatalogCacheStatsView,
 
 )
 from products.categories.views import (
@@ -28,7 +31,7 @@ from products.categories.views import (
 from products.carts.views import (
     CartCreateView,
     CartUserListView,
-    CartUserDelete, CartItemCreateView, CartExistView,
+    CartUserDelete, CartItemCreateView, CartExistView, CartSummaryView,
 )
 
 from products.orders.views import (
@@ -61,10 +64,13 @@ urlpatterns = [
     path("products/product/details/", ProductDetailsView.as_view()), #retrieve a single products
     path("products/product/update/", ProductUpdateView.as_view()),
     path("products/product/remove/", ProductRemoveView.as_view()), # remove a single product
+    path("products/cache/stats/", CatalogCacheStatsView.as_view()), # catalog cache hit/miss counters
+    path("products/import/", ProductImportView.as_view()), # bulk create/update products from CSV/XLSX
 
     #------------------------ carts endpoints -----------------------------
     path("carts/create/", CartCreateView.as_view()), #create carts
     path("carts/items/create/", CartItemCreateView.as_view()), #cart item create view
+    path("carts/summary/", CartSummaryView.as_view()), # lines with effective prices and cart total
     path("carts/",  CartUserListView.as_view()), #list all carts of some user
     path("carts/delete/", CartUserDelete.as_view()), #remove a unique cart
     path("carts/check/", CartExistView.as_view()), #remove a unique cart
@@ -106,6 +112,9 @@ urlpatterns = [
     path("payment/process/", PaymentCreateView.as_view()),
     path("payment/preferences/", CreatePaymentPreference.as_view()),
     path("process_payment/", MercadoPagoPaymentView.as_view()),
+    path("payment/mercadopago/stats/", MercadoPagoClientStatsView.as_view()), # shared client metrics
+    path("payment/mercadopago/webhook/", MercadoPagoWebhookView.as_view()), # provider notifications
+    path("sales-report/batch/", GenerateSalesReportBatchView.as_view()), # ZIP with every invoice in a date range
     path("sales-report/<str:order_id>/", GenerateSalesReportView.as_view(), name="sales-report"),
 
 
@@ -115,6 +124,14 @@ urlpatterns = [
     path("purchases/list/", PurchaseListView.as_view(), name="purchase-list"),  # Retrieve all purchases
     path("purchases/details/<str:id>/", PurchaseDetailView.as_view(), name="purchase-detail"),
     path("purchases/missing-items/", RetrieveMissingItemsView.as_view()),
+    path("purchases/missing-items/shopping-list/", MissingItemsShoppingListView.as_view()), # shortfalls grouped by SKU
+
+    #------------------------------------ Analytics -----------------------------
+    path("analytics/reorder-suggestions/", ReorderSuggestionsView.as_view()), # demand forecast and what to buy
+    path("analytics/margins/", MarginReportView.as_view()), # realized margin per SKU/category and period
+
+    #------------------------------------ Exports -------------------------------
+    path("exports/<str:dataset>/<str:file_format>/", ExportView.as_view()), # stream products/orders/purchases/missing-items
 
     path("units-of-measure/", UnitOfMeasureView.as_view()), #Only GET Method to retrieve all measure units
     path("units-of-measure/create/", UnitOfMeasureView.as_view()), #Only POST Method
@@ -5,6 +5,8 @@ from rest_framework.views import APIView, Response
 from rest_framework import status
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.pagination import LimitOffsetPagination
+from .pagination import get_list_paginator
+from .cache import get_or_build, catalog_cache_stats
 from .models import Category, Product, Coupon, UnitOfMeasure
 from .permissions import AdminPermissions
 from .serializers import (
@@ -116,11 +118,15 @@ class ProductCreateView(APIView):
 class ProductListView(APIView):
     def get(self, request):
         try:
-            queryset = Product.objects.all()
-            paginator = LimitOffsetPagination()
-            paginated_queryset = paginator.paginate_queryset(queryset, request)
-            serializer = ProductSerializer(paginated_queryset, many= True)
-            return paginator.get_paginated_response(serializer.data)
+            def build_page():
+                queryset = Product.objects.select_related("category", "measure_unity")
+                paginator = get_list_paginator(request, ordering=("sku",))
+                paginated_queryset = paginator.paginate_queryset(queryset, request)
+                serializer = ProductSerializer(paginated_queryset, many= True)
+                return paginator.get_paginated_response(serializer.data).data
+
+            data = get_or_build("products:list", [request.build_absolute_uri()], build_page)
+            return Response(data, status = status.HTTP_200_OK)
         except Exception as e:
             return Response({"message": str(e)}, status = status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -128,11 +134,15 @@ class ProductListView(APIView):
 class RetrieveLatestProducts(ListAPIView):
     def get(self, request):
         try:
-            queryset = Product.objects.filter(recommended=True)[:3]
-            paginator = LimitOffsetPagination()
-            paginated_queryset = paginator.paginate_queryset(queryset, request)
-            serializer = ProductSerializer(paginated_queryset, many=True)
-            return paginator.get_paginated_response(serializer.data)
+            def build_page():
+                queryset = Product.objects.filter(recommended=True).select_related("category", "measure_unity")[:3]
+                paginator = LimitOffsetPagination()
+                paginated_queryset = paginator.paginate_queryset(queryset, request)
+                serializer = ProductSerializer(paginated_queryset, many=True)
+                return paginator.get_paginated_response(serializer.data).data
+
+            data = get_or_build("products:latest", [request.build_absolute_uri()], build_page)
+            return Response(data, status = status.HTTP_200_OK)
         except Exception as e:
             return Response({"message": str(e)}, status = status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -147,9 +157,12 @@ class ProductDetailsView(APIView):
             return Response({"message":"Sku is required"}, status = status.HTTP_400_BAD_REQUEST)
         
         try:
-            product = Product.objects.get(sku = sku)
-            serializer = ProductSerializer(product)
-            return Response(serializer.data, status = status.HTTP_200_OK)
+            def build_product():
+                product = Product.objects.select_related("category", "measure_unity").get(sku = sku)
+                return ProductSerializer(product).data
+
+            data = get_or_build("products:detail", [sku], build_product)
+            return Response(data, status = status.HTTP_200_OK)
 
         except Product.DoesNotExist:
             return Response({"message": f"Product with SKU {sku}"}, status = status.HTTP_400_BAD_REQUEST)
@@ -159,6 +172,17 @@ class ProductDetailsView(APIView):
             return Response({"message" : str(e)}, status = status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class CatalogCacheStatsView(APIView):
+    """
+    Return hit/miss counters and the current version of the catalog cache.
+    Only accessible to admin users.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(catalog_cache_stats(), status=status.HTTP_200_OK)
+
+
 #update a single product
 class ProductUpdateView(APIView):
     #permission_classes = [IsAuthenticated, IsAdminUser]
@@ -3,7 +3,7 @@ from rest_framework import status, generics
 from rest_framework_simplejwt.views import  TokenObtainPairView, TokenRefreshView
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
-from rest_framework.pagination import LimitOffsetPagination
+from products.pagination import get_list_paginator
 
 from .permissions import IsOwnerOrSuperUserPermission
 from .serializers import UserSerializer, CustomTokenObtainPairSerializer, CommentSerializer, ChangePasswordSerializer
@@ -114,7 +114,7 @@ class ClientUserListView(APIView):
     def get(self, request):
         try:
             queryset = User.objects.filter(rol="Cliente")
-            paginator = LimitOffsetPagination()
+            paginator = get_list_paginator(request, ordering=("dni",))
             paginated_queryset = paginator.paginate_queryset(queryset, request)
             serializer = UserSerializer(paginated_queryset, many=True)
             return paginator.get_paginated_response(serializer.data)